@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Micro benchmarks for the value storage of Records
+# python bench.py [-n 1000 10000 100000] [-r 5]
+
+import argparse, random, timeit
+from datetime import datetime, timedelta
+
+from primitives.vcolumns import vcolumns
+from primitives.vlist import vlist
+from variables.record import Record
+from variables.value import Value
+from variables.var import ValueFilter, Var
+
+
+def sample_values(n: int, seed: int = 0) -> list[Value]:
+    rnd = random.Random(seed)
+    start = datetime(2000, 1, 1)
+    return [Value(rnd.randint(50, 300), date=start + timedelta(minutes=rnd.randint(0, 12_000_000))) for _ in range(n)]
+
+
+def legacy_sort(values):
+    # sorting as vlist did before the presorted path: through ValueDate.__lt__
+    return list(sorted(values, key=lambda v: v.date, reverse=True))
+
+
+def bench_record_copy(values, repeat):
+    """HealthContext record, then the SufficiencyEvaluator copy of it"""
+    var = Var('LDL')
+    legacy = lambda: legacy_sort(legacy_sort(values))
+    current = lambda: Record(var, Record(var, values).values)
+    return min(timeit.repeat(legacy, number=1, repeat=repeat)), min(timeit.repeat(current, number=1, repeat=repeat))
+
+
+def bench_append(values, repeat):
+    """20 new values added to a sorted history"""
+    base = vlist(values)
+    new = sample_values(20, seed=1)
+    def legacy():
+        lst = list(base)
+        for v in new:
+            lst = legacy_sort(lst + [v])
+    def current():
+        lst = vlist(base)
+        for v in new:
+            lst.insort(v)
+    return min(timeit.repeat(legacy, number=1, repeat=repeat)), min(timeit.repeat(current, number=1, repeat=repeat))
+
+
+def bench_window(values, repeat):
+    """latest 10% of the values, 100 times"""
+    base = vlist(values)
+    k = len(base) // 10
+    legacy = lambda: [vlist(base[:k]) for _ in range(100)]
+    current = lambda: [base.view(0, k) for _ in range(100)]
+    return min(timeit.repeat(legacy, number=1, repeat=repeat)), min(timeit.repeat(current, number=1, repeat=repeat))
+
+
+def bench_filter(values, repeat):
+    """value filter `after: 365, expression: ' > 175'` as in persistence style variables"""
+    base = vlist(values)
+    columns = vcolumns.from_values(values)
+    vf = ValueFilter(after=365 * 5, value_expression=' > 175')
+    def legacy():
+        after = vf.after_date
+        return [v for v in base if v.date.dt >= after and eval(str(v.value) + vf.value_expression)]
+    current = lambda: vf.apply(columns)
+    return min(timeit.repeat(legacy, number=1, repeat=repeat)), min(timeit.repeat(current, number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser('bench')
+    parser.add_argument('-n', dest='sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('-r', dest='repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"benchmark":<14}{"values":>8}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+    for n in args.sizes:
+        values = sample_values(n)
+        for name, bench in (('record copy', bench_record_copy), ('append 20', bench_append), ('window x100', bench_window), ('filter', bench_filter)):
+            before, after = bench(values, args.repeat)
+            print(f'{name:<14}{n:>8}{before * 1000:>12.2f}{after * 1000:>12.2f}{before / after:>9.1f}x')
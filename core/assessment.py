@@ -2,15 +2,18 @@
 
 from dataclasses import dataclass, field
 from datetime import datetime
+from functools import cached_property
 import logging
 from typing import Any, Protocol
 
 
 
 from .expression import Expression
+from .dependency import DependencyGraph
 from .evaluation import EvaluatedRecord, EvaluationContext, EvaluationResult, SufficiencyResultStatus
 from primitives.errors import VariableEvaluationError
 from primitives.types import Persona 
+from primitives.varstring import CompiledExpression
 from primitives.vlist import vlist
 from variables import record, var, value
 
@@ -37,6 +40,15 @@ class AssessmentVar(var.Var):
     def __hash__(self):
         return hash(self.__repr__)
 
+    @cached_property
+    def compiled_expression(self):
+        return CompiledExpression.compile(self.expression) if self.expression else None
+
+    @cached_property
+    def evaluator(self) -> Expression:
+        """`Expression` shared by every record of this variable"""
+        return Expression(self.compiled_expression) if self.expression else None
+
     @classmethod
     def instantiate_from_yaml(cls, yml):
         return super(AssessmentVar, cls).instantiate_from_yaml(yml)
@@ -45,25 +57,24 @@ class AssessmentVar(var.Var):
 class AssessmentRecord(record.Record):
 
     var: AssessmentVar
-    __expression: Expression = field(init=False)
     __assessed_value: value.Value = None
 
     def __post_init__(self):
         super().__post_init__()
-        
-        self.__expression = Expression(self.var.expression) if self.var.expression else None
         self.__assessed_value = None
-        # return 
 
     @property 
     def expression(self):
-        return self.__expression if self.__expression else None
+        return self.var.evaluator
 
-    def evaluate(self, records, persona: Persona = Persona.patient, functions_module=None):
+    def evaluate(self, records, persona: Persona = Persona.patient, functions_module=None, as_of: datetime = None):
+        """records: list of `Record` or a name table (id -> Record)
+        as_of: evaluation date, dates the assessed value; now if not given"""
 
-        record_dict = {r.id: r.value if r.value else None for r in records}
+        records = record.record_table(records)
         try:
             if self.var.function:
+                record_dict = {rid: r.value if r.value else None for rid, r in records.items()}
                 func = getattr(functions_module, self.var.function)
                 result = func(record_dict)
                 if result == None:
@@ -71,14 +82,12 @@ class AssessmentRecord(record.Record):
                     raise ve 
                 else:
 
-                    self.__assessed_value = value.Value(result)
+                    self.__assessed_value = value.Value(result, date=as_of)
 
 
-            elif self.__expression:
-                result = self.__expression.evaluate(records)
-                if result:
-                    # already result is a value.Value type
-                    self.__assessed_value = self.__expression.result
+            elif self.expression:
+                # already a value.Value, sourced from the records used
+                self.__assessed_value = self.expression.evaluate(records, as_of=as_of)
         except Exception as e:
             raise VariableEvaluationError([e], self.id)
         finally:
@@ -87,8 +96,7 @@ class AssessmentRecord(record.Record):
             if self.var.narr:
                 var_dict = None 
                 if self.var.narr.variables:
-                    records_for_filter = list(filter(lambda ea: ea.id in self.var.narr.variables, records))
-                    var_dict = {r.id: r.as_dict() for r in records_for_filter}
+                    var_dict = {rid: records[rid].as_dict() for rid in self.var.narr.variables if rid in records}
             
             self.set_narrative(persona=persona, variable_data_dict=var_dict)
                 
@@ -104,7 +112,7 @@ class AssessmentRecord(record.Record):
 
     @property
     def values(self):
-        return vlist([self.__assessed_value]) if self.__assessed_value else None
+        return vlist([self.__assessed_value], presorted=True) if self.__assessed_value else None
 
 
 
@@ -138,7 +146,9 @@ class AssessmentEvaluatorProtocol(Protocol):
                 evaluated_records: list[EvaluatedRecord],
                 persona: Persona = Persona.patient,
                 functions_module=None,
-                context: EvaluationContext = None) -> AssessmentResult:
+                context: EvaluationContext = None,
+                dependency_graph: DependencyGraph = None,
+                as_of: datetime = None) -> AssessmentResult:
         
         ...
 
@@ -149,29 +159,45 @@ class AssessmentEvaluator(AssessmentEvaluatorProtocol):
                 evaluated_records: list[EvaluatedRecord],
                 persona: Persona = Persona.patient,
                 functions_module=None,
-                context: EvaluationContext = None) -> AssessmentResult:
+                context: EvaluationContext = None,
+                dependency_graph: DependencyGraph = None,
+                as_of: datetime = None) -> AssessmentResult:
+        """Evaluates assessments in dependency order against a single name table that grows as results come in.
+
+        dependency_graph: graph of the CPG (`CPG.assessment_graph`), built from `assessment_variables` if not given
+        as_of: evaluation date, now if not given
+        """
         
         eval_context = context or EvaluationContext() 
 
-        # holder for AssessmentRecord that are evaluated
-        evaluated_assessment_records = []
+        graph = dependency_graph or DependencyGraph.for_assessments(assessment_variables, functions_module)
+        variables = {av.id: av for av in assessment_variables}
+        if set(graph.nodes) != set(variables):
+            graph = graph.subgraph(variables)
+
         # given records, pull record from the EV
-        records = [e.record for e in evaluated_records]
-        # evaluate each AV
-        for var in assessment_variables:
+        table = record.record_table([e.record for e in evaluated_records])
+        evaluated = {}
 
-            # convert to a Record
-            assessment_record = AssessmentRecord(var=var)
+        def evaluate(var_id):
+            assessment_record = AssessmentRecord(var=variables[var_id], as_of=as_of)
             try:
-                success = assessment_record.evaluate(records + evaluated_assessment_records, persona=persona, functions_module=functions_module)
-                evaluated_assessment_records.append(assessment_record)
-                eval_context.successful_evaluation(assessment_record)
+                assessment_record.evaluate(table, persona=persona, functions_module=functions_module, as_of=as_of)
+                return assessment_record, None
             except VariableEvaluationError as e:
-                evaluated_assessment_records.append(assessment_record)
-                eval_context.failed_evaluation(assessment_record, e)
-            except Exception as e:
-                raise e
-                
+                return assessment_record, e
+
+        for var_id in graph.order:
+            evaluated[var_id] = evaluate(var_id)
+            table.setdefault(var_id, evaluated[var_id][0])
+
+        # evaluation list keeps definition order
+        for var in assessment_variables:
+            assessment_record, error = evaluated[var.id]
+            if error:
+                eval_context.failed_evaluation(assessment_record, error)
+            else:
+                eval_context.successful_evaluation(assessment_record)
 
         return AssessmentResult(context=eval_context)
 
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import StrEnum
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Protocol
+import logging, os
+
+from .concord import Concord, NeedAttestationError
+from .cpg import CPG
+from .healthcontext import HealthContext
+from primitives.code import Code
+
+log = logging.getLogger(__name__)
+
+
+class PatientStatus(StrEnum):
+    evaluated           = 'evaluated'
+    not_eligible        = 'not_eligible'
+    insufficient        = 'insufficient'
+    needs_attestation   = 'needs_attestation'
+    failed              = 'failed'
+
+
+@dataclass(frozen=True)
+class PatientResult:
+    """Compact, picklable outcome of one CPG for one patient"""
+
+    identifier: str
+    status: PatientStatus
+    eligible: bool = None
+    insufficient: tuple[str, ...] = ()
+    """variables that made the data insufficient"""
+    needs_attestation: tuple[str, ...] = ()
+    assessments: dict[str, Any] = field(default_factory=dict)
+    """assessment id -> value; None when it could not be evaluated"""
+    failed_assessments: tuple[str, ...] = ()
+    recommendations: dict[str, tuple[bool, bool]] = field(default_factory=dict)
+    """recommendation id -> (applies, compliant)"""
+    failed_recommendations: tuple[str, ...] = ()
+    error: str = None
+
+    @property
+    def applied(self) -> list[str]:
+        return [rid for rid, (applies, _) in self.recommendations.items() if applies]
+
+    @staticmethod
+    def compact(value):
+        """`value` as kept in a result: plain, picklable and comparable (codes as strings, sequences as tuples)"""
+        if isinstance(value, Code):
+            return value.as_string
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, (tuple, list)):
+            return tuple(PatientResult.compact(v) for v in value)
+        return str(value)
+
+
+class PatientPartition(Protocol):
+    """A picklable unit of patients loaded inside the worker, eg. one file of a bulk export,
+    so that only the partition reference crosses the process boundary"""
+
+    def healthcontexts(self) -> Iterable[HealthContext]:
+        ...
+
+
+def evaluate_patient(cpg: CPG, healthcontext: HealthContext, demand_driven: bool = False, as_of: datetime = None, require_attestation: bool = False) -> PatientResult:
+    """Eligibility, sufficiency, assessments and recommendations of `cpg` for one patient"""
+
+    identifier = healthcontext.identifier
+    try:
+        concord = Concord(cpg, healthcontext, demand_driven=demand_driven, as_of=as_of)
+
+        if not concord.eligibility().is_eligible:
+            return PatientResult(identifier, PatientStatus.not_eligible, eligible=False)
+
+        sufficiency = concord.sufficiency()
+        if not sufficiency.is_executable:
+            insufficient = tuple(ev.id for ev in sufficiency.insufficient_variables)
+            return PatientResult(identifier, PatientStatus.insufficient, eligible=True, insufficient=insufficient)
+
+        try:
+            assessment = concord.assess(require_attestation=require_attestation)
+        except NeedAttestationError as e:
+            return PatientResult(identifier, PatientStatus.needs_attestation, eligible=True, needs_attestation=tuple(ev.id for ev in e.records))
+
+        evaluated = assessment.context.evaluation_list
+        recommendations = concord.recommendations(raise_errors=False).recommendations
+        return PatientResult(
+            identifier,
+            PatientStatus.evaluated,
+            eligible=True,
+            assessments={ev.id: PatientResult.compact(ev.record.value.value) if ev.record.value else None for ev in evaluated},
+            failed_assessments=tuple(ev.id for ev in evaluated if ev.error),
+            recommendations={er.recommendation.id: (er.applies, PatientResult.compact(er.compliant.value) if er.compliant else None) for er in recommendations},
+            failed_recommendations=tuple(er.recommendation.id for er in recommendations if er.error))
+
+    except Exception as e:
+        log.error(f'Cohort: evaluation failed for patient={identifier} error={e}')
+        return PatientResult(identifier, PatientStatus.failed, error=f'{type(e).__name__}: {e}')
+
+
+# ---- worker process ---- #
+
+_worker = {}
+
+def _initialize_worker(cpg_filepath: str, options: dict):
+    # the CPG is loaded once per process (from its compiled artifact) and kept for every chunk
+    logging.disable(options.pop('log_level', logging.ERROR))
+    _worker['cpg'] = CPG.from_document_path(cpg_filepath)
+    _worker['options'] = options
+
+def _evaluate_chunk(chunk: list) -> list[PatientResult]:
+    return _evaluate_items(_worker['cpg'], chunk, _worker['options'])
+
+def _evaluate_items(cpg: CPG, items: list, options: dict) -> list[PatientResult]:
+    results = []
+    for item in items:
+        healthcontexts = [item] if isinstance(item, HealthContext) else item.healthcontexts()
+        results.extend(evaluate_patient(cpg, hc, **options) for hc in healthcontexts)
+    return results
+
+
+class CohortRunner:
+    """Evaluates one CPG over many patients on a process pool.
+
+    Patients are `HealthContext`s or `PatientPartition`s, sent to workers in chunks of `chunksize`;
+    at most `max_in_flight` chunks are pending so that large or lazy cohorts are never materialized.
+    Results stream back in input order (`ordered=True`) or as soon as a chunk completes.
+    """
+
+    def __init__(self,
+                 cpg_filepath: str,
+                 max_workers: int = None,
+                 chunksize: int = 64,
+                 max_in_flight: int = None,
+                 ordered: bool = True,
+                 demand_driven: bool = False,
+                 as_of: datetime = None,
+                 require_attestation: bool = False,
+                 progress: Callable[[int, int], None] = None,
+                 worker_log_level: int = logging.ERROR):
+        """
+        max_workers: worker processes, all cores by default; 1 evaluates in this process
+        progress: called with (items done, items submitted) after each chunk; a partition counts as one item
+        worker_log_level: log records at or below this level are disabled in workers
+        """
+        self.cpg_filepath = cpg_filepath
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self.ordered = ordered
+        self.options = {'demand_driven': demand_driven, 'as_of': as_of, 'require_attestation': require_attestation}
+        self.progress = progress
+        self.worker_log_level = worker_log_level
+
+    def run(self, patients: Iterable[HealthContext | PatientPartition]) -> Iterator[PatientResult]:
+
+        chunks = self.__chunks(patients)
+
+        if self.max_workers == 1:
+            cpg = CPG.from_document_path(self.cpg_filepath)
+            done = submitted = 0
+            for chunk in chunks:
+                submitted += len(chunk)
+                results = _evaluate_items(cpg, chunk, self.options)
+                done += len(chunk)
+                self.__report(done, submitted)
+                yield from results
+            return
+
+        options = dict(self.options, log_level=self.worker_log_level)
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_initialize_worker, initargs=(self.cpg_filepath, options)) as pool:
+            pending = deque()
+            sizes = {}
+            done = submitted = 0
+            exhausted = False
+            while pending or not exhausted:
+                # keep the pool fed up to the in-flight bound
+                while not exhausted and len(pending) < self.max_in_flight:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    future = pool.submit(_evaluate_chunk, chunk)
+                    sizes[future] = len(chunk)
+                    submitted += len(chunk)
+                    pending.append(future)
+
+                if not pending:
+                    break
+
+                if self.ordered:
+                    completed = [pending.popleft()]
+                else:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    completed = [f for f in pending if f in finished]
+                    for f in completed:
+                        pending.remove(f)
+
+                for future in completed:
+                    results = future.result()
+                    done += sizes.pop(future)
+                    self.__report(done, submitted)
+                    yield from results
+
+    def __chunks(self, patients):
+        iterator = iter(patients)
+        while chunk := list(islice(iterator, self.chunksize)):
+            yield chunk
+
+    def __report(self, done, submitted):
+        if self.progress:
+            self.progress(done, submitted)
@@ -3,15 +3,19 @@
 from dataclasses import dataclass, field
 from datetime import datetime, date
 from functools import cached_property
+from typing import Any
 import logging
 
 from .cpg import CPG
+from .engine import ConcordEngine
 from .eligibility import EligibilityResult, EligibilityEvaluator, EligibilityEvaluatorProtocol
 from .assessment import AssessmentEvaluatorProtocol, AssessmentResult, AssessmentEvaluator, AssessmentEvaluatorProtocol
 from .recommendation import EvaluatedRecommendation, RecommendationResult
 from .sufficiency import SufficiencyResult, SufficiencyEvaluator, SufficiencyEvaluatorProtocol
 from .evaluation import EvaluatedRecord, EvaluationContext
+from .snapshot import ConcordSnapshot
 from variables.value import Value
+from primitives.valuedate import local_naive
 from .healthcontext import HealthContext
 
 log = logging.getLogger(__name__)
@@ -24,12 +28,19 @@ class NeedAttestationError(Exception):
 
 @dataclass
 class Concord:
+    """Evaluation of a CPG for one patient, stage by stage, stopping for attestations.
+    The stages run on the engine of the CPG (`CPG.engine`), shared by every patient."""
 
     cpg: CPG
     """Instance of CPG()"""
     healthcontext: HealthContext
     """HealthContext"""
     until_year: int = None
+    as_of: datetime = None
+    """Evaluation date (naive, local time) for data cut-off, value filter windows, assessed values and narratives.
+    Defaults to the end of `until_year`, if given, else to the time of evaluation"""
+    demand_driven: bool = False
+    """Only evaluate the variables and assessments reached by recommendations that can apply for the persona"""
     __eligibility_result: EligibilityResult = field(init=False)
     __assessment_result: AssessmentResult = field(init=False)
     __recommendations_result: RecommendationResult = field(init=False)
@@ -37,7 +48,20 @@ class Concord:
 
     @cached_property
     def until_date(self) -> date|None:
-        return datetime(self.until_year, 12, 31).date if self.until_year else None
+        return datetime(self.until_year, 12, 31).date() if self.until_year else None
+
+    @cached_property
+    def evaluation_date(self) -> datetime|None:
+        """`as_of`, or the end of `until_year`; None evaluates against the current date"""
+        if self.as_of:
+            return local_naive(self.as_of)
+        if self.until_year:
+            return datetime(self.until_year, 12, 31, 23, 59, 59)
+        return None
+    @cached_property
+    def engine(self) -> ConcordEngine:
+        return self.cpg.engine(self.demand_driven)
+
     @property
     def records(self):
         """Patient data, from HealthContext"""
@@ -66,9 +90,11 @@ class Concord:
         if not self.cpg.eligibility_criterias:
             raise Exception('Concord: no criterias defined to evaluate for this CPG')
         
-        eligibility_eval = evaluator or EligibilityEvaluator(self.cpg.eligibility_criterias)
         # evalute eligibility
-        self.__eligibility_result = eligibility_eval.evaluate(self.healthcontext, context=context)
+        if evaluator:
+            self.__eligibility_result = evaluator.evaluate(self.healthcontext, context=context, as_of=self.evaluation_date)
+        else:
+            self.__eligibility_result = self.engine.eligibility(self.healthcontext, self.evaluation_date, context)
 
         return self.__eligibility_result
 
@@ -80,19 +106,24 @@ class Concord:
         if not self.cpg.variables:
             raise Exception('Concord: no variables defined to evaluate for this CPG')
 
-        # initialize an evaluator 
-        sufficiency_eval = sufficiency_evaluator or SufficiencyEvaluator('se', cpg_variables=self.cpg.variables)
         # evaluate sufficiency
-        self.__sufficiency_result = sufficiency_eval.evaluate(self.healthcontext, context)
+        if sufficiency_evaluator:
+            self.__sufficiency_result = sufficiency_evaluator.evaluate(self.healthcontext, context, as_of=self.evaluation_date)
+        else:
+            self.__sufficiency_result = self.engine.sufficiency(self.healthcontext, self.healthcontext.persona, self.evaluation_date, context)
 
         return self.__sufficiency_result
 
     def assess(self,
-                assessment_evaluator: AssessmentEvaluatorProtocol = None
+                assessment_evaluator: AssessmentEvaluatorProtocol = None,
+                require_attestation: bool = True
                 ) -> AssessmentResult:
 
         """Get all evaluated_records
 
+        require_attestation: raise NeedAttestationError for attestable variables without values;
+            when False they are evaluated as missing (population runs without a user to ask)
+
         1. if suff.result == insuff, abort
         2. get evalauted records, send to assessment variables
         3. check if needs PGHD.
@@ -121,7 +152,7 @@ class Concord:
         # --> check if they need Input
         need_attestation = self.__sufficiency_result.attestation_variables
         log.info(f'Attestation needed for {len(need_attestation)} variables')
-        if need_attestation:
+        if need_attestation and require_attestation:
             for n in need_attestation:
                 log.error(f'Need Input for record={n.record.id}')
             raise NeedAttestationError(need_attestation)
@@ -131,42 +162,70 @@ class Concord:
 
         
 
-        evaluator = assessment_evaluator or AssessmentEvaluator()
-        ctx = EvaluationContext()
-
-        self.__assessment_result = evaluator.assess(
-            assessment_variables= self.cpg.assessments_variables,
-            evaluated_records= self.sufficiency_evaluated_records,
-            persona= self.healthcontext.persona,
-            functions_module= self.cpg.functions_module,
-            context= ctx
-        )
+        if assessment_evaluator:
+            self.__assessment_result = assessment_evaluator.assess(
+                assessment_variables= self.engine.demanded(self.cpg.assessments_variables, self.healthcontext.persona),
+                evaluated_records= self.sufficiency_evaluated_records,
+                persona= self.healthcontext.persona,
+                functions_module= self.cpg.functions_module,
+                context= EvaluationContext(),
+                dependency_graph= self.cpg.assessment_graph,
+                as_of= self.evaluation_date
+            )
+        else:
+            self.__assessment_result = self.engine.assess(self.sufficiency_evaluated_records, self.healthcontext.persona, self.evaluation_date)
 
         return self.__assessment_result
 
     
 
 
-    def recommendations(self, context: EvaluationContext = None) -> RecommendationResult:
-
-
-        context = context or    EvaluationContext() 
-        evaluated_recommendations = []
-        for recommendation in self.cpg.recommendation_variables:
+    def recommendations(self, context: EvaluationContext = None, raise_errors: bool = True) -> RecommendationResult:
+        """raise_errors: when False, a recommendation that cannot be evaluated keeps the error in `EvaluatedRecommendation.error`"""
 
-            eval_rec = EvaluatedRecommendation(recommendation=recommendation)
-            eval_rec.evaluate(self.assessment_result.context.evaluation_list, evaluated_records=self.sufficiency_evaluated_records, persona=self.healthcontext.persona)
-            # eval_rec.evaluate(self.assessment_result.context.evaluation_list, variables=self.evaluated_records, persona=self.healthcontext.persona)
-            evaluated_recommendations.append(eval_rec)
-            log.debug(eval_rec)
-
-        self.__recommendations_result = RecommendationResult(
-                context=context, 
-                recommendations=sorted(evaluated_recommendations, key=lambda er: er.applies if er.applies else False, reverse=True)
-            )
+        self.__recommendations_result = self.engine.recommendations(
+            self.assessment_result, self.sufficiency_evaluated_records, self.healthcontext.persona, self.evaluation_date,
+            raise_errors=raise_errors, context=context)
         return self.__recommendations_result
 
     
+    def snapshot(self) -> ConcordSnapshot:
+        """Snapshot after eligibility and sufficiency, to resume with `from_snapshot` once attestations are in"""
+        if getattr(self, '_Concord__eligibility_result', None) is None or getattr(self, '_Concord__sufficiency_result', None) is None:
+            raise ValueError('Concord: eligibility and sufficiency must be evaluated before a snapshot')
+        state = {
+            'eligibility': self.__eligibility_result,
+            'sufficiency': self.__sufficiency_result,
+            'persona': self.healthcontext.persona,
+            'identifier': self.healthcontext.identifier,
+            'until_year': self.until_year,
+            'as_of': self.as_of,
+            'demand_driven': self.demand_driven,
+        }
+        pending = [ev.record.id for ev in self.__sufficiency_result.attestation_variables]
+        return ConcordSnapshot.of(self.cpg, state, pending)
+
+    @classmethod
+    def from_snapshot(cls, cpg: CPG, snapshot: ConcordSnapshot) -> 'Concord':
+        """Concord restored from a snapshot, ready for `attest`, `assess` and `recommendations`.
+        The health context keeps the persona and identifier only, the remaining stages need no more."""
+        state = snapshot.state(cpg)
+        concord = cls(cpg, HealthContext(records=[], persona=state['persona'], identifier=state['identifier']),
+                      until_year=state['until_year'], as_of=state['as_of'], demand_driven=state['demand_driven'])
+        concord.__eligibility_result = state['eligibility']
+        concord.__sufficiency_result = state['sufficiency']
+        return concord
+
+    def attest(self, attestations: dict[str, Any]):
+        """Attested values (variable id -> `Value` or plain value) of the variables waiting for attestation;
+        raises ValueError for other variables and VarError for invalid values"""
+        pending = {ev.record.id: ev.record for ev in self.__sufficiency_result.attestation_variables}
+        unknown = set(attestations) - set(pending)
+        if unknown:
+            raise ValueError(f'Concord: no attestation pending for variables={sorted(unknown)}')
+        for var_id, attested in attestations.items():
+            pending[var_id].attested_value = attested if isinstance(attested, Value) else Value(attested, source=['attested'])
+
     @property
     def applied_recommendations(self):
         if not self.__recommendations_result:
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from dataclasses import dataclass
+from functools import cache, cached_property
 import logging
 
 from typing import Any, Protocol
@@ -10,10 +11,32 @@ from .eligibility import EligibilityVar
 from .recommendation import RecommendationVar
 from primitives.code import Code
 from variables import var
+from variables.codeindex import CodeIndex
 from .expression import Expression
+from .dependency import DependencyGraph
 
 log = logging.getLogger(__name__)
 
+ARTIFACT_DIRECTORY = '__cpgcache__'
+ARTIFACT_PACKAGES = ('core', 'variables', 'primitives', 'ontology')
+"""Packages of the classes pickled in an artifact; any change to their source invalidates all artifacts"""
+
+
+@cache
+def code_fingerprint() -> str:
+    """Hash of the Python version and the source of `ARTIFACT_PACKAGES`, computed once per process"""
+    import hashlib, os, sys
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256(f'{sys.version_info.major}.{sys.version_info.minor}'.encode())
+    for package in ARTIFACT_PACKAGES:
+        package_path = os.path.join(root, package)
+        for fn in sorted(os.listdir(package_path)) if os.path.isdir(package_path) else []:
+            if fn.endswith('.py'):
+                digest.update(f'{package}/{fn}'.encode())
+                with open(os.path.join(package_path, fn), 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
 @dataclass
 class CPG():
 
@@ -29,6 +52,8 @@ class CPG():
     recommendation_variables: list[RecommendationVar] = None
     rendering_template_path: str = None
     functions_module: Any = None
+    fingerprint: str = None
+    """Content hash of the CPG definition, set by `from_document_path`"""
 
     # for rendering reasons
     def as_dict(self):
@@ -41,11 +66,16 @@ class CPG():
 
 
     @classmethod
-    def from_document_path(cls, cpg_filepath: str):
+    def from_document_path(cls, cpg_filepath: str, use_artifact: bool = True):
+        """Loads a CPG from its YAML definition and accompanying functions module.
+
+        A compiled artifact of the fully built CPG is kept in `__cpgcache__/` next to the YAML,
+        keyed by a content hash of the YAML, its `.py` module and the source of the pickled classes
+        (`code_fingerprint`). When the hash matches, YAML parsing and object construction are skipped;
+        editing either file, or the code, rebuilds the artifact.
+        """
         
         from os import path
-        import sys
-        import yaml
         yaml_filename = path.basename(cpg_filepath)
         directory = path.dirname(cpg_filepath)
         function_module =yaml_filename[:-5].replace('/', '.')
@@ -57,19 +87,64 @@ class CPG():
         log.info(function_module)
         log.debug(functions_module_path)
 
-        yml = None
-        with open(cpg_filepath, 'r') as cpgs_doc:
-            try:
-                yml = yaml.safe_load(cpgs_doc)
-            except yaml.YAMLError as exc:
-                log.error(exc)
-                raise exc
-            except Exception as e:
-                log.error(e)
-                raise e
-        
-        raise_error = path.exists(functions_module_path)
+        with open(cpg_filepath, 'rb') as cpgs_doc:
+            document_bytes = cpgs_doc.read()
+
+        module_bytes = None
+        if path.exists(functions_module_path):
+            with open(functions_module_path, 'rb') as module_doc:
+                module_bytes = module_doc.read()
+
+        fingerprint = cls.document_fingerprint(document_bytes, module_bytes)
+        artifact_path = path.join(directory, ARTIFACT_DIRECTORY, f'{function_module}.{fingerprint[:16]}.pickle')
+
+        fn_module = cls.__load_functions_module(function_module, functions_module_path)
+
+        if use_artifact:
+            instance = cls.__read_artifact(artifact_path, fingerprint)
+            if instance:
+                log.debug(f'CPG={instance.identifier} loaded from artifact={artifact_path}')
+                instance.functions_module = fn_module
+                return instance
+
+        import yaml
+        try:
+            yml = yaml.safe_load(document_bytes)
+        except yaml.YAMLError as exc:
+            log.error(exc)
+            raise exc
+        except Exception as e:
+            log.error(e)
+            raise e
+
+        instance = cls.from_document(yml, fn_module)
+        instance.fingerprint = fingerprint
+        instance.compile()
+
+        if use_artifact:
+            cls.__write_artifact(instance, artifact_path)
+
+        return instance
+
+    @staticmethod
+    def document_fingerprint(document_bytes: bytes, module_bytes: bytes = None) -> str:
+        """Content hash of a CPG definition and its functions module, for this version of the code"""
+        import hashlib
+        digest = hashlib.sha256(code_fingerprint().encode())
+        digest.update(document_bytes)
+        digest.update(b'\0')
+        digest.update(module_bytes or b'')
+        return digest.hexdigest()
+
+    @staticmethod
+    def __load_functions_module(function_module: str, functions_module_path: str):
+
+        from os import path
+        import sys
         import importlib
+        if not path.exists(functions_module_path):
+            return None
+
         log.warning('SAFETY-ISSUE: make sure functions module has not malicious-ness. INTERNAL-PROVISION-ONLY')
         try:
             # fn_module = importlib.import_module(functions_module_path) if functions_module_path else None
@@ -79,12 +154,53 @@ class CPG():
             sys.modules[function_module] = fn_module
             spec.loader.exec_module(fn_module)
             log.debug(fn_module)
-            return cls.from_document(yml, fn_module)
+            return fn_module
         except Exception as e:
             log.debug(e)
-            if raise_error:
-                raise e
-            return cls.from_document(yml, None)
+            raise e
+
+    @classmethod
+    def __read_artifact(cls, artifact_path: str, fingerprint: str):
+
+        import pickle
+        from os import path
+        if not path.exists(artifact_path):
+            return None
+        # artifacts are only ever written by `from_document_path`, same trust as the functions module
+        try:
+            with open(artifact_path, 'rb') as f:
+                instance = pickle.load(f)
+            if not isinstance(instance, cls) or instance.fingerprint != fingerprint:
+                log.warning(f'Stale CPG artifact={artifact_path}, rebuilding')
+                return None
+            return instance
+        except Exception as e:
+            log.warning(f'Cannot read CPG artifact={artifact_path} error={e}, rebuilding')
+            return None
+
+    @staticmethod
+    def __write_artifact(instance, artifact_path: str):
+
+        import copy, os, pickle, tempfile
+        directory = os.path.dirname(artifact_path)
+        prefix = os.path.basename(artifact_path).split('.')[0] + '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # functions module is re-executed on every load, modules cannot be pickled
+            artifact = copy.copy(instance)
+            artifact.functions_module = None
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, artifact_path)
+            # older artifacts of the same CPG
+            for fn in os.listdir(directory):
+                stale = os.path.join(directory, fn)
+                if fn.startswith(prefix) and fn.endswith('.pickle') and stale != artifact_path:
+                    os.remove(stale)
+            log.debug(f'CPG artifact written={artifact_path}')
+        except Exception as e:
+            log.warning(f'Cannot write CPG artifact={artifact_path} error={e}')
 
     @classmethod
     def from_document(cls, document_dict: dict, module=None):
@@ -107,6 +223,73 @@ class CPG():
             functions_module=module
         )
 
+    def compile(self):
+        """Compiles expressions, validators, value filters and narrative tags ahead of evaluation
+        so that parsing is done once per CPG (and stored in the compiled artifact) instead of once per patient"""
+
+        all_vars = (self.variables or []) + (self.eligibility_criterias or []) + (self.assessments_variables or []) + (self.recommendation_variables or [])
+        for vr in all_vars:
+            vr.plausible_validator
+            vr.panel_validator
+            if vr.value_filter:
+                vr.value_filter.compiled_value_expression
+                vr.value_filter.compiled_comparison
+            if vr.narr:
+                vr.narr.tags
+
+        for vr in (self.eligibility_criterias or []) + (self.assessments_variables or []):
+            vr.compiled_expression
+            vr.evaluator
+
+        for vr in (self.recommendation_variables or []):
+            vr.compiled_expression
+            vr.compiled_compliance_expression
+            vr.evaluator
+            vr.compliance_evaluator
+
+        self.assessment_graph
+        self.dependency_graph
+        self.code_index
+        return self
+
+    @cached_property
+    def assessment_graph(self) -> DependencyGraph:
+        """Dependencies between assessments, used to schedule their evaluation"""
+        return DependencyGraph.for_assessments(self.assessments_variables or [], self.functions_module)
+
+    @cached_property
+    def code_index(self) -> CodeIndex:
+        """`system|code` -> identifiers of the CPG variables, to match patient data to variables"""
+        return CodeIndex.for_variables(self.variables or [])
+
+    @cached_property
+    def dependency_graph(self) -> DependencyGraph:
+        """Dependencies between all variables, assessments and recommendations of the CPG"""
+        all_vars = (self.variables or []) + (self.assessments_variables or []) + (self.recommendation_variables or [])
+        return DependencyGraph.for_variables(all_vars, self.functions_module)
+
+    def engine(self, demand_driven: bool = False):
+        """`ConcordEngine` of this CPG, created once per mode and shared by the evaluations of every patient"""
+        from .engine import ConcordEngine
+        engines = self.__dict__.setdefault('_engines', {})
+        demand_driven = bool(demand_driven)
+        if demand_driven not in engines:
+            engines[demand_driven] = ConcordEngine(self, demand_driven=demand_driven)
+        return engines[demand_driven]
+
+    def __getstate__(self):
+        # engines are built again where the CPG is loaded, not stored in artifacts
+        state = dict(self.__dict__)
+        state.pop('_engines', None)
+        return state
+
+    def demanded_identifiers(self, persona) -> set[str]:
+        """Identifiers of the recommendations that can apply for `persona` and of every variable and assessment they reach,
+        and of every required variable: sufficiency is decided on the same variables as when evaluating everything"""
+        recommendations = [r.id for r in self.recommendation_variables or [] if r.may_apply(persona)]
+        required = [v.id for v in self.variables or [] if v.required]
+        return self.dependency_graph.dependencies_of(recommendations + required)
+
     def non_optional_variables(self):
         if self.variables:
             non_optionals = list(filter(lambda v: v.required == True, self.variables), None)
@@ -203,6 +386,12 @@ class CPG():
                     ValueError(f'CPG.assessment {assessment.id} cannot have both `expression` and `function`')
                 )
 
+        # Assessments are evaluated in dependency order, which must exist
+        from primitives.errors import DependencyCycleError
+        cycle = self.assessment_graph.cycle()
+        if cycle:
+            errors.append(DependencyCycleError(cycle))
+
         if not self.recommendation_variables:
             errors.append(
                     Exception('CPG.recommendations not found;  all CPGs must have recommendation variables defined')
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import ast, inspect, logging, textwrap
+from dataclasses import dataclass
+from functools import cached_property
+
+from primitives.errors import DependencyCycleError
+
+log = logging.getLogger(__name__)
+
+
+def function_inputs(functions_module, function_name: str):
+    """Identifiers a CPG function reads from its `healthcontext` argument.
+
+    A function may declare them explicitly (`tenyearriskscore.inputs = ['Age', ...]`),
+    otherwise they are inferred from `healthcontext['id']` and `healthcontext.get('id')`
+    in its source, following calls to other functions of the same module.
+    Returns None when the inputs cannot be determined.
+    """
+    if functions_module is None:
+        return None
+    return _function_inputs(functions_module, function_name, set())
+
+
+def _function_inputs(functions_module, function_name: str, visiting: set):
+
+    func = getattr(functions_module, function_name, None)
+    if func is None:
+        return None
+
+    declared = getattr(func, 'inputs', None)
+    if declared is not None:
+        return list(declared)
+
+    if function_name in visiting:
+        return []
+    visiting.add(function_name)
+
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    except (OSError, TypeError, SyntaxError) as e:
+        log.debug(f'Cannot read source of function={function_name} error={e}')
+        return None
+
+    fn_def = tree.body[0]
+    if not isinstance(fn_def, (ast.FunctionDef, ast.AsyncFunctionDef)) or not fn_def.args.args:
+        return None
+    arg = fn_def.args.args[0].arg
+
+    def is_arg(node):
+        return isinstance(node, ast.Name) and node.id == arg
+
+    inputs = []
+    for node in ast.walk(fn_def):
+        # healthcontext['id']
+        if isinstance(node, ast.Subscript) and is_arg(node.value):
+            if isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+                inputs.append(node.slice.value)
+            else:
+                return None
+        elif isinstance(node, ast.Call):
+            # healthcontext.get('id')
+            if isinstance(node.func, ast.Attribute) and is_arg(node.func.value):
+                if node.func.attr == 'get' and node.args and isinstance(node.args[0], ast.Constant):
+                    inputs.append(node.args[0].value)
+                else:
+                    return None
+            # helper(healthcontext)
+            elif any(is_arg(a) for a in node.args) or any(is_arg(k.value) for k in node.keywords):
+                if not isinstance(node.func, ast.Name):
+                    return None
+                nested = _function_inputs(functions_module, node.func.id, visiting)
+                if nested is None:
+                    return None
+                inputs.extend(nested)
+
+    return list(dict.fromkeys(inputs))
+
+
+def references(variable, functions_module=None):
+    """Identifiers a CPG variable refers to, from its expressions, function inputs, validator and narrative.
+    Returns None when a function's inputs cannot be determined."""
+
+    refs = []
+    for attr in ('compiled_expression', 'compiled_compliance_expression'):
+        compiled = getattr(variable, attr, None)
+        if compiled and compiled.variable_identifiers:
+            refs.extend(compiled.variable_identifiers)
+
+    if variable.panel_validator:
+        refs.extend(variable.panel_validator.variables)
+
+    if variable.narr and variable.narr.variables:
+        refs.extend(variable.narr.variables)
+
+    function = getattr(variable, 'function', None)
+    if function:
+        inputs = function_inputs(functions_module, function)
+        if inputs is None:
+            return None
+        refs.extend(inputs)
+
+    return [r for r in dict.fromkeys(refs) if r not in ('self', 'value')]
+
+
+@dataclass(frozen=True)
+class DependencyGraph:
+    """Directed graph of CPG variable identifiers.
+
+    `dependencies` maps each node to the nodes it needs evaluated first,
+    in definition order; edges only point to nodes of the graph.
+    """
+
+    dependencies: dict[str, tuple[str, ...]]
+
+    @classmethod
+    def for_assessments(cls, assessment_variables: list, functions_module=None):
+        """Graph over assessments; edges come from `$identifiers` in expressions and narratives and from function inputs.
+        Function assessments whose inputs cannot be determined depend on every assessment defined before them."""
+        return cls.for_variables(assessment_variables, functions_module)
+
+    @classmethod
+    def for_variables(cls, variables: list, functions_module=None):
+        """Graph over any CPG variables (data variables, assessments, recommendations) in definition order.
+        A variable whose function inputs cannot be determined depends on every variable defined before it."""
+
+        ids = [v.id for v in variables]
+        known = set(ids)
+        dependencies = {}
+        for i, v in enumerate(variables):
+            refs = references(v, functions_module)
+            if refs is None:
+                log.warning(f'Cannot determine inputs of function={v.function} for variable={v.id}, ordered after all preceding variables')
+                refs = ids[:i]
+            compiled = getattr(v, 'compiled_expression', None)
+            expression_refs = set(compiled.variable_identifiers or []) if compiled else set()
+            # a narrative may mention the variable itself, an expression may not
+            dependencies[v.id] = tuple(r for r in refs if r in known and (r != v.id or r in expression_refs))
+        return cls(dependencies)
+
+    def __contains__(self, node) -> bool:
+        return node in self.dependencies
+
+    @property
+    def nodes(self):
+        return list(self.dependencies.keys())
+
+    @cached_property
+    def dependents(self) -> dict[str, tuple[str, ...]]:
+        """Reverse edges: node -> nodes that depend on it"""
+        reverse = {n: [] for n in self.dependencies}
+        for node, deps in self.dependencies.items():
+            for d in deps:
+                reverse[d].append(node)
+        return {n: tuple(ds) for n, ds in reverse.items()}
+
+    def subgraph(self, nodes):
+        keep = set(nodes)
+        return DependencyGraph({n: tuple(d for d in deps if d in keep) for n, deps in self.dependencies.items() if n in keep})
+
+    def cycle(self) -> list[str] | None:
+        """First circular dependency found, as a path that ends where it starts; None if the graph is acyclic"""
+
+        WHITE, GREY, BLACK = 0, 1, 2
+        color = dict.fromkeys(self.dependencies, WHITE)
+        for root in self.dependencies:
+            if color[root] != WHITE:
+                continue
+            path = [root]
+            stack = [iter(self.dependencies[root])]
+            color[root] = GREY
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    color[path.pop()] = BLACK
+                    stack.pop()
+                elif color[dep] == GREY:
+                    return path[path.index(dep):] + [dep]
+                elif color[dep] == WHITE:
+                    color[dep] = GREY
+                    path.append(dep)
+                    stack.append(iter(self.dependencies[dep]))
+        return None
+
+    @cached_property
+    def levels(self) -> list[list[str]]:
+        """Topological levels; nodes within a level are independent of each other.
+        Raises DependencyCycleError."""
+
+        level_of = {}
+        for node in self.order:
+            deps = self.dependencies[node]
+            level_of[node] = 1 + max(level_of[d] for d in deps) if deps else 0
+
+        levels = [[] for _ in range(max(level_of.values()) + 1)] if level_of else []
+        # definition order is kept within a level
+        for node in self.dependencies:
+            levels[level_of[node]].append(node)
+        return levels
+
+    @cached_property
+    def order(self) -> list[str]:
+        """Topological order, closest to definition order: each node is placed right after its dependencies.
+        Raises DependencyCycleError."""
+
+        cycle = self.cycle()
+        if cycle:
+            raise DependencyCycleError(cycle)
+        return list(self.__postorder())
+
+    def dependencies_of(self, nodes) -> set[str]:
+        """`nodes` and everything they transitively depend on"""
+        return self.__closure(nodes, self.dependencies)
+
+    def dependents_of(self, nodes) -> set[str]:
+        """`nodes` and everything that transitively depends on them"""
+        return self.__closure(nodes, self.dependents)
+
+    def __closure(self, nodes, edges):
+        seen = set()
+        pending = [n for n in nodes if n in edges]
+        while pending:
+            node = pending.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            pending.extend(edges[node])
+        return seen
+
+    def __postorder(self):
+        visited = set()
+        for root in self.dependencies:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(self.dependencies[root]))]
+            while stack:
+                node, deps = stack[-1]
+                dep = next(deps, None)
+                if dep is None:
+                    stack.pop()
+                    yield node
+                elif dep not in visited:
+                    visited.add(dep)
+                    stack.append((dep, iter(self.dependencies[dep])))
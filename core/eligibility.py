@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from dataclasses import dataclass
+from datetime import datetime
 from enum import Enum, auto
 from functools import cached_property
 from typing import Any, Protocol
@@ -8,6 +9,7 @@ from .assessment import AssessmentVar, AssessmentRecord
 from .healthcontext import HealthContext
 from .evaluation import EvaluationResult, EvaluationContext
 from primitives.types import YMLStrEnum
+from variables.record import Record
 
 
 class EligbilityValueAbstract(Protocol):
@@ -59,7 +61,8 @@ class EligibilityEvaluatorProtocol(Protocol):
 
     def evaluate(self, 
                 healthcontext: HealthContext, 
-                context: EvaluationContext = None) -> EligibilityResult:
+                context: EvaluationContext = None,
+                as_of: datetime = None) -> EligibilityResult:
         ...
 
 
@@ -70,7 +73,9 @@ class EligibilityEvaluator(EligibilityEvaluatorProtocol):
 
     def evaluate(self, 
                 healthcontext: HealthContext, 
-                context: EvaluationContext = None) -> EligibilityResult:
+                context: EvaluationContext = None,
+                as_of: datetime = None) -> EligibilityResult:
+        """as_of: evaluation date (naive, local time); values dated after it are left out, as for sufficiency"""
 
         if not self.criterias:
             raise ValueError('No criterias to evaluate')
@@ -78,12 +83,13 @@ class EligibilityEvaluator(EligibilityEvaluatorProtocol):
         errs = [] 
         eval_ctx = context or EvaluationContext()
         evaluated_crtiera_records = []
+        records = healthcontext.records if as_of is None else [self.until(r, as_of) for r in healthcontext.records]
 
         for criteria in self.criterias:
 
             try:
                 criteria_record = EligibilityRecord(criteria)
-                criteria_record.evaluate(records=healthcontext.records, persona=healthcontext.persona)
+                criteria_record.evaluate(records=records, persona=healthcontext.persona, as_of=as_of)
                 eval_ctx.successful_evaluation(criteria_record)
             except Exception as e:
                 eval_ctx.failed_evaluation(criteria_record, e)
@@ -95,6 +101,12 @@ class EligibilityEvaluator(EligibilityEvaluatorProtocol):
         result = EligibilityResult(eval_ctx)
         return result
 
+    @staticmethod
+    def until(record: Record, as_of: datetime) -> Record:
+        """`record`, or a copy of it without the values dated after `as_of`"""
+        values = record.values_until(as_of)
+        return record if values is record.values else Record(record.var, values, as_of=as_of)
+
 
 
 
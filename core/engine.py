@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# Long-lived evaluation API: one engine per CPG, compiled once, then evaluating any number of
+# patients, from any number of threads.
+#
+#   engine = ConcordEngine(CPG.from_document_path('cpgs/cholesterol.yaml'))
+#   result = engine.evaluate(healthcontext, Persona.provider, as_of=datetime(2024, 1, 1))
+#   result.applied
+#
+# The engine holds the CPG and its evaluators and never changes after construction; everything an
+# evaluation creates (records, contexts, results) belongs to that evaluation alone. Its stages
+# (`eligibility`, `sufficiency`, `assess`, `recommendations`) are also what `Concord` runs, step by
+# step, with the engine of its CPG (`CPG.engine`).
+
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+import logging
+
+from .assessment import AssessmentEvaluator, AssessmentResult
+from .cpg import CPG
+from .eligibility import EligibilityEvaluator, EligibilityResult
+from .evaluation import EvaluatedRecord, EvaluationContext
+from .healthcontext import HealthContext
+from .recommendation import EvaluatedRecommendation, RecommendationResult, RecommendationVar
+from .sufficiency import SufficiencyEvaluator, SufficiencyResult
+from primitives.types import Persona
+from primitives.valuedate import local_naive
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ConcordResult:
+    """Outcome of one evaluation, as far as it went: not eligible, insufficient data,
+    waiting for attestation, failed (`error`) or evaluated"""
+
+    identifier: str
+    persona: Persona
+    as_of: datetime = None
+    eligibility: EligibilityResult = None
+    sufficiency: SufficiencyResult = None
+    needs_attestation: tuple[EvaluatedRecord, ...] = ()
+    assessments: AssessmentResult = None
+    recommendations: RecommendationResult = None
+    error: Exception = None
+
+    @property
+    def is_eligible(self) -> bool:
+        return self.eligibility.is_eligible if self.eligibility else None
+
+    @property
+    def is_executable(self) -> bool:
+        return self.sufficiency.is_executable if self.sufficiency else None
+
+    @property
+    def evaluated(self) -> bool:
+        return self.recommendations is not None
+
+    @property
+    def applied(self) -> list[EvaluatedRecommendation]:
+        return self.recommendations.applied if self.recommendations else []
+
+
+@dataclass(frozen=True)
+class ConcordEngine:
+    """Evaluates one CPG for any number of patients; safe to share between threads"""
+
+    cpg: CPG
+    demand_driven: bool = False
+    """Only evaluate the variables and assessments reached by recommendations that can apply for the persona"""
+    eligibility_evaluator: EligibilityEvaluator = field(init=False, repr=False)
+    assessment_evaluator: AssessmentEvaluator = field(init=False, repr=False)
+    __demanded_ids: dict = field(init=False, repr=False)
+    """persona -> identifiers evaluated in demand driven mode"""
+    __sufficiency_evaluators: dict = field(init=False, repr=False)
+    """persona -> evaluator of the variables evaluated for it"""
+
+    def __post_init__(self):
+        if not self.cpg.eligibility_criterias:
+            raise ValueError(f'ConcordEngine: no criterias defined to evaluate for CPG={self.cpg.identifier}')
+        if not self.cpg.variables:
+            raise ValueError(f'ConcordEngine: no variables defined to evaluate for CPG={self.cpg.identifier}')
+        # everything lazily compiled is compiled now, before the engine is shared
+        self.cpg.compile()
+        demanded = {persona: self.cpg.demanded_identifiers(persona) if self.demand_driven else None for persona in Persona}
+        object.__setattr__(self, '_ConcordEngine__demanded_ids', demanded)
+        object.__setattr__(self, '_ConcordEngine__sufficiency_evaluators', {
+            persona: SufficiencyEvaluator('se', cpg_variables=self.demanded(self.cpg.variables, persona), code_index=self.cpg.code_index)
+            for persona in Persona
+        })
+        object.__setattr__(self, 'eligibility_evaluator', EligibilityEvaluator(self.cpg.eligibility_criterias))
+        object.__setattr__(self, 'assessment_evaluator', AssessmentEvaluator())
+
+    def evaluate(self, healthcontext: HealthContext, persona: Persona = None, as_of: datetime = None, require_attestation: bool = False) -> ConcordResult:
+        """Evaluates the CPG for one patient.
+
+        persona: overrides the persona of `healthcontext`
+        as_of: evaluation date, for data cut-off, value filter windows, assessed values and narratives; now if not given
+        require_attestation: stop at attestable variables without values (`ConcordResult.needs_attestation`);
+            when False they are evaluated as missing
+        """
+        persona = persona or healthcontext.persona
+        if persona != healthcontext.persona:
+            healthcontext = replace(healthcontext, persona=persona)
+        as_of = local_naive(as_of) if as_of else None
+        result = ConcordResult(healthcontext.identifier, persona, as_of)
+
+        try:
+            eligibility = self.eligibility(healthcontext, as_of)
+            result = replace(result, eligibility=eligibility)
+            if not eligibility.is_eligible:
+                return result
+
+            sufficiency = self.sufficiency(healthcontext, persona, as_of)
+            result = replace(result, sufficiency=sufficiency)
+            if not sufficiency.is_executable:
+                return result
+
+            need_attestation = sufficiency.attestation_variables
+            if need_attestation and require_attestation:
+                return replace(result, needs_attestation=tuple(need_attestation))
+
+            evaluated_records = sufficiency.context.evaluation_list
+            assessments = self.assess(evaluated_records, persona, as_of)
+            result = replace(result, assessments=assessments)
+
+            return replace(result, recommendations=self.recommendations(assessments, evaluated_records, persona, as_of))
+
+        except Exception as e:
+            log.error(f'ConcordEngine: evaluation failed for patient={healthcontext.identifier} error={e}')
+            return replace(result, error=e)
+
+    # ---- stages, `as_of` naive local time ---- #
+
+    def eligibility(self, healthcontext: HealthContext, as_of: datetime = None, context: EvaluationContext = None) -> EligibilityResult:
+        return self.eligibility_evaluator.evaluate(healthcontext, context=context or EvaluationContext(), as_of=as_of)
+
+    def sufficiency(self, healthcontext: HealthContext, persona: Persona, as_of: datetime = None, context: EvaluationContext = None) -> SufficiencyResult:
+        return self.__sufficiency_evaluators[persona].evaluate(healthcontext, context or EvaluationContext(), as_of=as_of)
+
+    def assess(self, evaluated_records: list, persona: Persona, as_of: datetime = None, context: EvaluationContext = None) -> AssessmentResult:
+        return self.assessment_evaluator.assess(
+            assessment_variables=self.demanded(self.cpg.assessments_variables, persona),
+            evaluated_records=evaluated_records,
+            persona=persona,
+            functions_module=self.cpg.functions_module,
+            context=context or EvaluationContext(),
+            dependency_graph=self.cpg.assessment_graph,
+            as_of=as_of)
+
+    def recommendations(self, assessments: AssessmentResult, evaluated_records: list, persona: Persona, as_of: datetime = None,
+                        raise_errors: bool = False, context: EvaluationContext = None) -> RecommendationResult:
+        """raise_errors: when False, a recommendation that cannot be evaluated keeps the error in `EvaluatedRecommendation.error`"""
+        return self.recommendation_result([
+            self.evaluate_recommendation(recommendation, assessments, evaluated_records, persona, as_of, raise_errors)
+            for recommendation in self.demanded(self.cpg.recommendation_variables, persona)], context)
+
+    @staticmethod
+    def evaluate_recommendation(recommendation: RecommendationVar, assessments: AssessmentResult, evaluated_records: list, persona: Persona, as_of: datetime,
+                                raise_errors: bool = False) -> EvaluatedRecommendation:
+        """One recommendation evaluated against the assessments; a failure is kept as its `error` unless `raise_errors`"""
+        eval_rec = EvaluatedRecommendation(recommendation=recommendation)
+        try:
+            eval_rec.evaluate(assessments.context.evaluation_list, evaluated_records=evaluated_records, persona=persona, as_of=as_of)
+        except Exception as e:
+            if raise_errors:
+                raise e
+            log.warning(f'Recommendation={recommendation.id} could not be evaluated: {e}')
+            eval_rec.error = e
+        log.debug(eval_rec)
+        return eval_rec
+
+    @staticmethod
+    def recommendation_result(evaluated_recommendations: list[EvaluatedRecommendation], context: EvaluationContext = None) -> RecommendationResult:
+        """Result of recommendations given in definition order; applied ones first"""
+        return RecommendationResult(
+            context=context or EvaluationContext(),
+            recommendations=sorted(evaluated_recommendations, key=lambda er: er.applies if er.applies else False, reverse=True))
+
+    def demanded(self, variables: list, persona: Persona) -> list:
+        """`variables` evaluated for `persona`: all of them, or in demand driven mode those reached by its recommendations"""
+        demanded = self.__demanded_ids[persona]
+        return variables if demanded is None else [v for v in variables if v.id in demanded]
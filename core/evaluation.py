@@ -3,7 +3,7 @@ import logging
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum, auto
-from uuid import uuid1
+from uuid import UUID, uuid4
 from variables.record import Record
 
 log = logging.getLogger(__name__)
@@ -92,8 +92,9 @@ class EvaluatedRecord:
 @dataclass
 class EvaluationContext:
 
-    id = uuid1()
     evaluation_list: list[EvaluatedRecord] = field(default_factory=list[EvaluatedRecord])
+    id: UUID = field(default_factory=uuid4)
+    """unique to each context"""
 
     @property 
     def errors(self):
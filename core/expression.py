@@ -1,30 +1,28 @@
 #!/usr/bin/env python3
 
 from dataclasses import dataclass
+from datetime import datetime
 from functools import cached_property
 from re import findall
 from primitives.errors import ExpressionVariableNotFound, ExpressionEvaluationError, VariableEvaluationError
-from primitives.varstring import VarString
+from primitives.varstring import CompiledExpression
 from variables.value import Value
-import simpleeval, logging
+from variables.record import record_table
+import logging
 
 log = logging.getLogger(__name__)
 
 
 class Expression:
+    """Evaluator of a compiled expression.
 
-    def __init__(self, expression_string: str):
-        self.string = VarString(expression_string)
-        self.__expression_records =  []
-        self._result = None
-    
-    @property
-    def expression_records(self):
-        return self.__expression_records
+    Keeps no state between evaluations: one instance is shared by every evaluation of its variable,
+    from any number of threads. The records an evaluation used are returned with its result.
+    """
 
-    @property
-    def result(self):
-        return self._result
+    def __init__(self, expression: str | CompiledExpression):
+        self.compiled = expression if isinstance(expression, CompiledExpression) else CompiledExpression.compile(expression)
+        self.string = self.compiled.string
 
     def __str__(self) -> str:
         return f'Expression({self.string})'
@@ -33,13 +31,14 @@ class Expression:
     def variable_identifiers(self):
         return self.string.variable_identifiers
 
-    def evaluate_recommendation(self, evaluated_records):
+    def evaluate_recommendation(self, evaluated_records, based_on: list = None):
+        """based_on: the assessment records the expression used are appended to it"""
 
         assessment_ids = self.string.variable_identifiers
         if not assessment_ids:
             raise ValueError(f'Expression must have AssessmentVariable identifiers, none fouund in {self.string}')
         
-        self.__expression_records = []
+        expression_records = []
         expression_values = {}
         errors = []
         for assessment_var_id in assessment_ids:
@@ -52,7 +51,7 @@ class Expression:
                         # errors.append(ValueError(f'Assessments in a recommendation must have bool-type value, found:{type(filtered.record.value.value)}')) 
                         # continue 
                     expression_values[assessment_var_id] = filtered.record.value.value
-                    self.__expression_records.append(filtered.record)
+                    expression_records.append(filtered.record)
                 else:
                     errors.append(KeyError(f'No value for Assessment={filtered.id} in {self.string}'))
                     continue
@@ -64,18 +63,20 @@ class Expression:
         if errors:
             raise VariableEvaluationError(errors, f'expression={self.string}')
 
-        try:
-            expstr = self.string.replace('$', '')
-            expression_result = simpleeval.simple_eval(expstr, names=expression_values)
-            if not isinstance(expression_result, bool):
-                raise ValueError(f'Recommendation.expression result must be a bool-type, got={type(expression_result)}')
-            return expression_result
-        except Exception as e:
-            raise e
+        expression_result = self.compiled.evaluate(expression_values)
+        if not isinstance(expression_result, bool):
+            raise ValueError(f'Recommendation.expression result must be a bool-type, got={type(expression_result)}')
+        if based_on is not None:
+            based_on.extend(expression_records)
+        return expression_result
 
-    def evaluate(self, records):
+    def evaluate(self, records, as_of: datetime = None):
+        """records: list of `Record` or a name table (id -> Record)
+        as_of: date of the resulting `Value`, now if not given
+        Returns a `Value` whose source is the records the expression used"""
 
-        self.__expression_records = []  
+        records = record_table(records)
+        expression_records = []
         expression_tags = self.string.tags
         if not expression_tags:
             raise ValueError(f'Expressions must have variable-identifiers, none found in {self.string}')
@@ -90,7 +91,7 @@ class Expression:
             comps = exp_var_id.split('.')
             var_id = comps[0]
             func = comps[1] if len(comps) == 2 else None 
-            filtered_record = next(filter(lambda record: record.id == var_id, records), None)
+            filtered_record = records.get(var_id)
             
             if filtered_record:
                 expression_values.update({filtered_record.id: filtered_record.as_dict()})
@@ -110,17 +111,15 @@ class Expression:
 
 
                 expression_values[var_id] = var_value
-                self.__expression_records.append(filtered_record)
+                expression_records.append(filtered_record)
 
             # Cannot find the variable: Raise ERROR!
             else:
                 raise ExpressionVariableNotFound(exp_var_id, self.string)
+        expstr = self.compiled.source
         try:
-            expstr = self.string.replace('$', '')
-            evaluator = simpleeval.SimpleEval(names=expression_values)
-            # evaluator.ATTR_INDEX_FALLBACK=True 
-            expression_result = evaluator.eval(expstr)
-            self._result = Value(expression_result, source=self.__expression_records)
+            expression_result = self.compiled.evaluate(expression_values)
+            result = Value(expression_result, date=as_of, source=expression_records)
             log.debug(f'Evaluatingvalues={expression_values}, expression={expstr}, result={expression_result}')
         except TypeError as e:
             ve = ExpressionEvaluationError(expstr, expression_values,  str(e))
@@ -129,6 +128,6 @@ class Expression:
             ve = ExpressionEvaluationError(expstr, expression_values,  str(e))
             raise ve
             
-        return self._result
+        return result
 
 
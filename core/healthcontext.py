@@ -6,6 +6,8 @@ from datetime import date
 
 from primitives.types import Persona
 from variables import var, value, record
+from variables.codeindex import CodeIndex
+from primitives.vcolumns import vcolumns
 
 
 @dataclass(frozen=True)
@@ -13,11 +15,17 @@ class HealthContext:
 
     records: list[record.Record]
     persona: Persona
+    identifier: str = None
+    """Patient identifier, carried into cohort results"""
 
     @classmethod
-    def from_values(cls, values: list[value.Value], for_variables: list[var.Var], age: record.Record, gender: record.Record, race: record.Record, persona: Persona, until_date: date = None):
+    def from_values(cls, values: list[value.Value], for_variables: list[var.Var], age: record.Record, gender: record.Record, race: record.Record, persona: Persona, until_date: date = None, code_index: CodeIndex = None, columnar: bool = False, identifier: str = None):
+        """code_index: index of `for_variables` (`CPG.code_index`), built if not given
+        columnar: keep numeric histories in a `vcolumns` store instead of a list of `Value`"""
         
-        var_values = [[var.Var('-',code=v.code), v] for v in values]
+        code_index = code_index or CodeIndex.for_variables(for_variables)
+        # bucket values by variable in a single pass
+        var_values = code_index.bucket(values, lambda v: v.code)
         till_date = until_date or date.today().replace(month=12, day=31)
         # FOR EACH VAR, BUILD A RECORD WITH VALUES
         records = [] 
@@ -31,16 +39,17 @@ class HealthContext:
             
         for variable in for_variables:
             
-            filtered_values = list(filter(lambda value: value[0] == variable, var_values))
-            vals = [t[1] for t in filtered_values] if filtered_values else None
+            vals = var_values.get(variable.id)
             if vals:
                 vals = list(filter(lambda v: v.date.date() <= till_date, vals))
 
+            if vals and columnar:
+                vals = vcolumns.from_values(vals) or vals
             rec = record.Record(variable, vals if vals else None)
             records.append(rec)
        
 
 
-        return HealthContext(records=records, persona=persona)
+        return HealthContext(records=records, persona=persona, identifier=identifier)
 
 
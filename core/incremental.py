@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Incremental re-evaluation of one patient as new data arrives.
+#
+#   evaluation = IncrementalEvaluation(engine, healthcontext)
+#   changes = evaluation.update({'ldl': [Value(190, date=...)]})
+#
+# An update re-validates the records of the changed variables (and of variables whose panel
+# validators read them), then re-evaluates only the assessments and recommendations that reach them
+# in the CPG's dependency graph (`CPG.dependency_graph`); everything else is carried over from the
+# previous result. A patient who was not eligible stays so unless eligibility inputs change, and
+# insufficient data only has its changed records re-checked. When eligibility could change, the data
+# becomes sufficient or no longer is, or the previous evaluation failed, the CPG is evaluated again
+# from the start.
+
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Iterable
+import logging
+
+from .assessment import AssessmentResult
+from .dependency import references
+from .engine import ConcordEngine, ConcordResult
+from .evaluation import EvaluationContext
+from .healthcontext import HealthContext
+from .recommendation import EvaluatedRecommendation
+from .sufficiency import SufficiencyEvaluator, SufficiencyResult
+from primitives.types import Persona
+from primitives.vcolumns import vcolumns
+from variables.record import Record
+from variables.value import Value
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RecommendationChange:
+    """State of a recommendation before and after an update"""
+
+    id: str
+    applied: bool
+    applies: bool
+    was_compliant: bool
+    compliant: bool
+    previous_narrative: str = None
+    narrative: str = None
+
+    @property
+    def newly_applied(self) -> bool:
+        return bool(self.applies) and not self.applied
+
+    @property
+    def withdrawn(self) -> bool:
+        return bool(self.applied) and not self.applies
+
+
+def _source_key(value: Value):
+    # the resource a value came from: a value from the same resource replaces it
+    for source in value.source or []:
+        if reference := getattr(source, 'reference', None):
+            if isinstance(reference, str):
+                return reference
+        if isinstance(source, dict) and source.get('id'):
+            return f'{source.get("resourceType")}/{source["id"]}'
+        if getattr(source, 'id', None) and hasattr(source, 'resource_type'):
+            return f'{source.resource_type}/{source.id}'
+    return None
+
+
+class IncrementalEvaluation:
+    """Evaluation of a CPG for one patient, kept and updated with new or changed values"""
+
+    def __init__(self, engine: ConcordEngine, healthcontext: HealthContext, persona: Persona = None, as_of: datetime = None):
+        self.engine = engine
+        self.persona = persona or healthcontext.persona
+        self.as_of = as_of
+        self.healthcontext = healthcontext
+        self.result: ConcordResult = engine.evaluate(healthcontext, self.persona, as_of=as_of)
+        self.__variables = {v.id: v for v in engine.cpg.variables}
+        self.__eligibility_inputs = self.__inputs(engine.cpg.eligibility_criterias)
+        # variable id -> index of its record in `healthcontext.records`, the first one when repeated
+        self.__positions = {}
+        for i, record in enumerate(healthcontext.records):
+            self.__positions.setdefault(record.var.id, i)
+
+    def update(self, values: dict[str, Iterable[Value]]) -> list[RecommendationChange]:
+        """Adds the values (variable id -> new or changed values) and re-evaluates what depends on them;
+        the recommendations whose state (applies, compliant, narrative) changed"""
+        unknown = set(values) - set(self.__variables)
+        if unknown:
+            raise ValueError(f'IncrementalEvaluation: no variables={sorted(unknown)} in CPG={self.engine.cpg.identifier}')
+
+        previous = self.result
+        self.healthcontext = self.__merged(values)
+        # variables sharing a code read the same data
+        code_index = self.engine.cpg.code_index
+        changed = set(values).union(*(code_index.matches(self.__variables[vid].code) for vid in values))
+        if previous.error or previous.eligibility is None or self.__eligibility_inputs is None or changed & self.__eligibility_inputs:
+            self.result = self.engine.evaluate(self.healthcontext, self.persona, as_of=self.as_of)
+        elif not previous.is_eligible:
+            # eligibility does not read the changed variables
+            self.result = previous
+        else:
+            self.result = self.__reevaluate(previous, changed) or self.engine.evaluate(self.healthcontext, self.persona, as_of=self.as_of)
+        return self.changes(previous, self.result)
+
+    @staticmethod
+    def changes(previous: ConcordResult, result: ConcordResult) -> list[RecommendationChange]:
+        before = {er.recommendation.id: er for er in (previous.recommendations.recommendations if previous.recommendations else [])}
+        after = {er.recommendation.id: er for er in (result.recommendations.recommendations if result.recommendations else [])}
+        changes = []
+        for rid in dict.fromkeys([*before, *after]):
+            b, a = before.get(rid), after.get(rid)
+            state_b = (b.applies, b.compliant, b.narrative) if b else (None, None, None)
+            state_a = (a.applies, a.compliant, a.narrative) if a else (None, None, None)
+            if state_b != state_a:
+                changes.append(RecommendationChange(rid, state_b[0], state_a[0], state_b[1], state_a[1], state_b[2], state_a[2]))
+        return changes
+
+    def __reevaluate(self, previous: ConcordResult, changed: set[str]) -> ConcordResult:
+        """Result with the dependents of `changed` re-evaluated; None when it needs a full evaluation"""
+        cpg, graph = self.engine.cpg, self.engine.cpg.dependency_graph
+        affected = graph.dependents_of(changed) | changed
+        user_records = self.__user_records(changed)
+
+        # variables: the changed records are rebuilt, they and the records whose panel validators read them re-checked
+        evaluations = {ev.id: ev for ev in previous.sufficiency.context.evaluation_list}
+        records = [SufficiencyEvaluator.record(ev.record.var, user_records.get(ev.id), self.as_of) if ev.id in changed else ev.record
+                   for ev in evaluations.values()]
+        check = EvaluationContext()
+        SufficiencyEvaluator.check(records, self.persona, check, identifiers=affected)
+        evaluations.update({ev.id: ev for ev in check.evaluation_list})
+        sufficiency = SufficiencyResult(EvaluationContext(list(evaluations.values())))
+        if not previous.evaluated:
+            # insufficient before, so nothing was assessed
+            return None if sufficiency.is_executable else replace(previous, sufficiency=sufficiency)
+        if not sufficiency.is_executable:
+            return None
+        evaluated_records = sufficiency.context.evaluation_list
+
+        # assessments: the affected ones, in dependency order, against the carried over ones
+        assessed = {ev.id: ev for ev in previous.assessments.context.evaluation_list}
+        stale = [cpg_var for cpg_var in cpg.assessments_variables if cpg_var.id in assessed and cpg_var.id in affected]
+        if stale:
+            kept = [ev for rid, ev in assessed.items() if rid not in affected]
+            reassessed = self.engine.assessment_evaluator.assess(
+                assessment_variables=stale,
+                evaluated_records=evaluated_records + kept,
+                persona=self.persona,
+                functions_module=cpg.functions_module,
+                context=EvaluationContext(),
+                dependency_graph=cpg.assessment_graph,
+                as_of=self.as_of)
+            assessed.update({ev.id: ev for ev in reassessed.context.evaluation_list})
+        assessments = AssessmentResult(EvaluationContext(list(assessed.values())))
+
+        # recommendations: the affected ones, in definition order like a full evaluation
+        recommended = {er.recommendation.id: er for er in previous.recommendations.recommendations}
+        evaluated_recommendations: list[EvaluatedRecommendation] = []
+        reevaluated = 0
+        for recommendation in cpg.recommendation_variables:
+            if recommendation.id not in recommended:
+                continue
+            if recommendation.id in affected:
+                evaluated_recommendations.append(self.engine.evaluate_recommendation(recommendation, assessments, evaluated_records, self.persona, self.as_of))
+                reevaluated += 1
+            else:
+                evaluated_recommendations.append(recommended[recommendation.id])
+
+        log.debug(f'IncrementalEvaluation: patient={self.healthcontext.identifier} changed={sorted(changed)} '
+                  f'reassessed={len(stale)} recommendations={reevaluated}')
+        return replace(previous, sufficiency=sufficiency, assessments=assessments,
+                       recommendations=self.engine.recommendation_result(evaluated_recommendations))
+
+    def __merged(self, values: dict[str, Iterable[Value]]) -> HealthContext:
+        """Health context with the values added, replacing values from the same source"""
+        records = list(self.healthcontext.records)
+        positions = self.__positions
+        for var_id, new_values in values.items():
+            new_values = list(new_values)
+            replaced = {k for k in map(_source_key, new_values) if k}
+            i = positions.get(var_id)
+            existing = records[i].unfiltered_values if i is not None else None
+            merged = [v for v in existing or [] if not replaced or _source_key(v) not in replaced] + new_values
+            if isinstance(existing, vcolumns):
+                merged = vcolumns.from_values(merged) or merged
+            record = Record(self.__variables[var_id], merged or None)
+            if i is None:
+                positions[var_id] = len(records)
+                records.append(record)
+            else:
+                records[i] = record
+        return replace(self.healthcontext, records=records)
+
+    def __user_records(self, identifiers: set[str]) -> dict[str, Record]:
+        """variable id -> first user record sharing a code with it, as `SufficiencyEvaluator` finds them"""
+        code_index = self.engine.cpg.code_index
+        found = {}
+        for record in self.healthcontext.records:
+            for vid in code_index.matches(record.var.code):
+                if vid in identifiers:
+                    found.setdefault(vid, record)
+            if len(found) == len(identifiers):
+                break
+        return found
+
+    def __inputs(self, variables: list) -> set[str]:
+        # identifiers the variables read; None when any of them cannot be determined
+        inputs = set()
+        for variable in variables or []:
+            refs = references(variable, self.engine.cpg.functions_module)
+            if refs is None:
+                return None
+            inputs.update(refs)
+        return inputs
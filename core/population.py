@@ -0,0 +1,655 @@
+#!/usr/bin/env python3
+
+# Population engine: evaluates a CPG over a whole cohort with NumPy array operations.
+#
+# The latest value of each CPG variable becomes a `Column` over all patients, and eligibility,
+# assessment and recommendation expressions are translated into array passes over those columns.
+# A value is either present, missing (None in the scalar engine) or failed (the scalar engine raised);
+# both propagate as in simpleeval, so each patient gets the result `core.cohort.evaluate_patient`
+# gives with `require_attestation=False`. CPG functions run through their batch implementation
+# (`primitives.batch`) when they have one; they, and expressions that cannot be translated,
+# are otherwise evaluated row by row.
+
+import ast, logging, operator
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from .cohort import PatientResult, PatientStatus
+from .cpg import CPG
+from .dependency import function_inputs
+from .eligibility import EligibilityEvaluator
+from .healthcontext import HealthContext
+from .recommendation import RecommendationType, RecommendationVar
+from primitives.batch import batch_result
+from primitives.errors import ExpressionError
+from primitives.types import Persona
+from primitives.varstring import CompiledExpression
+from variables.record import Record, record_table
+from variables.value import Value
+
+log = logging.getLogger(__name__)
+
+BOOL, INT, NUMBER, OBJECT, NONE = 'bool', 'int', 'number', 'object', 'none'
+_NUMERIC = (BOOL, INT, NUMBER)
+_DISPLAY = {
+    RecommendationType.DISPLAY: None,
+    RecommendationType.DISPLAY_PROVIDER: Persona.provider,
+    RecommendationType.DISPLAY_PATIENT: Persona.patient,
+}
+
+
+def _objects(values) -> np.ndarray:
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+@dataclass(frozen=True)
+class Column:
+    """One value per patient.
+
+    `data` is float64 for bool, int and number kinds and an object array otherwise.
+    `missing` marks None values; `failed` marks evaluations that raised, or records not found.
+    """
+
+    data: np.ndarray
+    missing: np.ndarray
+    failed: np.ndarray
+    kind: str = NUMBER
+    count: np.ndarray = None
+    """number of values for `$x.count`, -1 when there are none"""
+    dates: np.ndarray = None
+    """`ValueDate` of the latest value for `$x.date`"""
+    values: np.ndarray = None
+    """latest `Value` of a variable, as CPG functions get it"""
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def present(self) -> np.ndarray:
+        return ~(self.missing | self.failed)
+
+    def value(self, i: int):
+        """Value of patient `i` as the scalar engine has it; None when missing or failed"""
+        if self.missing[i] or self.failed[i]:
+            return None
+        v = self.data[i]
+        if self.kind == BOOL:
+            return bool(v)
+        if self.kind == INT:
+            return int(v)
+        if self.kind == NUMBER:
+            return float(v)
+        return v
+
+    def value_object(self, i: int) -> Value:
+        if self.values is not None:
+            return self.values[i]
+        v = self.value(i)
+        return Value(v) if v is not None else None
+
+    def to_list(self) -> list:
+        return [self.value(i) for i in range(len(self))]
+
+    @classmethod
+    def from_values(cls, items: list, failed: np.ndarray = None, **kwargs) -> 'Column':
+        """Column of python values, None for missing"""
+        n = len(items)
+        missing = np.fromiter((v is None for v in items), dtype=bool, count=n)
+        present = [v for v in items if v is not None]
+        if not present:
+            kind = NONE
+        elif all(type(v) is bool for v in present):
+            kind = BOOL
+        elif all(type(v) in (bool, int) for v in present):
+            kind = INT
+        elif all(type(v) in (bool, int, float) for v in present):
+            kind = NUMBER
+        else:
+            kind = OBJECT
+        if kind == OBJECT:
+            data = _objects(items)
+        else:
+            data = np.fromiter((0.0 if v is None else float(v) for v in items), dtype=float, count=n)
+        failed = np.zeros(n, dtype=bool) if failed is None else failed
+        return cls(data, missing & ~failed, failed, kind, **kwargs)
+
+    @classmethod
+    def of_records(cls, records: list) -> 'Column':
+        """Column of the latest values of `records`; a None record is not found and fails"""
+        n = len(records)
+        latest = [r.value if r is not None else None for r in records]
+        return cls.from_values(
+            [v.evaluation_val if v is not None else None for v in latest],
+            failed=np.fromiter((r is None for r in records), dtype=bool, count=n),
+            count=np.fromiter((len(r.values) if r is not None and r.values is not None else -1 for r in records), dtype=np.int64, count=n),
+            dates=_objects([v.date if v is not None else None for v in latest]),
+            values=_objects(latest))
+
+
+@dataclass(frozen=True)
+class PopulationData:
+    """A cohort loaded for one CPG: the CPG variables as matched by `SufficiencyEvaluator`,
+    and the health context records that eligibility criteria read by id."""
+
+    identifiers: list
+    personas: np.ndarray
+    variables: dict[str, Column]
+    context: dict[str, Column]
+    invalid: dict[str, np.ndarray]
+    """variable id -> patients whose value fails validation"""
+
+    def __len__(self) -> int:
+        return len(self.identifiers)
+
+    @classmethod
+    def from_healthcontexts(cls, cpg: CPG, healthcontexts: Iterable[HealthContext], as_of: datetime = None) -> 'PopulationData':
+        """as_of: evaluation date (naive local), as `Concord.evaluation_date`"""
+
+        variables = cpg.variables or []
+        context_ids = _eligibility_identifiers(cpg)
+        identifiers, personas = [], []
+        records = {v.id: [] for v in variables}
+        context = {vid: [] for vid in context_ids}
+        invalid = {v.id: [] for v in variables}
+
+        for hc in healthcontexts:
+            identifiers.append(hc.identifier)
+            personas.append(hc.persona)
+
+            table = record_table(hc.records)
+            for vid in context_ids:
+                record = table.get(vid)
+                context[vid].append(EligibilityEvaluator.until(record, as_of) if record and as_of else record)
+
+            firsts = cpg.code_index.first(hc.records, lambda r: r.var.code)
+            patient_records = []
+            for var in variables:
+                user_record = firsts.get(var.id)
+                values = user_record.values_until(as_of) if user_record and user_record.has_value else None
+                patient_records.append(Record(var, values or None, as_of=as_of))
+
+            for record in patient_records:
+                records[record.id].append(record)
+                try:
+                    record.validate(records=patient_records, strict=True)
+                    invalid[record.id].append(False)
+                except Exception:
+                    invalid[record.id].append(True)
+
+        n = len(identifiers)
+        return cls(
+            identifiers,
+            _objects(personas),
+            {vid: Column.of_records(rs) for vid, rs in records.items()},
+            {vid: Column.of_records(rs) for vid, rs in context.items()},
+            {vid: np.fromiter(flags, dtype=bool, count=n) for vid, flags in invalid.items()})
+
+
+def _eligibility_identifiers(cpg: CPG) -> list[str]:
+    ids = []
+    for criteria in cpg.eligibility_criterias or []:
+        if criteria.function:
+            ids.extend(function_inputs(cpg.functions_module, criteria.function) or [])
+        elif criteria.expression:
+            ids.extend(criteria.compiled_expression.variable_identifiers or [])
+    return list(dict.fromkeys(ids))
+
+
+@dataclass(frozen=True)
+class PopulationResult:
+    """Result columns of one CPG; assessments and recommendations only hold for `evaluated` patients"""
+
+    data: PopulationData
+    eligible: np.ndarray
+    eligibility_failed: np.ndarray
+    failed_criterias: dict[str, np.ndarray]
+    """eligibility criteria id -> patients for whom the criteria could not be evaluated"""
+    insufficient: dict[str, np.ndarray]
+    """variable id -> patients for whom the variable makes the data insufficient"""
+    needs_attestation: dict[str, np.ndarray]
+    """variable id -> patients who would be asked to attest the variable"""
+    assessments: dict[str, Column]
+    recommendations: dict[str, Column]
+    """recommendation id -> applies"""
+    compliance: dict[str, Column]
+    """recommendation id -> result of its compliance expression"""
+
+    @property
+    def executable(self) -> np.ndarray:
+        executable = np.ones(len(self.data), dtype=bool)
+        for mask in self.insufficient.values():
+            executable &= ~mask
+        return executable
+
+    @property
+    def evaluated(self) -> np.ndarray:
+        return self.eligible & self.executable
+
+    def applies(self, recommendation_id: str) -> np.ndarray:
+        col = self.recommendations[recommendation_id]
+        return (col.data != 0) & col.present & self.evaluated
+
+    def counts(self) -> dict[str, int]:
+        """Number of patients each recommendation applies to"""
+        return {rid: int(self.applies(rid).sum()) for rid in self.recommendations}
+
+    def patient_results(self) -> Iterator[PatientResult]:
+        """`PatientResult` of each patient, as `core.cohort.evaluate_patient` returns them"""
+        executable = self.executable
+        for i, identifier in enumerate(self.data.identifiers):
+            if self.eligibility_failed[i]:
+                e = self.__eligibility_error(i)
+                yield PatientResult(identifier, PatientStatus.failed, error=f'{type(e).__name__}: {e}')
+            elif not self.eligible[i]:
+                yield PatientResult(identifier, PatientStatus.not_eligible, eligible=False)
+            elif not executable[i]:
+                insufficient = tuple(vid for vid, mask in self.insufficient.items() if mask[i])
+                yield PatientResult(identifier, PatientStatus.insufficient, eligible=True, insufficient=insufficient)
+            else:
+                yield PatientResult(
+                    identifier,
+                    PatientStatus.evaluated,
+                    eligible=True,
+                    assessments={aid: PatientResult.compact(col.value(i)) for aid, col in self.assessments.items()},
+                    failed_assessments=tuple(aid for aid, col in self.assessments.items() if col.failed[i]),
+                    recommendations={rid: (col.value(i), self.__compliant(rid, i)) for rid, col in self.recommendations.items()},
+                    failed_recommendations=tuple(rid for rid, col in self.recommendations.items()
+                                                 if col.failed[i] or (rid in self.compliance and self.compliance[rid].failed[i])))
+
+    def __eligibility_error(self, i: int) -> ExceptionGroup:
+        # as `EligibilityEvaluator` raises it, one sub-exception per criteria that failed
+        return ExceptionGroup('EligibilityEvaluationError', [
+            ExpressionError(cid, 'Eligibility criteria could not be evaluated') for cid, mask in self.failed_criterias.items() if mask[i]])
+
+    def __compliant(self, rid: str, i: int):
+        # compliance is only evaluated once the recommendation itself is
+        if rid not in self.compliance or self.recommendations[rid].failed[i]:
+            return None
+        return PatientResult.compact(self.compliance[rid].value(i))
+
+
+class PopulationEngine:
+    """Evaluates one CPG over `PopulationData`: each expression runs once over all patients"""
+
+    def __init__(self, cpg: CPG):
+        self.cpg = cpg
+
+    def evaluate(self, data: PopulationData) -> PopulationResult:
+
+        n = len(data)
+        eligible, failed_criterias = self.__eligibility(data, n)
+        eligibility_failed = np.zeros(n, dtype=bool)
+        for mask in failed_criterias.values():
+            eligibility_failed |= mask
+        eligible &= ~eligibility_failed
+
+        # required variables without a valid value that cannot be attested break the CPG
+        insufficient, needs_attestation = {}, {}
+        for var in self.cpg.variables or []:
+            col = data.variables[var.id]
+            if var.user_attestable:
+                needs_attestation[var.id] = col.missing.copy()
+            elif var.required:
+                insufficient[var.id] = col.missing | data.invalid[var.id]
+
+        # assessments in dependency order, over the variables and earlier assessments
+        names = dict(data.variables)
+        by_id = {av.id: av for av in self.cpg.assessments_variables or []}
+        assessed = {}
+        for aid in self.cpg.assessment_graph.order:
+            av = by_id[aid]
+            col = self.__function(av.function, names, n) if av.function else self.__expression(av.compiled_expression, names, n)
+            assessed[aid] = _assessed(col)
+            names.setdefault(aid, assessed[aid])
+        assessments = {aid: assessed[aid] for aid in by_id}
+
+        recommendations, compliance = {}, {}
+        for rec in self.cpg.recommendation_variables or []:
+            recommendations[rec.id] = self.__recommendation(rec, assessments, data.personas, n)
+            if rec.compiled_compliance_expression and rec.type not in _DISPLAY:
+                compliance[rec.id] = _assessed(self.__expression(rec.compiled_compliance_expression, data.variables, n))
+
+        return PopulationResult(data, eligible, eligibility_failed, failed_criterias, insufficient, needs_attestation, assessments, recommendations, compliance)
+
+    def __eligibility(self, data: PopulationData, n: int):
+        # any criteria that raises fails eligibility; a criteria equal to False excludes
+        eligible, failed = np.ones(n, dtype=bool), {}
+        for criteria in self.cpg.eligibility_criterias or []:
+            if criteria.function:
+                col = self.__function(criteria.function, data.context, n)
+            else:
+                col = self.__expression(criteria.compiled_expression, data.context, n)
+            col = _assessed(col)
+            failed[criteria.id] = col.failed
+            eligible &= ~_equals_false(col)
+        return eligible, failed
+
+    def __expression(self, compiled: CompiledExpression, names: dict, n: int) -> Column:
+        allowed = set(compiled.variable_identifiers or [])
+        try:
+            return _Vectorizer(names, allowed, n).eval(compiled.node)
+        except _Unsupported as e:
+            log.info(f'Population: expression={compiled.source} evaluated row by row ({e})')
+            return _rowwise(compiled, names, n)
+
+    def __function(self, function: str, names: dict, n: int) -> Column:
+        func = getattr(self.cpg.functions_module, function)
+        inputs = function_inputs(self.cpg.functions_module, function)
+        input_ids = list(names) if inputs is None else [i for i in inputs if i in names]
+
+        batch = getattr(func, 'batch', None)
+        if batch is not None and n > 1:
+            try:
+                data, failed = batch_result(batch({vid: _batch_input(names[vid]) for vid in input_ids}), n)
+                return Column.from_values([None if f else v for v, f in zip(data.tolist(), failed)], failed=failed)
+            except Exception as e:
+                log.warning(f'Population: batch function={function} failed, evaluating row by row: {e}')
+
+        results = []
+        for i in range(n):
+            try:
+                results.append(func({vid: names[vid].value_object(i) for vid in input_ids}))
+            except Exception as e:
+                log.debug(f'Population: function={function} failed for row={i}: {e}')
+                results.append(None)
+        # a function returning None fails
+        return Column.from_values(results, failed=np.fromiter((r is None for r in results), dtype=bool, count=n))
+
+    def __recommendation(self, rec: RecommendationVar, assessments: dict, personas: np.ndarray, n: int) -> Column:
+
+        if rec.type in _DISPLAY:
+            persona = _DISPLAY[rec.type]
+            applies = np.ones(n, dtype=bool) if persona is None else np.fromiter((p == persona for p in personas), dtype=bool, count=n)
+            return Column(applies.astype(float), np.zeros(n, dtype=bool), np.zeros(n, dtype=bool), BOOL)
+
+        ids = rec.compiled_expression.variable_identifiers if rec.compiled_expression else None
+        if not ids:
+            return Column(np.zeros(n), np.zeros(n, dtype=bool), np.ones(n, dtype=bool), BOOL)
+
+        # every assessment it reads must have a value
+        failed = np.zeros(n, dtype=bool)
+        names = {}
+        for aid in ids:
+            col = assessments.get(aid)
+            if col is None:
+                failed[:] = True
+            else:
+                failed |= ~col.present
+                names[aid] = col
+
+        col = self.__expression(rec.compiled_expression, names, n)
+        # and the result must be a bool
+        failed |= col.failed | ~_is_bool(col)
+        return Column(np.where(failed, 0.0, _truthy(col).astype(float)), np.zeros(n, dtype=bool), failed, BOOL)
+
+
+def _batch_input(col: Column) -> np.ma.MaskedArray:
+    # `Value.value` of each patient, masked where the scalar function gets None
+    if col.kind in _NUMERIC:
+        data = col.data
+    elif col.values is not None:
+        data = _objects([v.value if v is not None else None for v in col.values])
+    else:
+        data = col.data
+    return np.ma.masked_array(data, mask=~col.present)
+
+
+def _assessed(col: Column) -> Column:
+    # `Value(None)` raises: a result of None fails, and reads as None in later expressions
+    failed = col.failed | col.missing
+    return Column(col.data, failed, failed, col.kind if col.kind != NONE else NUMBER, count=np.where(failed, -1, 1))
+
+
+def _truthy(col: Column) -> np.ndarray:
+    if col.kind == NONE:
+        return np.zeros(len(col), dtype=bool)
+    if col.kind == OBJECT:
+        truthy = np.fromiter((bool(v) for v in col.data), dtype=bool, count=len(col))
+    else:
+        truthy = col.data != 0
+    return truthy & ~col.missing
+
+
+def _equals_false(col: Column) -> np.ndarray:
+    if col.kind == OBJECT:
+        equal = np.fromiter((v == False for v in col.data), dtype=bool, count=len(col))
+    else:
+        equal = col.data == 0
+    return equal & col.present
+
+
+def _is_bool(col: Column) -> np.ndarray:
+    if col.kind == BOOL:
+        return ~col.missing
+    if col.kind == OBJECT:
+        return np.fromiter((type(v) is bool for v in col.data), dtype=bool, count=len(col)) & ~col.missing
+    return np.zeros(len(col), dtype=bool)
+
+
+def _rowwise(compiled: CompiledExpression, names: dict, n: int) -> Column:
+    """Scalar evaluation for each patient, with the names `Expression.evaluate` builds"""
+    results, failed = [], np.zeros(n, dtype=bool)
+    for i in range(n):
+        row = {}
+        try:
+            for tag in compiled.tags or []:
+                var_id, _, func = tag.partition('.')
+                col = names.get(var_id)
+                if col is None or col.failed[i] and not col.missing[i]:
+                    raise KeyError(f'{var_id} not found')
+                if func == 'count':
+                    row[var_id] = {'count': int(col.count[i])} if col.count is not None and col.count[i] >= 0 else None
+                elif func == 'date':
+                    row[var_id] = {'date': col.dates[i]} if col.dates is not None and col.dates[i] is not None else None
+                else:
+                    row[var_id] = col.value(i)
+            results.append(compiled.evaluate(row))
+        except Exception:
+            results.append(None)
+            failed[i] = True
+    return Column.from_values(results, failed=failed)
+
+
+class _Unsupported(Exception):
+    pass
+
+
+_ARITHMETIC = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+}
+_COMPARE = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Gt: operator.gt,
+    ast.Lt: operator.lt, ast.GtE: operator.ge, ast.LtE: operator.le,
+}
+
+
+class _Vectorizer:
+    """Translates a simpleeval node tree into array operations over `Column`s"""
+
+    def __init__(self, names: dict, allowed: set, n: int):
+        self.names = names
+        self.allowed = allowed
+        self.n = n
+
+    def eval(self, node) -> Column:
+        method = getattr(self, '_' + type(node).__name__, None)
+        if method is None:
+            raise _Unsupported(type(node).__name__)
+        return method(node)
+
+    def __zeros(self) -> np.ndarray:
+        return np.zeros(self.n, dtype=bool)
+
+    def __failed(self) -> Column:
+        return Column(np.zeros(self.n), self.__zeros(), np.ones(self.n, dtype=bool), NONE)
+
+    def __name(self, name: str) -> Column:
+        # only the expression's tags are defined names
+        return self.names.get(name) if name in self.allowed else None
+
+    # ---- leaves
+
+    def _Expr(self, node):
+        return self.eval(node.value)
+
+    def _Constant(self, node):
+        v, n = node.value, self.n
+        if v is None:
+            return Column(np.zeros(n), np.ones(n, dtype=bool), self.__zeros(), NONE)
+        if isinstance(v, bool):
+            return Column(np.full(n, float(v)), self.__zeros(), self.__zeros(), BOOL)
+        if isinstance(v, int):
+            return Column(np.full(n, float(v)), self.__zeros(), self.__zeros(), INT)
+        if isinstance(v, float):
+            return Column(np.full(n, v), self.__zeros(), self.__zeros(), NUMBER)
+        if isinstance(v, str):
+            return Column(_objects([v] * n), self.__zeros(), self.__zeros(), OBJECT)
+        raise _Unsupported(f'constant of type {type(v).__name__}')
+
+    def _Name(self, node):
+        col = self.__name(node.id)
+        if col is None:
+            return self.__failed()
+        # a failed assessment reads as None; a record not found raises
+        return Column(col.data, col.missing, col.failed & ~col.missing, col.kind)
+
+    def _Attribute(self, node):
+        if not isinstance(node.value, ast.Name) or node.attr not in ('count', 'date'):
+            raise _Unsupported(f'attribute {node.attr}')
+        col = self.__name(node.value.id)
+        if col is None:
+            return self.__failed()
+        if col.values is None:
+            raise _Unsupported(f'{node.attr} of an assessment')
+        # `$x.count` and `$x.date` are None without values, and None has no attributes
+        if node.attr == 'count':
+            return Column(np.maximum(col.count, 0).astype(float), self.__zeros(), col.failed | (col.count < 0), INT)
+        return Column(col.dates, self.__zeros(), col.failed | (col.dates == None), OBJECT)
+
+    # ---- operators
+
+    def _BinOp(self, node):
+        op = _ARITHMETIC.get(type(node.op))
+        if op is None:
+            raise _Unsupported(type(node.op).__name__)
+        a, b = self.eval(node.left), self.eval(node.right)
+        if a.kind == NONE or b.kind == NONE:
+            return self.__failed()
+        if a.kind not in _NUMERIC or b.kind not in _NUMERIC:
+            raise _Unsupported('arithmetic on objects')
+        # arithmetic with None raises, as does division by zero
+        failed = ~a.present | ~b.present
+        if isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+            failed |= b.data == 0
+        with np.errstate(all='ignore'):
+            data = op(a.data, np.where(failed, 1.0, b.data))
+        kind = NUMBER if isinstance(node.op, ast.Div) or NUMBER in (a.kind, b.kind) else INT
+        return Column(np.where(failed, 0.0, data), self.__zeros(), failed, kind)
+
+    def _UnaryOp(self, node):
+        a = self.eval(node.operand)
+        if isinstance(node.op, ast.Not):
+            return Column((~_truthy(a)).astype(float), self.__zeros(), a.failed, BOOL)
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            if a.kind == NONE:
+                return self.__failed()
+            if a.kind not in _NUMERIC:
+                raise _Unsupported('unary operator on objects')
+            data = -a.data if isinstance(node.op, ast.USub) else a.data
+            return Column(data, self.__zeros(), ~a.present, INT if a.kind == BOOL else a.kind)
+        raise _Unsupported(type(node.op).__name__)
+
+    def _Compare(self, node):
+        # `a < b < c` is `a < b and b < c`
+        left = self.eval(node.left)
+        result = None
+        for op_node, comparator in zip(node.ops, node.comparators):
+            op = _COMPARE.get(type(op_node))
+            if op is None:
+                raise _Unsupported(type(op_node).__name__)
+            right = self.eval(comparator)
+            step = self.__compare(op, left, right)
+            result = step if result is None else self.__and(result, step)
+            left = right
+        return result
+
+    def __compare(self, op, a: Column, b: Column) -> Column:
+        failed = a.failed | b.failed
+        either_missing = a.missing | b.missing
+
+        if op in (operator.eq, operator.ne):
+            if a.kind in _NUMERIC and b.kind in _NUMERIC:
+                equal = a.data == b.data
+            elif NONE in (a.kind, b.kind):
+                equal = self.__zeros()
+            else:
+                equal = np.fromiter((x == y for x, y in zip(self.__objects(a), self.__objects(b))), dtype=bool, count=self.n)
+            # None == None, and None differs from any value
+            equal = np.where(either_missing, a.missing & b.missing, equal)
+            return Column((equal if op is operator.eq else ~equal).astype(float), self.__zeros(), failed, BOOL)
+
+        # ordering with None raises, and so does ordering a string against a number
+        failed = failed | either_missing
+        if NONE in (a.kind, b.kind):
+            return self.__failed()
+        if a.kind in _NUMERIC and b.kind in _NUMERIC:
+            data = op(a.data, b.data)
+        else:
+            data = self.__zeros()
+            for i, (x, y) in enumerate(zip(self.__objects(a), self.__objects(b))):
+                if failed[i]:
+                    continue
+                try:
+                    data[i] = op(x, y)
+                except TypeError:
+                    failed[i] = True
+        return Column(np.where(failed, 0.0, data.astype(float)), self.__zeros(), failed, BOOL)
+
+    def _BoolOp(self, node):
+        result = self.eval(node.values[0])
+        combine = self.__and if isinstance(node.op, ast.And) else self.__or
+        for value in node.values[1:]:
+            result = combine(result, self.eval(value))
+        return result
+
+    def __and(self, a: Column, b: Column) -> Column:
+        # `a and b` is b where a is truthy, else a
+        return self.__select(_truthy(a) & ~a.failed, b, a, a.failed)
+
+    def __or(self, a: Column, b: Column) -> Column:
+        # `a or b` is a where a is truthy, else b
+        return self.__select(~_truthy(a) & ~a.failed, b, a, a.failed)
+
+    def _IfExp(self, node):
+        test = self.eval(node.test)
+        return self.__select(_truthy(test) & ~test.failed, self.eval(node.body), self.eval(node.orelse), test.failed)
+
+    def __select(self, mask: np.ndarray, a: Column, b: Column, failed: np.ndarray) -> Column:
+        """a where `mask`, else b; `failed` holds where neither is evaluated"""
+        kind = _merged_kind(a.kind, b.kind)
+        if kind == OBJECT:
+            data = np.where(mask, self.__objects(a), self.__objects(b))
+        else:
+            data = np.where(mask, a.data, b.data)
+        return Column(data, np.where(mask, a.missing, b.missing) & ~failed, failed | np.where(mask, a.failed, b.failed), kind)
+
+    def __objects(self, col: Column) -> np.ndarray:
+        if col.kind == OBJECT:
+            return col.data
+        return _objects(col.to_list())
+
+
+def _merged_kind(a: str, b: str) -> str:
+    if a == b or b == NONE:
+        return a
+    if a == NONE:
+        return b
+    if a in _NUMERIC and b in _NUMERIC:
+        return NUMBER if NUMBER in (a, b) else INT
+    return OBJECT
@@ -4,6 +4,7 @@
 # raheel
 
 from dataclasses import dataclass, field
+from datetime import datetime
 from enum import Enum, auto, StrEnum
 from functools import cached_property
 
@@ -15,6 +16,7 @@ from .expression import Expression
 from .evaluation import EvaluationContext
 from primitives import vlist
 from primitives.types import Persona, YMLStrEnum
+from primitives.varstring import CompiledExpression
 
 import logging
 
@@ -129,6 +131,31 @@ class RecommendationVar(var.Var):
     def __hash__(self):
         return super().__hash__()
 
+    @cached_property
+    def compiled_expression(self):
+        return CompiledExpression.compile(self.expression) if self.expression else None
+
+    @cached_property
+    def compiled_compliance_expression(self):
+        return CompiledExpression.compile(self.compliance_expression) if self.compliance_expression else None
+
+    @cached_property
+    def evaluator(self) -> Expression:
+        """`Expression` shared by every evaluation of this recommendation"""
+        return Expression(self.compiled_expression) if self.expression else None
+
+    @cached_property
+    def compliance_evaluator(self) -> Expression:
+        return Expression(self.compiled_compliance_expression) if self.compliance_expression else None
+
+    def may_apply(self, persona: Persona) -> bool:
+        """False for display recommendations meant for another persona; others may apply depending on their expression"""
+        if self.type == RecommendationType.DISPLAY_PROVIDER:
+            return persona == Persona.provider
+        if self.type == RecommendationType.DISPLAY_PATIENT:
+            return persona == Persona.patient
+        return True
+
     @classmethod
     def instantiate_from_yaml(cls, yml, InstantiationContext=None):
 
@@ -189,19 +216,31 @@ class EvaluatedRecommendation:
                     log.debug(f' --- --- ---> {s_rec}')
         
         return all_records
+
+    def based_on_resources(self):
+        """JSON of the FHIR resources behind the values of `based_on_records`, read one at a time as iterated;
+        a `SourceReference` is resolved from its file, unresolvable references are skipped."""
+        for record in self.based_on_records:
+            for value in record.values or []:
+                for source in value.source or []:
+                    if getattr(source, 'resolvable', False):
+                        yield source.resolve()
+                    elif isinstance(source, dict):
+                        yield source
+                    elif hasattr(source, 'as_json'):
+                        yield source.as_json()
             
     def __post_init__(self):
         
-        if self.recommendation.expression:
-            self.expression = Expression(self.recommendation.expression)
-        if self.recommendation.compliance_expression:
-            self.compliance = Expression(self.recommendation.compliance_expression)
+        self.expression = self.recommendation.evaluator
+        self.compliance = self.recommendation.compliance_evaluator
 
-    def evaluate(self, evaluated_assessments: vlist.vlist[EvaluatedAssessmentRecord], evaluated_records: list[EvaluatedRecord] = None, persona: Persona = Persona.patient):
+    def evaluate(self, evaluated_assessments: vlist.vlist[EvaluatedAssessmentRecord], evaluated_records: list[EvaluatedRecord] = None, persona: Persona = Persona.patient, as_of: datetime = None):
         """Evaluates recommendations
 
         evaluated_assessments: List of EvaluatedAssessmentRecords 
         evaluated_records: List of evaluated Patient Records `EvaluatedRecord`  
+        as_of: evaluation date for narratives, today if not given
         """
         rectype = self.recommendation.type
         show_if_patient = rectype == RecommendationType.DISPLAY_PATIENT
@@ -218,21 +257,25 @@ class EvaluatedRecommendation:
             raise Exception(f'Cannot evaluate, no expression found for recommendation={self.recommendation.id}') 
         else:
             try:
-                self.applies =  self.expression.evaluate_recommendation(evaluated_assessments)
-                self.based_on = self.expression.expression_records
+                based_on = []
+                self.applies =  self.expression.evaluate_recommendation(evaluated_assessments, based_on=based_on)
+                self.based_on = based_on
                 if self.compliance:
-                    self.compliant = self.compliance.evaluate([v.record for v in evaluated_records])
-                    self.based_on.extend(self.compliance.expression_records)
+                    self.compliant = self.compliance.evaluate([v.record for v in evaluated_records], as_of=as_of)
+                    self.based_on.extend(self.compliant.source)
             except Exception as e:
                 raise e
 
+        if not self.recommendation.narr:
+            return
+
         varible_value_dict = None 
         if self.recommendation.narr.variables:
             records = list(filter(lambda ea: ea.id in self.recommendation.narr.variables, evaluated_assessments + (evaluated_records or [])))
             varible_value_dict = {r.id: r.record.as_dict() for r in records}
             log.info(varible_value_dict)
-        self.narrative = self.recommendation.narr.get_text(self.applies, persona=persona, sanitization_dict=varible_value_dict)
-        self.compliance_narrative = self.recommendation.narr.get_compliance_text(self.compliant, persona=persona, sanitization_dict=varible_value_dict)
+        self.narrative = self.recommendation.narr.get_text(self.applies, persona=persona, sanitization_dict=varible_value_dict, as_of=as_of)
+        self.compliance_narrative = self.recommendation.narr.get_compliance_text(self.compliant, persona=persona, sanitization_dict=varible_value_dict, as_of=as_of)
         
 
 
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Snapshots of a partially evaluated `Concord`, to resume it later and elsewhere, eg. once the user
+# has answered the attestation questions of a web form, on whichever worker receives the answers.
+#
+#   try:
+#       concord.assess()
+#   except NeedAttestationError:
+#       key = store.put(concord.snapshot())
+#   ...
+#   concord = Concord.from_snapshot(cpg, store.pop(key))
+#   concord.attest({'smoking_status': True})
+#   concord.assess()
+#
+# A snapshot holds the eligibility and sufficiency results, not the health context nor the CPG:
+# variables (and their compiled validators) are pickled as references to the CPG by identifier and
+# resolved against the CPG the snapshot is resumed with, which must have the same fingerprint.
+# Snapshots are pickles, only load them from a store this deployment writes (as CPG artifacts).
+
+import io, logging, os, pickle, re, tempfile, time, uuid, zlib
+from dataclasses import dataclass
+
+from .cpg import CPG
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+"""Bump when the pickled structure of results/records changes, invalidates all snapshots"""
+SNAPSHOT_SUFFIX = '.snapshot'
+TMP_SUFFIX = '.tmp'
+# `<key>.snapshot.<uuid>`: a snapshot claimed by `pop`
+CLAIMED_PATTERN = re.compile(r'[\w-]+' + re.escape(SNAPSHOT_SUFFIX) + r'\.[0-9a-f]{32}')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _variables(cpg: CPG):
+    # (kind, variable) of every CPG variable; identifiers are unique within a kind
+    for kind in ('variables', 'eligibility_criterias', 'assessments_variables', 'recommendation_variables'):
+        for variable in getattr(cpg, kind) or []:
+            yield kind, variable
+
+
+def _owned(cpg: CPG):
+    # objects of the CPG that records refer to, and their persistent ids
+    for kind, variable in _variables(cpg):
+        yield ('var', kind, variable.id), variable
+        for attr in ('plausible_validator', 'panel_validator'):
+            if (obj := getattr(variable, attr)) is not None:
+                yield (attr, kind, variable.id), obj
+
+
+def _rebuild_exception(cls, args):
+    return cls.__new__(cls, *args)
+
+
+class _Pickler(pickle.Pickler):
+    """Pickles CPG variables as persistent ids, and exceptions without calling their `__init__` on load"""
+
+    def __init__(self, file, cpg: CPG):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.__ids = {id(obj): (pid, obj) for pid, obj in _owned(cpg)}
+
+    def persistent_id(self, obj):
+        owned = self.__ids.get(id(obj))
+        return owned[0] if owned and owned[1] is obj else None
+
+    def reducer_override(self, obj):
+        # errors kept on records (VarError, VariableEvaluationError..) take other arguments than their `args`
+        if isinstance(obj, BaseException):
+            return _rebuild_exception, (type(obj), obj.args), obj.__dict__ or None
+        return NotImplemented
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, file, cpg: CPG):
+        super().__init__(file)
+        self.__objects = dict(_owned(cpg))
+
+    def persistent_load(self, pid):
+        try:
+            return self.__objects[tuple(pid)]
+        except KeyError:
+            raise SnapshotError(f'Snapshot refers to {pid}, not in the CPG')
+
+
+@dataclass(frozen=True)
+class ConcordSnapshot:
+    """Compact, picklable state of a `Concord` after eligibility and sufficiency"""
+
+    cpg_identifier: str
+    cpg_fingerprint: str
+    pending: tuple[str, ...]
+    """identifiers of the variables waiting for attestation"""
+    payload: bytes
+    """compressed pickle of the results, see `ConcordSnapshot.of`"""
+    version: int = SNAPSHOT_VERSION
+    created: float = None
+
+    @classmethod
+    def of(cls, cpg: CPG, state: dict, pending: list[str]) -> 'ConcordSnapshot':
+        buffer = io.BytesIO()
+        _Pickler(buffer, cpg).dump(state)
+        return cls(cpg.identifier, cpg.fingerprint, tuple(pending), zlib.compress(buffer.getvalue()), created=time.time())
+
+    def state(self, cpg: CPG) -> dict:
+        """The pickled state, resolved against `cpg`; raises SnapshotError for another CPG or version of it"""
+        if self.version != SNAPSHOT_VERSION:
+            raise SnapshotError(f'Snapshot version={self.version}, expected={SNAPSHOT_VERSION}')
+        if cpg.identifier != self.cpg_identifier or cpg.fingerprint != self.cpg_fingerprint:
+            raise SnapshotError(f'Snapshot of CPG={self.cpg_identifier} fingerprint={self.cpg_fingerprint} '
+                                f'cannot be resumed with CPG={cpg.identifier} fingerprint={cpg.fingerprint}')
+        return _Unpickler(io.BytesIO(zlib.decompress(self.payload)), cpg).load()
+
+    def to_bytes(self) -> bytes:
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ConcordSnapshot':
+        snapshot = pickle.loads(data)
+        if not isinstance(snapshot, cls):
+            raise SnapshotError(f'Not a snapshot: {type(snapshot)}')
+        return snapshot
+
+
+@dataclass
+class LocalSnapshotStore:
+    """Snapshots as files of a directory, shared by the workers of one host (or a shared volume)"""
+
+    directory: str
+    max_age: float = None
+    """seconds a snapshot is kept; older ones are not returned and removed by `purge`"""
+    leftover_age: float = 3600.0
+    """seconds after which files of a `put` or `pop` that did not finish (a crash) are removed by `purge`"""
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, snapshot: ConcordSnapshot, key: str = None) -> str:
+        """Stores the snapshot, replacing any under the same key; its key"""
+        key = key or uuid.uuid4().hex
+        path = self.__path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=TMP_SUFFIX)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(snapshot.to_bytes())
+        os.replace(tmp_path, path)
+        log.debug(f'Snapshot: {key} stored, pending={snapshot.pending}')
+        return key
+
+    def get(self, key: str) -> ConcordSnapshot:
+        """The snapshot under `key`; None if there is none or it has expired"""
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                if self.__expired(os.fstat(f.fileno()).st_mtime):
+                    return None
+                return ConcordSnapshot.from_bytes(f.read())
+        except FileNotFoundError:
+            return None
+
+    def pop(self, key: str) -> ConcordSnapshot:
+        """The snapshot under `key`, removed from the store so that it is resumed once"""
+        path = self.__path(key)
+        claimed = f'{path}.{uuid.uuid4().hex}'
+        try:
+            # renamed first: of concurrent pops, one wins
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(claimed, 'rb') as f:
+                if self.__expired(os.fstat(f.fileno()).st_mtime):
+                    return None
+                return ConcordSnapshot.from_bytes(f.read())
+        finally:
+            os.remove(claimed)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.__path(key))
+        except FileNotFoundError:
+            pass
+
+    def purge(self) -> int:
+        """Removes expired snapshots, and the temporary files of `put` and snapshots claimed by `pop`
+        left by a crash, once older than `leftover_age`; how many"""
+        removed = 0
+        now = time.time()
+        for fn in os.listdir(self.directory):
+            path = os.path.join(self.directory, fn)
+            try:
+                if fn.endswith(SNAPSHOT_SUFFIX):
+                    stale = self.__expired(os.path.getmtime(path))
+                elif fn.endswith(TMP_SUFFIX) or CLAIMED_PATTERN.fullmatch(fn):
+                    # a claimed snapshot keeps the mtime of its `put`, the claim itself shows in its ctime
+                    stale = now - max(os.path.getmtime(path), os.path.getctime(path)) > self.leftover_age
+                else:
+                    continue
+                if stale:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                # put, popped or purged meanwhile
+                continue
+        return removed
+
+    def __expired(self, mtime: float) -> bool:
+        return self.max_age is not None and time.time() - mtime > self.max_age
+
+    def __path(self, key: str) -> str:
+        if not re.fullmatch(r'[\w-]+', key):
+            raise ValueError(f'Invalid snapshot key={key}')
+        return os.path.join(self.directory, key + SNAPSHOT_SUFFIX)
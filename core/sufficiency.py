@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+from datetime import datetime
 from functools import cached_property
 import logging
 from dataclasses import dataclass
@@ -8,6 +9,8 @@ from typing import Protocol
 from .healthcontext import HealthContext
 from variables.record import Record
 from variables.var import Var
+from variables.codeindex import CodeIndex
+from primitives.types import Persona
 from .evaluation import EvaluationContext, EvaluationResult, SufficiencyResultStatus
 
 log = logging.getLogger(__name__)
@@ -41,21 +44,25 @@ class SufficiencyEvaluatorProtocol(Protocol):
 
     def evaluate(self,
                 user_context: HealthContext,
-                context: EvaluationContext = None) -> SufficiencyResult:
+                context: EvaluationContext = None,
+                as_of: datetime = None) -> SufficiencyResult:
         ...
 
 
 class SufficiencyEvaluator(SufficiencyEvaluatorProtocol):
 
-    def __init__(self, identifier: str, cpg_variables: list[Var]):
+    def __init__(self, identifier: str, cpg_variables: list[Var], code_index: CodeIndex = None):
+        """code_index: index of the CPG variables (`CPG.code_index`), built from `cpg_variables` if not given"""
 
         self.id = identifier
         self.cpg_variables = cpg_variables
+        self.code_index = code_index or CodeIndex.for_variables(cpg_variables)
 
 
     def evaluate(self,
                 user_context: HealthContext,
-                context: EvaluationContext = None) -> SufficiencyResult:
+                context: EvaluationContext = None,
+                as_of: datetime = None) -> SufficiencyResult:
         """Evalutes a given list of variables for sufficiency to execute a CPG and categorizes 
         each variable.
         Note: Always call cpg.is_valid() else where before evaluating for sufficiency!
@@ -63,6 +70,8 @@ class SufficiencyEvaluator(SufficiencyEvaluatorProtocol):
         Args:
             user_context: HealthContext 
             context (EvaluationContext, optional): Records evaluation context. Defaults to None.
+            as_of (datetime, optional): Evaluation date; values dated after it are left out and
+                value filters count back from it. Defaults to None (today, all values).
 
         Returns:
             SufficiencyResult: Sufficiency
@@ -70,39 +79,37 @@ class SufficiencyEvaluator(SufficiencyEvaluatorProtocol):
         
         eval_ctx = context or EvaluationContext()
 
-        records: list[Record] = []
+        # first user record sharing a code with each variable, in one pass over the user records
+        user_records = self.code_index.first(user_context.records, lambda user_record: user_record.var.code)
         # --- Sufficiency only checks of `cpg.Variables`
         # --- Assessments, Eligibility, Recommendations rely on Sufficiency of cpg.Variables to execute
-        for var in self.cpg_variables:
-            
-            record = None
-            
-            user_record = next(filter(lambda user_record: user_record.var == var, user_context.records), None)
-
-            # Assign Values to Concord Record
-            if user_record and user_record.has_value:
-                record = Record(var, user_record.values)
-            else:
-                record = Record(var, None)
-            
-            # record.set_narrative(persona=user_context.persona)
-            records.append(record)
-
-
-        # --- PERFORM EVALUATION CHECKS --- 
-        for record in records:
+        records: list[Record] = [self.record(var, user_records.get(var.id), as_of) for var in self.cpg_variables]
+
+        self.check(records, user_context.persona, eval_ctx)
+        return SufficiencyResult(eval_ctx)
 
+    @staticmethod
+    def record(var: Var, user_record: Record = None, as_of: datetime = None) -> Record:
+        """Concord record of `var` with the values of the user record, those dated after `as_of` left out"""
+        if user_record and user_record.has_value:
+            return Record(var, user_record.values_until(as_of), as_of=as_of)
+        return Record(var, None, as_of=as_of)
+
+    @staticmethod
+    def check(records: list[Record], persona: Persona, context: EvaluationContext, identifiers: set[str] = None) -> EvaluationContext:
+        """Validates the records (only those of `identifiers` if given) against all of `records`, sets their narratives
+        and adds them to `context`"""
+        for record in records:
+            if identifiers is not None and record.id not in identifiers:
+                continue
             try:
                 if record.validate(records=records, strict=True):
-                    eval_ctx.successful_evaluation(record)
+                    context.successful_evaluation(record)
             except Exception as e:
-        
-                eval_ctx.failed_evaluation(record, e)   
-                
+                context.failed_evaluation(record, e)
 
-            record.set_narrative(persona=user_context.persona)
-            
-        return SufficiencyResult(eval_ctx)
+            record.set_narrative(persona=persona)
+        return context
 
 
 
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 import math
 
+import numpy as np
+
+from primitives.batch import batch_of
+
+MALE = "248153007|http://snomed.info/sct"
+
 
 def compute_ten_year_score(
     isMale,
@@ -103,7 +109,7 @@ def compute_ten_year_score(
 
 def optimal_tenyearriskscore(healthcontext):
     try: 
-        isMale = healthcontext['Gender'].value.as_string == "248153007|http://snomed.info/sct"
+        isMale = healthcontext['Gender'].value.as_string == MALE
         isAfricanAmerican = healthcontext['Race_Is_Black_AfricanAmerican'].value == True
         onHtnMeds = False
         dm   = False
@@ -144,7 +150,7 @@ def tenyearriskscore(healthcontext):
         hdl (int)
     """
     try: 
-        isMale = healthcontext['Gender'].value.as_string == "248153007|http://snomed.info/sct"
+        isMale = healthcontext['Gender'].value.as_string == MALE
         isAfricanAmerican = healthcontext['Race_Is_Black_AfricanAmerican'].value == True
         onHtnMeds = healthcontext['med_for_htn'].value
         dm   = healthcontext['diabetesMellitus'].value
@@ -173,3 +179,126 @@ def tenyearriskscore(healthcontext):
    
 
 
+# ---- batch implementations, one call for many patients ---- #
+
+# coefficients of the four cohorts: (s010, mean, ln age, ln age², ln chol, ln age·ln chol, ln hdl, ln age·ln hdl,
+#   treated ln sbp, ln age·treated ln sbp, untreated ln sbp, ln age·untreated ln sbp, smoker, ln age·smoker, diabetic)
+_COHORTS = {
+    # (isAfricanAmerican, isMale)
+    (True, False):  (0.95334, 86.6081, 17.1141, 0, 0.9396, 0, -18.9196, 4.4748, 29.2907, -6.4321, 27.8197, -6.0873, 0.6908, 0, 0.8738),
+    (False, False): (0.96652, -29.1817, -29.799, 4.884, 13.54, -3.114, -13.578, 3.149, 2.019, 0, 1.957, 0, 7.574, -1.665, 0.661),
+    (True, True):   (0.89536, 19.5425, 2.469, 0, 0.302, 0, -0.307, 0, 1.916, 0, 1.809, 0, 0.549, 0, 0.645),
+    (False, True):  (0.91436, 61.1816, 12.344, 0, 11.853, -2.664, -7.99, 1.769, 1.797, 0, 1.764, 0, 7.837, -1.795, 0.658),
+}
+
+
+def compute_ten_year_score_batch(
+    isMale,
+    isAfricanAmerican,
+    smoker,
+    hypertensive,
+    diabetic,
+    age,
+    systolicBloodPressure,
+    totalCholesterol,
+    hdl,
+):
+    """`compute_ten_year_score` over arrays; a masked array with the patients it would fail for masked"""
+
+    inputs = (isMale, isAfricanAmerican, smoker, hypertensive, diabetic, age, systolicBloodPressure, totalCholesterol, hdl)
+    mask = np.logical_or.reduce([np.ma.getmaskarray(a) for a in inputs])
+    isMale, isAfricanAmerican, smoker, hypertensive, diabetic = (_flags(a) for a in inputs[:5])
+    (age, m1), (sbp, m2), (chol, m3), (hdl, m4) = (_numbers(a) for a in inputs[5:])
+    mask |= m1 | m2 | m3 | m4
+
+    # out of the age range, or logarithms of non-positive values, raise in the scalar version
+    mask |= (age < 40) | (age > 79) | (sbp <= 0) | (chol <= 0) | (hdl <= 0)
+    age, sbp, chol, hdl = (np.where(mask, 1.0, a) for a in (age, sbp, chol, hdl))
+
+    lnAge, lnTotalChol, lnHdl, lnSbp = np.log(age), np.log(chol), np.log(hdl), np.log(sbp)
+    trlnsbp = np.where(hypertensive, lnSbp, 0)
+    ntlnsbp = np.where(hypertensive, 0, lnSbp)
+    terms = (lnAge, lnAge ** 2, lnTotalChol, lnAge * lnTotalChol, lnHdl, lnAge * lnHdl,
+             trlnsbp, lnAge * trlnsbp, ntlnsbp, lnAge * ntlnsbp,
+             smoker.astype(float), np.where(smoker, lnAge, 0), diabetic.astype(float))
+
+    pct = np.zeros(len(age))
+    for (african_american, male), (s010, mnxb, *coefficients) in _COHORTS.items():
+        cohort = (isAfricanAmerican == african_american) & (isMale == male)
+        predict = sum(c * t[cohort] for c, t in zip(coefficients, terms) if c)
+        with np.errstate(over='ignore'):
+            exponent = np.exp(predict - mnxb)
+        mask[cohort] |= ~np.isfinite(exponent)
+        pct[cohort] = 1 - s010 ** exponent
+
+    return np.ma.masked_array(np.round(pct * 100 * 10) / 10, mask=mask)
+
+
+@batch_of(tenyearriskscore)
+def tenyearriskscore_batch(healthcontext):
+
+    return compute_ten_year_score_batch(
+        _strings(healthcontext['Gender']) == MALE,
+        healthcontext['Race_Is_Black_AfricanAmerican'] == True,
+        healthcontext['is_smoker'],
+        healthcontext['med_for_htn'],
+        healthcontext['diabetesMellitus'],
+        healthcontext['Age'],
+        _first(healthcontext['bloodpressure']),
+        healthcontext['Chol'],
+        healthcontext['HDL'],
+    )
+
+
+@batch_of(optimal_tenyearriskscore)
+def optimal_tenyearriskscore_batch(healthcontext):
+
+    age = healthcontext['Age']
+    n = len(age)
+    return compute_ten_year_score_batch(
+        _strings(healthcontext['Gender']) == MALE,
+        healthcontext['Race_Is_Black_AfricanAmerican'] == True,
+        np.zeros(n, dtype=bool),
+        np.zeros(n, dtype=bool),
+        np.zeros(n, dtype=bool),
+        age,
+        np.full(n, 110),
+        np.full(n, 170),
+        np.full(n, 50),
+    )
+
+
+def _flags(a):
+    # truthiness of each value, as `if value`
+    data = np.ma.getdata(a)
+    return data.astype(bool) if data.dtype != object else np.array([bool(v) for v in data], dtype=bool)
+
+
+def _numbers(a):
+    # float values and the mask of values that are not numbers
+    data = np.ma.getdata(a)
+    if data.dtype != object:
+        return data.astype(float), np.zeros(len(data), dtype=bool)
+    invalid = np.array([not isinstance(v, (int, float)) for v in data], dtype=bool)
+    return np.array([0.0 if bad else float(v) for v, bad in zip(data, invalid)]), invalid
+
+
+def _strings(codes):
+    # `Code.as_string` of each value; masked where it is not a code
+    data = np.ma.getdata(codes)
+    strings = [getattr(c, 'as_string', None) for c in data]
+    return np.ma.masked_array(np.array(strings, dtype=object), mask=np.ma.getmaskarray(codes) | np.array([s is None for s in strings], dtype=bool))
+
+
+def _first(values):
+    # `value[0]` of each value; masked where it cannot be indexed
+    data = np.ma.getdata(values)
+    firsts, invalid = [], []
+    for v in data:
+        try:
+            firsts.append(v[0])
+            invalid.append(False)
+        except (TypeError, IndexError, KeyError):
+            firsts.append(None)
+            invalid.append(True)
+    return np.ma.masked_array(np.array(firsts, dtype=object), mask=np.ma.getmaskarray(values) | np.array(invalid, dtype=bool))
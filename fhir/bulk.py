@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+# Streaming ingest of a FHIR bulk-data export (a directory of NDJSON files, optionally gzipped).
+#
+# Resources are grouped by patient without holding the export in memory: a first pass spills each
+# line into one of several partition files on disk, chosen by a hash of its patient reference;
+# each partition is then read back on its own and one `HealthContext` is built per patient.
+# Memory is bounded by the size of one partition (`partition_size`) plus one patient's resources.
+
+import gzip, json, logging, os, tempfile, zlib
+from collections import defaultdict
+from itertools import repeat
+from dataclasses import dataclass
+from functools import cached_property
+from datetime import date
+from typing import IO, Iterable, Iterator
+
+from core.healthcontext import HealthContext
+from fhir.prefilter import CODED_ELEMENTS, CodePrefilter
+from primitives.sourcereference import SourceReference
+from primitives.types import Persona
+from variables.codeindex import CodeIndex
+from variables.var import Var
+
+log = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+# resources `FHIRValue` converts, and the Patient resource for demographics
+VALUE_RESOURCE_TYPES = ('Observation', 'Condition', 'MedicationRequest', 'Procedure', 'QuestionnaireResponse')
+PATIENT_RESOURCE_TYPE = 'Patient'
+
+# gzip'd NDJSON is typically this many times smaller than the resources it holds
+_GZIP_RATIO = 8
+
+
+def open_ndjson(filepath: str) -> IO[bytes]:
+    """Binary stream of an NDJSON file, decompressed when it is gzipped"""
+    file_ = open(filepath, 'rb')
+    if file_.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=file_)
+    return file_
+
+
+def iter_ndjson(filepath: str) -> Iterator[dict]:
+    """Resources of an NDJSON file, one at a time"""
+    with open_ndjson(filepath) as file_:
+        for line in file_:
+            if line.strip():
+                yield json.loads(line)
+
+
+def patient_key(resource: dict) -> str:
+    """Identifier of the patient a resource belongs to; None for resources outside a patient compartment.
+    `Patient/123`, `urn:uuid:123` and the Patient resource `123` are the same patient."""
+    if resource.get('resourceType') == PATIENT_RESOURCE_TYPE:
+        return resource.get('id')
+    for attr in ('subject', 'patient'):
+        reference = (resource.get(attr) or {}).get('reference')
+        if reference:
+            return reference.rsplit('/', 1)[-1].removeprefix('urn:uuid:')
+    return None
+
+
+@dataclass(frozen=True)
+class NDJSONExport:
+    """A bulk-data export on disk, described by its `manifest.json` when there is one"""
+
+    directory: str
+
+    def manifest(self) -> dict:
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def files(self, resource_types: Iterable[str] = None) -> list[tuple[str, str]]:
+        """(resource type, file path) of the export, limited to `resource_types` if given"""
+        types = set(resource_types) if resource_types else None
+        manifest = self.manifest()
+        if manifest:
+            entries = [(o['type'], self.__local_path(o['url'])) for o in manifest.get('output', [])]
+        else:
+            entries = []
+            for fn in sorted(os.listdir(self.directory)):
+                if fn.endswith(('.ndjson', '.ndjson.gz')):
+                    entries.append((fn.split('.')[0], os.path.join(self.directory, fn)))
+        files = []
+        for resource_type, path in entries:
+            if types and resource_type not in types:
+                continue
+            if path is None:
+                log.warning(f'Bulk: file for {resource_type} not found in {self.directory}')
+                continue
+            files.append((resource_type, path))
+        return files
+
+    def resources(self, resource_types: Iterable[str] = None) -> Iterator[dict]:
+        for _, path in self.files(resource_types):
+            yield from iter_ndjson(path)
+
+    def __local_path(self, url: str) -> str:
+        # manifest urls point to the server; files are downloaded next to the manifest by name, maybe gzipped
+        name = url.rsplit('/', 1)[-1]
+        for candidate in (name, name + '.gz'):
+            path = os.path.join(self.directory, candidate)
+            if os.path.exists(path):
+                return path
+        return None
+
+
+@dataclass(frozen=True)
+class BulkIngest:
+    """`HealthContext`s of every patient in a bulk-data export, for the variables of a CPG.
+
+    Picklable, so that it can be given to `core.cohort.CohortRunner` as a patient partition.
+    """
+
+    directory: str
+    for_variables: list[Var]
+    persona: Persona = Persona.patient
+    until_date: date = None
+    columnar: bool = False
+    partition_size: int = 32 * 2**20
+    """approximate bytes of resources per partition held in memory"""
+    spill_directory: str = None
+    """where partitions are written, a temporary directory by default"""
+    strict: bool = False
+    """validate resources with the full fhirclient models (`FHIRValue.from_fhir`)"""
+    references: bool = True
+    """keep a `SourceReference` (file and byte range) as the source of values instead of the resource"""
+    prefilter: CodePrefilter = None
+    """drops resources that cannot match, built from `for_variables` if not given;
+    pass `CodePrefilter.for_cpgs` to ingest once for several CPGs"""
+    use_prefilter: bool = True
+
+    def healthcontexts(self) -> Iterator[HealthContext]:
+
+        export = NDJSONExport(self.directory)
+        files = export.files(VALUE_RESOURCE_TYPES + (PATIENT_RESOURCE_TYPE,))
+        code_index = self.__code_index
+        prefilter = self.__prefilter
+        with tempfile.TemporaryDirectory(prefix='concord-bulk-', dir=self.spill_directory) as spill:
+            partitions = self.__spill(files, spill, prefilter)
+            paths = [os.path.abspath(path) for _, path in files]
+            for path in partitions:
+                yield from self.__read_partition(path, paths, code_index)
+                os.remove(path)
+
+    def patient(self, identifier: str, index: 'NDJSONIndex' = None) -> HealthContext:
+        """`HealthContext` of one patient, read through a byte-offset index of the export: `index`,
+        or the one kept by this ingest (`BulkIngest.index`)"""
+        index = index or self.index
+        prefilter = self.__prefilter
+        resources, references = [], []
+        for file_index, offset, line in index.lines(identifier):
+            coded = prefilter is not None and index.files[file_index]['type'] in CODED_ELEMENTS
+            if coded and not prefilter.may_match(line):
+                continue
+            resource = json.loads(line)
+            if coded and not prefilter.accepts(resource):
+                continue
+            resources.append(resource)
+            references.append(SourceReference.of(resource, index.path(file_index), offset, len(line)))
+        return self.healthcontext(identifier, resources, self.__code_index, references if self.references else None)
+
+    @cached_property
+    def index(self) -> 'NDJSONIndex':
+        """Byte-offset index of the export (`fhir.ndjsonindex`), loaded on first use, or built and saved
+        next to the export if there is none, then kept open for every `patient` call; see `close`"""
+        from fhir.ndjsonindex import NDJSONIndex
+        return NDJSONIndex.for_export(self.directory)
+
+    def close(self):
+        """Releases the memory maps of the index; it is loaded again if needed"""
+        index = self.__dict__.pop('index', None)
+        if index is not None:
+            index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        # the open index stays with the process that loaded it
+        state = dict(self.__dict__)
+        state.pop('index', None)
+        return state
+
+    @cached_property
+    def __code_index(self) -> CodeIndex:
+        return CodeIndex.for_variables(self.for_variables)
+
+    @cached_property
+    def __prefilter(self) -> CodePrefilter:
+        if not self.use_prefilter:
+            return None
+        return self.prefilter or CodePrefilter.for_variables(self.for_variables)
+
+    def __partition_count(self, files) -> int:
+        size = 0
+        for _, path in files:
+            st = os.path.getsize(path)
+            size += st * _GZIP_RATIO if path.endswith('.gz') else st
+        return max(1, -(-size // self.partition_size))
+
+    def __spill(self, files, spill: str, prefilter: CodePrefilter = None) -> list[str]:
+        # each line is written as `<patient key>\t<file index>:<offset>:<length>\t<resource>` to the partition of its patient
+        count = self.__partition_count(files)
+        paths = [os.path.join(spill, f'partition-{i:05d}.ndjson') for i in range(count)]
+        outputs = [open(p, 'wb') for p in paths]
+        skipped = dropped = 0
+        try:
+            for index, (resource_type, path) in enumerate(files):
+                coded = prefilter is not None and resource_type in CODED_ELEMENTS
+                offset = 0
+                with open_ndjson(path) as file_:
+                    for line in file_:
+                        position = f'{index}:{offset}:{len(line)}'.encode()
+                        offset += len(line)
+                        line = line.strip()
+                        if not line:
+                            continue
+                        # codes are checked on the raw line first, then exactly once decoded
+                        if coded and not prefilter.may_match(line):
+                            dropped += 1
+                            continue
+                        resource = json.loads(line)
+                        if coded and not prefilter.accepts(resource):
+                            dropped += 1
+                            continue
+                        key = patient_key(resource)
+                        if key is None:
+                            skipped += 1
+                            continue
+                        key = key.encode()
+                        outputs[zlib.crc32(key) % count].write(key + b'\t' + position + b'\t' + line + b'\n')
+        finally:
+            for output in outputs:
+                output.close()
+        if skipped:
+            log.warning(f'Bulk: {skipped} resources without a patient reference skipped')
+        log.debug(f'Bulk: {len(files)} files spilled into {count} partitions, {dropped} resources not matching any variable dropped')
+        return paths
+
+    def __read_partition(self, path: str, paths: list[str], code_index: CodeIndex) -> Iterator[HealthContext]:
+        # only raw lines are kept while grouping; resources are parsed one patient at a time
+        by_patient = defaultdict(list)
+        with open(path, 'rb') as file_:
+            for line in file_:
+                key, position, resource = line.split(b'\t', 2)
+                by_patient[key].append((position, resource))
+
+        while by_patient:
+            key, lines = by_patient.popitem()
+            resources = [json.loads(line) for _, line in lines]
+            references = None
+            if self.references:
+                references = [self.__reference(resource, position, paths) for resource, (position, _) in zip(resources, lines)]
+            yield self.healthcontext(key.decode(), resources, code_index, references)
+
+    @staticmethod
+    def __reference(resource: dict, position: bytes, paths: list[str]) -> SourceReference:
+        index, offset, length = map(int, position.split(b':'))
+        return SourceReference.of(resource, paths[index], offset, length)
+
+    def healthcontext(self, identifier: str, resources: Iterable[dict], code_index: CodeIndex = None,
+                      references: Iterable[SourceReference] = None) -> HealthContext:
+        """`HealthContext` of one patient from their resources
+
+        references: `SourceReference` of each resource, kept as value sources instead of the resources"""
+        return healthcontext_of(
+            identifier, resources, self.for_variables, self.persona, self.until_date,
+            code_index=code_index or self.__code_index, columnar=self.columnar, strict=self.strict, references=references)
+
+
+def healthcontext_of(identifier: str, resources: Iterable[dict], for_variables: list[Var], persona: Persona = Persona.patient,
+                     until_date: date = None, code_index: CodeIndex = None, columnar: bool = False, strict: bool = False,
+                     references: Iterable[SourceReference] = None) -> HealthContext:
+    """`HealthContext` of one patient from their FHIR resources, demographics from their Patient resource"""
+    from fhir.fhirvalue import FHIRValue
+    from fhir.fhirpatient import FHIRPatient
+    from fhirclient.models import patient
+
+    values, fhir_patient, errors = [], None, 0
+    for resource, reference in zip(resources, references or repeat(None)):
+        try:
+            if resource.get('resourceType') == PATIENT_RESOURCE_TYPE:
+                fhir_patient = FHIRPatient(patient.Patient(resource), source=reference)
+            else:
+                value = FHIRValue.from_fhir(resource, strict=strict, reference=reference)
+                if value is not None:
+                    values.append(value)
+        except Exception as e:
+            errors += 1
+            log.debug(f'Bulk: cannot convert {resource.get("resourceType")}/{resource.get("id")}: {e}')
+    if errors:
+        log.info(f'Bulk: {errors} resources of patient={identifier} could not be converted')
+
+    age = gender = race = None
+    if fhir_patient:
+        age, gender, race = fhir_patient.age_as_of(until_date), fhir_patient.gender, fhir_patient.race
+
+    return HealthContext.from_values(
+        values, for_variables, age, gender, race, persona,
+        until_date=until_date, code_index=code_index, columnar=columnar, identifier=identifier)
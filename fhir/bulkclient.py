@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# SMART/HL7 bulk-data ($export) client: kicks off an export, polls its status until the manifest
+# is ready, and downloads the manifest's output files concurrently into a directory `fhir.bulk`
+# reads (`BulkIngest`). Downloads go through one pooled `requests.Session` and resume with Range
+# requests from the `.part` files of an interrupted run. Part files are named by their url, and each
+# downloaded file records the url it came from (`.source`), so that an export into a directory
+# holding an earlier one neither keeps nor resumes the earlier files.
+#
+#   client = BulkDataClient('https://fhir.example.org/fhir', access_token=token)
+#   directory = client.export('exports/nightly', resource_types=['Patient', 'Observation'])
+#   hcs = BulkIngest(directory, cpg.variables).healthcontexts()
+
+import hashlib, json, logging, os, re, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from functools import cached_property
+from typing import Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fhir.bulk import MANIFEST
+
+log = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+SOURCE_SUFFIX = '.source'
+
+
+def pooled_session(pool_size: int, retries: int = 5, access_token: str = None) -> requests.Session:
+    """Session keeping up to `pool_size` connections alive per host, retrying connection errors,
+    429 and 5xx with exponential backoff"""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET', 'DELETE'), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if access_token:
+        session.headers['Authorization'] = f'Bearer {access_token}'
+    return session
+
+
+class BulkDataError(Exception):
+
+    def __init__(self, message, response: requests.Response = None):
+        if response is not None:
+            message += f' status={response.status_code} url={response.url} body={response.text[:500]}'
+        super(BulkDataError, self).__init__(message)
+        self.status_code = response.status_code if response is not None else None
+
+
+@dataclass
+class BulkDataClient:
+    """Bulk-data client of one FHIR server"""
+
+    base_url: str
+    access_token: str = None
+    max_workers: int = 4
+    """concurrent downloads, and the size of the connection pool"""
+    poll_interval: float = 2.0
+    """seconds between status polls when the server gives no Retry-After"""
+    export_timeout: float = 6 * 3600
+    """seconds to wait for an export to complete"""
+    chunk_size: int = 2**16
+    """bytes read and written at a time; at most this much of a broken-off transfer is fetched again"""
+    request_timeout: float = 60.0
+    retries: int = 5
+    """retries of a request on connection errors, 429 and 5xx, with exponential backoff"""
+
+    @cached_property
+    def session(self) -> requests.Session:
+        return pooled_session(self.max_workers, self.retries, self.access_token)
+
+    def kick_off(self, resource_types: Iterable[str] = None, since: datetime = None, operation: str = '$export') -> str:
+        """Starts an export (eg. `$export`, `Patient/$export`, `Group/<id>/$export`); its status url"""
+        params = {}
+        if resource_types:
+            params['_type'] = ','.join(resource_types)
+        if since:
+            params['_since'] = since.isoformat()
+        response = self.session.get(
+            f'{self.base_url.rstrip("/")}/{operation}', params=params, timeout=self.request_timeout,
+            headers={'Accept': 'application/fhir+json', 'Prefer': 'respond-async'})
+        if response.status_code != 202 or 'Content-Location' not in response.headers:
+            raise BulkDataError('Bulk: export was not accepted', response)
+        status_url = response.headers['Content-Location']
+        log.info(f'Bulk: export started, status={status_url}')
+        return status_url
+
+    def wait(self, status_url: str) -> dict:
+        """Polls the export status until it is complete; the manifest"""
+        deadline = time.monotonic() + self.export_timeout
+        while True:
+            response = self.session.get(status_url, timeout=self.request_timeout, headers={'Accept': 'application/json'})
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code != 202:
+                raise BulkDataError('Bulk: export failed', response)
+            if time.monotonic() > deadline:
+                raise BulkDataError(f'Bulk: export not complete after {self.export_timeout}s', response)
+            log.debug(f'Bulk: export in progress {response.headers.get("X-Progress", "")}')
+            time.sleep(self.__retry_after(response))
+
+    def download(self, manifest: dict, directory: str, resource_types: Iterable[str] = None) -> str:
+        """Downloads the output files of `manifest` into `directory`, then writes the manifest itself,
+        so that a directory with a manifest is a complete export; the directory"""
+        os.makedirs(directory, exist_ok=True)
+        # the directory is not a complete export until this manifest is written
+        try:
+            os.remove(os.path.join(directory, MANIFEST))
+        except FileNotFoundError:
+            pass
+        types = set(resource_types) if resource_types else None
+        outputs = [o for o in manifest.get('output', []) if not types or o['type'] in types]
+        authorize = manifest.get('requiresAccessToken', False)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.download_file, o['url'], self.__local_path(directory, o['url']), authorize)
+                       for o in outputs]
+            sizes = [f.result() for f in futures]
+
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4)
+        log.info(f'Bulk: {len(outputs)} files, {sum(sizes) // 2**20}MB downloaded into {directory}')
+        return directory
+
+    def download_file(self, url: str, path: str, authorize: bool = True) -> int:
+        """Downloads `url` to `path`, resuming the part file of an interrupted download of `url`; size of the file.
+        A file at `path` is kept only if it was downloaded from `url`."""
+        self.__clear(url, path)
+        for attempt in range(self.retries + 1):
+            if os.path.exists(path):
+                return os.path.getsize(path)
+            try:
+                self.__download(url, path, authorize)
+            except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                # broken off mid-transfer: resumed from what the part file holds
+                if attempt == self.retries:
+                    raise
+                log.info(f'Bulk: {url} interrupted ({e}), resuming')
+        return os.path.getsize(path)
+
+    def __clear(self, url: str, path: str):
+        # removes what is at `path` from other urls: the file, and part files of other downloads
+        if os.path.exists(path) and self.__source(path) != url:
+            log.warning(f'Bulk: {path} is not from {url}, downloading it again')
+            os.remove(path)
+        keep = os.path.basename(self.__part(url, path))
+        directory, name = os.path.split(path)
+        stale = re.compile(re.escape(name) + r'\.[0-9a-f]{16}' + re.escape(PART_SUFFIX))
+        for fn in os.listdir(directory or '.'):
+            if fn != keep and stale.fullmatch(fn):
+                log.info(f'Bulk: removing {fn}, part of another download')
+                os.remove(os.path.join(directory, fn))
+
+    @staticmethod
+    def __part(url: str, path: str) -> str:
+        return f'{path}.{hashlib.sha256(url.encode()).hexdigest()[:16]}{PART_SUFFIX}'
+
+    @staticmethod
+    def __source(path: str) -> str:
+        try:
+            with open(path + SOURCE_SUFFIX, 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def __content_range(response: requests.Response) -> tuple[int, int]:
+        # (first byte, total size) of `Content-Range: bytes <first>-<last>/<total>` or `bytes */<total>`; None if unknown
+        m = re.fullmatch(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)', response.headers.get('Content-Range', '').strip())
+        if not m:
+            return None, None
+        return (int(m.group(1)) if m.group(1) else None), (int(m.group(2)) if m.group(2) != '*' else None)
+
+    def __restart(self, url: str, path: str, authorize: bool, reason: str):
+        log.warning(f'Bulk: {url} cannot be resumed ({reason}), downloading it again')
+        os.remove(self.__part(url, path))
+        self.__download(url, path, authorize)
+
+    def __download(self, url: str, path: str, authorize: bool):
+        part = self.__part(url, path)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Accept': 'application/fhir+ndjson'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        if not authorize:
+            headers['Authorization'] = None
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.request_timeout) as response:
+            if response.status_code == 416 and offset:
+                # the part file already holds the whole file, if it is as long as the file
+                total = self.__content_range(response)[1]
+                if total != offset:
+                    return self.__restart(url, path, authorize, f'416 for a file of {total} bytes, part has {offset}')
+                return self.__complete(url, part, path)
+            if response.status_code == 206 and offset:
+                # appended only if the server sends the bytes from where the part file ends
+                start = self.__content_range(response)[0]
+                if start != offset:
+                    return self.__restart(url, path, authorize, f'206 from byte {start}, part has {offset}')
+            if response.status_code == 200 and offset:
+                log.info(f'Bulk: {url} cannot be resumed, downloading it again')
+                offset = 0
+            elif response.status_code not in (200, 206):
+                raise BulkDataError('Bulk: download failed', response)
+
+            written = 0
+            with open(part, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        self.__complete(url, part, path)
+        log.debug(f'Bulk: {url} downloaded, {written} bytes from offset={offset}')
+
+    @staticmethod
+    def __complete(url: str, part: str, path: str):
+        # the source is written before the file appears, a file is never left without one
+        with open(path + SOURCE_SUFFIX, 'w') as f:
+            f.write(url)
+        os.replace(part, path)
+
+    def export(self, directory: str, resource_types: Iterable[str] = None, since: datetime = None, operation: str = '$export') -> str:
+        """Kicks off an export, waits for it and downloads it into `directory`, which is returned for `BulkIngest`"""
+        manifest = self.wait(self.kick_off(resource_types, since, operation))
+        return self.download(manifest, directory)
+
+    def __retry_after(self, response: requests.Response) -> float:
+        retry_after = response.headers.get('Retry-After')
+        try:
+            return max(float(retry_after), 0.0)
+        except (TypeError, ValueError):
+            return self.poll_interval
+
+    @staticmethod
+    def __local_path(directory: str, url: str) -> str:
+        # named as `NDJSONExport` looks them up, by the last path component of the url
+        return os.path.join(directory, url.rsplit('/', 1)[-1])
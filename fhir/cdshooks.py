@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+# CDS Hooks service: every loaded CPG is a `patient-view` service the EHR calls when a chart is opened.
+#
+#   python -m fhir.cdshooks cpgs/cholesterol.yaml cpgs/screeninglungcancer.yaml --port 8090
+#
+# Discovery (`GET /cds-services`) lists one service per CPG with `prefetch` templates generated
+# from the codes of its variables (`fhir.search.code_queries`), so the EHR sends the Patient and
+# exactly the resources the CPG can use. A call (`POST /cds-services/<cpg identifier>`) maps the
+# prefetched resources into a `HealthContext`, evaluates the CPG and answers with one card per
+# applied recommendation. Prefetch the EHR did not fill (left out or null) is fetched from its
+# `fhirServer`; without one the call is answered 412. A call that cannot be evaluated is answered
+# with an error status (500, 502 when the `fhirServer` fails, 503 when not answered within
+# `timeout`), never with an empty list of cards, which means that nothing applies.
+#
+# The HTTP side runs on an asyncio event loop; conversion and evaluation are CPU bound and run on a
+# process pool whose workers load the CPGs once, when they start (as `core.cohort.CohortRunner`).
+# At most `max_pending` calls are in the pool: a call is not queued once it has run out of time, and
+# one that runs out of time while queued is dropped.
+
+import argparse, asyncio, json, logging, os, time, uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlparse
+
+import requests
+
+from core.cpg import CPG
+from core.engine import ConcordEngine
+from core.recommendation import EvaluatedRecommendation
+from fhir.bulk import PATIENT_RESOURCE_TYPE, healthcontext_of
+from fhir.bulkclient import BulkDataError, pooled_session
+from fhir.prefilter import CodePrefilter
+from fhir.search import code_queries
+from primitives.types import Persona
+
+log = logging.getLogger(__name__)
+
+HOOK = 'patient-view'
+PATIENT_PREFETCH = 'patient'
+PATIENT_ID_TOKEN = '{{context.patientId}}'
+SERVICES_PATH = '/cds-services'
+
+
+class CDSHooksError(Exception):
+    """A call that is answered with the HTTP `status`"""
+
+    def __init__(self, status: int, message: str):
+        super(CDSHooksError, self).__init__(message)
+        self.status = status
+
+
+def prefetch_templates(cpg: CPG, codes_per_query: int = 40) -> dict[str, str]:
+    """Prefetch key -> FHIR query template: the Patient, and searches of the codes of the CPG's variables"""
+    templates = {PATIENT_PREFETCH: f'{PATIENT_RESOURCE_TYPE}/{PATIENT_ID_TOKEN}'}
+    counts = {}
+    for query in code_queries(cpg.variables, codes_per_query):
+        n = counts[query.resource_type] = counts.get(query.resource_type, 0) + 1
+        params = urlencode(query.params(PATIENT_ID_TOKEN), safe='|,:/{}')
+        templates[f'{query.resource_type[0].lower()}{query.resource_type[1:]}{n}'] = f'{query.resource_type}?{params}'
+    return templates
+
+
+def prefetched_resources(prefetch: dict) -> list[dict]:
+    """Resources of the prefetch: single resources as they are, the entries of Bundles"""
+    resources = []
+    for value in (prefetch or {}).values():
+        if not value:
+            continue
+        if value.get('resourceType') == 'Bundle':
+            resources.extend(e['resource'] for e in value.get('entry') or [] if e.get('resource'))
+        else:
+            resources.append(value)
+    return resources
+
+
+def card(cpg: CPG, recommendation: EvaluatedRecommendation) -> dict:
+    """CDS Hooks card of an applied recommendation"""
+    rec = recommendation.recommendation
+    source = {'label': cpg.title}
+    if cpg.doi:
+        source['url'] = f'https://doi.org/{cpg.doi.removeprefix("doi:")}'
+    detail = [recommendation.narrative or '']
+    if rec.class_of_recommendation or rec.level_of_evidence:
+        detail.append(f'COR: {rec.class_of_recommendation or "-"}, LOE: {rec.level_of_evidence or "-"}')
+    return {
+        'uuid': str(uuid.uuid4()),
+        'summary': (rec.title or rec.id)[:140],
+        'detail': '\n\n'.join(d for d in detail if d),
+        'indicator': 'warning' if recommendation.compliant is False else 'info',
+        'source': source,
+    }
+
+
+# ---- worker process ---- #
+
+_worker = {}
+
+def _initialize_worker(cpg_filepaths: list[str], options: dict):
+    if 'log_level' in options:
+        logging.disable(options.pop('log_level'))
+    engines = {}
+    for path in cpg_filepaths:
+        cpg = CPG.from_document_path(path)
+        engines[cpg.identifier] = ConcordEngine(cpg, demand_driven=options['demand_driven'])
+    _worker['engines'] = engines
+    _worker['prefilters'] = {k: CodePrefilter.for_variables(e.cpg.variables) for k, e in engines.items()}
+    _worker['options'] = options
+
+def _services() -> list[str]:
+    return list(_worker['engines'])
+
+def _patient_view(service_id: str, patient: str, prefetch: dict, missing: dict, fhir_server: str = None, access_token: str = None,
+                  deadline: float = None) -> list[dict]:
+    """Cards of the CPG for the patient, from the prefetch and the `missing` prefetch queries fetched from `fhir_server`;
+    None without evaluating when `deadline` (epoch seconds) has passed"""
+    if deadline and time.time() > deadline:
+        return None
+    engine = _worker['engines'][service_id]
+    persona = _worker['options']['persona']
+    if missing and fhir_server:
+        prefetch = {**prefetch, **{k: _fetch(fhir_server, access_token, query) for k, query in missing.items()}}
+    # EHRs may match codes loosely, resources are checked again
+    accepts = _worker['prefilters'][service_id].accepts
+    resources = [r for r in prefetched_resources(prefetch) if accepts(r)]
+
+    hc = healthcontext_of(patient, resources, engine.cpg.variables, persona, code_index=engine.cpg.code_index)
+    result = engine.evaluate(hc, persona)
+    if result.error:
+        raise result.error
+    return [card(engine.cpg, rec) for rec in result.applied]
+
+def _fetch(fhir_server: str, access_token: str, query: str) -> dict:
+    """Result of a prefetch query, the entries of every page of a search in one Bundle"""
+    if 'session' not in _worker:
+        _worker['session'] = pooled_session(4)
+    headers = {'Accept': 'application/fhir+json'}
+    if access_token:
+        headers['Authorization'] = f'Bearer {access_token}'
+    url, result = f'{fhir_server.rstrip("/")}/{query}', None
+    while url:
+        try:
+            response = _worker['session'].get(url, headers=headers, timeout=30)
+        except requests.RequestException as e:
+            raise BulkDataError(f'CDSHooks: prefetch query failed url={url} error={e!r}')
+        if response.status_code != 200:
+            raise BulkDataError('CDSHooks: prefetch query failed', response)
+        page = response.json()
+        if result is None:
+            result = page
+        else:
+            result.setdefault('entry', []).extend(page.get('entry') or [])
+        url = next((link['url'] for link in page.get('link') or [] if link.get('relation') == 'next'), None)
+    return result
+
+
+@dataclass
+class CDSHooksService:
+    """`patient-view` services of the CPGs at `cpg_filepaths`"""
+
+    cpg_filepaths: list[str]
+    host: str = '127.0.0.1'
+    port: int = 8090
+    """0 picks a free port"""
+    max_workers: int = None
+    """worker processes, all cores by default; 1 evaluates on a thread of this process"""
+    persona: Persona = Persona.provider
+    demand_driven: bool = True
+    timeout: float = None
+    """seconds to answer a call; a call that takes longer is answered 503"""
+    max_pending: int = None
+    """calls in the pool, evaluating or queued; twice the workers by default"""
+    worker_log_level: int = logging.ERROR
+    cpgs: dict[str, CPG] = field(default_factory=dict, init=False, repr=False)
+    prefetch: dict[str, dict] = field(default_factory=dict, init=False, repr=False)
+    """service id -> prefetch templates"""
+    __pool: Executor = field(default=None, init=False, repr=False)
+    __pending: asyncio.Semaphore = field(default=None, init=False, repr=False)
+    __server: asyncio.Server = field(default=None, init=False, repr=False)
+    __connections: set = field(default_factory=set, init=False, repr=False)
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.__server.sockets[0].getsockname()[1]}'
+
+    def discovery(self) -> dict:
+        return {'services': [{
+            'hook': HOOK,
+            'id': identifier,
+            'title': cpg.title,
+            'description': f'Recommendations of {cpg.title}' + (f' ({cpg.publisher})' if cpg.publisher else ''),
+            'prefetch': self.prefetch[identifier],
+        } for identifier, cpg in self.cpgs.items()]}
+
+    async def start(self) -> 'CDSHooksService':
+        """Loads the CPGs here and in every worker, then starts listening"""
+        self.cpgs = {cpg.identifier: cpg for cpg in map(CPG.from_document_path, self.cpg_filepaths)}
+        self.prefetch = {identifier: prefetch_templates(cpg) for identifier, cpg in self.cpgs.items()}
+        options = {'persona': self.persona, 'demand_driven': self.demand_driven}
+        max_workers = self.max_workers or os.cpu_count() or 1
+        if max_workers == 1:
+            _initialize_worker(self.cpg_filepaths, options)
+            self.__pool = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.__pool = ProcessPoolExecutor(max_workers=max_workers, initializer=_initialize_worker,
+                                              initargs=(self.cpg_filepaths, dict(options, log_level=self.worker_log_level)))
+            # workers start (and load the CPGs) now rather than on the first call
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.__pool, _services) for _ in range(max_workers)))
+        self.__pending = asyncio.Semaphore(self.max_pending or 2 * max_workers)
+
+        self.__server = await asyncio.start_server(self.__connection, self.host, self.port)
+        log.info(f'CDSHooks: {len(self.cpgs)} services at {self.url}{SERVICES_PATH}')
+        return self
+
+    async def stop(self):
+        if self.__server:
+            self.__server.close()
+            # idle keep-alive connections would keep the server open
+            for writer in list(self.__connections):
+                writer.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        if self.__pool:
+            self.__pool.shutdown(cancel_futures=True)
+            self.__pool = None
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.__server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def handle(self, method: str, path: str, body: bytes = b'') -> tuple[int, dict]:
+        """(status, JSON body) of a request"""
+        path = path.rstrip('/')
+        if method == 'GET' and path == SERVICES_PATH:
+            return 200, self.discovery()
+        if method != 'POST' or not path.startswith(SERVICES_PATH + '/'):
+            return 404, {'error': f'{method} {path} not found'}
+        service_id = path[len(SERVICES_PATH) + 1:]
+        if service_id not in self.cpgs:
+            return 404, {'error': f'service={service_id} not found'}
+        try:
+            request = json.loads(body)
+            patient = request['context']['patientId']
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': f'invalid request: {e!r}'}
+        if request.get('hook') != HOOK:
+            return 400, {'error': f'hook={request.get("hook")} not supported'}
+        try:
+            return 200, {'cards': await self.patient_view(service_id, patient, request)}
+        except CDSHooksError as e:
+            return e.status, {'error': str(e)}
+
+    async def patient_view(self, service_id: str, patient: str, request: dict) -> list[dict]:
+        """Cards of the applied recommendations; raises CDSHooksError when the call cannot be evaluated"""
+        # prefetch keys sent as null were not prefetched either
+        prefetch = {k: v for k, v in (request.get('prefetch') or {}).items() if v is not None}
+        missing = {k: t.replace(PATIENT_ID_TOKEN, patient) for k, t in self.prefetch[service_id].items() if k not in prefetch}
+        if missing and not request.get('fhirServer'):
+            raise CDSHooksError(412, f'prefetch={sorted(missing)} missing and no fhirServer to fetch it from')
+        authorization = request.get('fhirAuthorization') or {}
+        deadline = time.time() + self.timeout if self.timeout else None
+
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self.__pending.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise CDSHooksError(503, f'service={service_id} busy, call not evaluated within {self.timeout}s')
+        # the slot is held until the pool is done with the call, also when it is no longer waited for
+        call = self.__pool.submit(_patient_view, service_id, patient, prefetch, missing,
+                                  request.get('fhirServer'), authorization.get('access_token'), deadline)
+        call.add_done_callback(lambda _: loop.call_soon_threadsafe(self.__pending.release))
+        try:
+            cards = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call)), deadline - time.time() if deadline else None)
+        except asyncio.TimeoutError:
+            # dropped if still queued; `_patient_view` skips it past the deadline if already handed to a worker
+            call.cancel()
+            log.warning(f'CDSHooks: service={service_id} patient={patient} not evaluated within {self.timeout}s')
+            raise CDSHooksError(503, f'service={service_id} patient={patient} not evaluated within {self.timeout}s')
+        except BulkDataError as e:
+            log.error(f'CDSHooks: service={service_id} patient={patient} prefetch from fhirServer failed: {e}')
+            raise CDSHooksError(502, f'prefetch from fhirServer failed: {e}')
+        except Exception as e:
+            log.error(f'CDSHooks: service={service_id} patient={patient} failed: {e}')
+            raise CDSHooksError(500, f'service={service_id} patient={patient} not evaluated: {type(e).__name__}: {e}')
+        if cards is None:
+            raise CDSHooksError(503, f'service={service_id} patient={patient} not evaluated within {self.timeout}s')
+        return cards
+
+    async def __connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 with keep-alive; requests of a connection are answered in order
+        self.__connections.add(writer)
+        try:
+            while request_line := await reader.readline():
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'OPTIONS':
+                    status, response = 204, None
+                else:
+                    status, response = await self.handle(method, urlparse(target).path, body)
+                log.debug(f'CDSHooks: {method} {target} {status}')
+                data = json.dumps(response).encode() if response is not None else b''
+                writer.write(
+                    f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}\r\n'
+                    'Content-Type: application/json\r\n'
+                    'Access-Control-Allow-Origin: *\r\n'
+                    'Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n'
+                    'Access-Control-Allow-Headers: Content-Type, Authorization\r\n'
+                    f'Content-Length: {len(data)}\r\n\r\n'.encode('latin-1') + data)
+                await writer.drain()
+                if version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            log.debug(f'CDSHooks: connection closed: {e!r}')
+        finally:
+            self.__connections.discard(writer)
+            writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('cdshooks')
+    parser.add_argument('cpg_filepaths', nargs='+', help='Paths to Concord.CPG files')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds to answer a call')
+    parser.add_argument('--max-pending', type=int, default=None, help='calls evaluating or queued at a time')
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(message)s')
+    asyncio.run(CDSHooksService(args.cpg_filepaths, args.host, args.port, args.workers, timeout=args.timeout,
+                                max_pending=args.max_pending).serve_forever())
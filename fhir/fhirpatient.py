@@ -12,10 +12,13 @@ from variables import record, value, var, age
 
 class FHIRPatient:
 
-    def __init__(self, pt: patient.Patient) -> None:
-        """Creates `Record`(s) from FHIR Patient resource"""
+    def __init__(self, pt: patient.Patient, source = None) -> None:
+        """Creates `Record`(s) from FHIR Patient resource
+
+        source: source of the values instead of the resource (eg. a `SourceReference`)"""
 
         self.pt = pt
+        self.source = [source or pt]
 
         (_race, _eth) = self.race_ethnicity()
 
@@ -28,12 +31,21 @@ class FHIRPatient:
     def name(self):
         return "Name"
     
+    @cached_property
+    def birth_datetime(self):
+        """Date of birth, dates the demographics that hold since birth; None if not known"""
+        if self.pt.birthDate and self.pt.birthDate.date:
+            from datetime import datetime
+            bd = self.pt.birthDate.date
+            return datetime(bd.year, bd.month, bd.day)
+        return None
+
     @cached_property
     def gender(self): 
         if self.pt.gender:
             v = var.Var.Gender()
             val_code = Code(self.pt.gender, CodeSystemType.concord.value, self.pt.gender)
-            val = value.Value(val_code, source=[self.pt])
+            val = value.Value(val_code, date=self.birth_datetime, source=self.source)
             rec = record.Record(v, [val])
             return rec
         return None
@@ -41,12 +53,17 @@ class FHIRPatient:
 
     @cached_property
     def age(self):
+        return self.age_as_of(None)
+
+    def age_as_of(self, as_of = None):
+        """Age `Record` on the date `as_of` (date or datetime), today if None"""
         if self.pt.birthDate:
-            from datetime import date
+            from datetime import date, datetime
             bd = self.pt.birthDate.date
-            today = date.today()
+            today = as_of or date.today()
             _age = today.year - bd.year - ((today.month, today.day) < (bd.month, bd.day))
-            return age.Age(_age)
+            # dated on the day it is computed for, so that an `as_of` cut-off keeps it
+            return age.Age(_age, date=datetime(today.year, today.month, today.day))
         else:
             return None        
         
@@ -67,7 +84,7 @@ class FHIRPatient:
                 if race_code.system == CodeSystemType.CDC_RaceEthnicity.value:
                     raceCode = Code(race_code.code, CodeSystemType.CDC_RaceEthnicity.value, race_code.display)
                     v = var.Var.RaceEthnicity()
-                    val = value.Value(raceCode, source=[self.pt])
+                    val = value.Value(raceCode, date=self.birth_datetime, source=self.source)
                     _race = record.Record(v, [val])
             
             if ex.url == CodeSystemType.USCore_Ethnicity.value:
@@ -75,15 +92,15 @@ class FHIRPatient:
                 if race_code.system == CodeSystemType.CDC_RaceEthnicity.value:
                     raceCode = Code(race_code.code, CodeSystemType.CDC_RaceEthnicity.value, race_code.display)
                     v = var.Var.RaceEthnicity()
-                    val = value.Value(raceCode, source=[self.pt])
+                    val = value.Value(raceCode, date=self.birth_datetime, source=self.source)
                     _eth = record.Record(v, [val])
             
         return (_race, _eth)
 
 
-    def records(self):
+    def records(self, as_of = None):
         return [
-            self.age,
+            self.age_as_of(as_of) if as_of else self.age,
             self.gender,
             self.race,
             self.ethnicity
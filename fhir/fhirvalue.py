@@ -3,164 +3,186 @@
 import logging
 
 from fhirclient.models import observation, procedure, condition, medication, medicationrequest, questionnaire, questionnaireresponse, patient
+from fhirclient.models.fhirdate import FHIRDate
 from variables import value
 from primitives.unit import Unit
 from primitives.code import Code
+from primitives.sourcereference import SourceReference
 
 
 
 log = logging.getLogger(__name__)
 
+BP_PANEL_CODES = ('55284-4', '85354-9')
+SYSTOLIC_BP_CODE = '8480-6'
+DIASTOLIC_BP_CODE = '8462-4'
+
+
+def _date(fhirdate: str):
+    # dates parsed as fhirclient does
+    return FHIRDate(fhirdate).date if fhirdate else None
+
+
+def _codes(codeable_concept: dict) -> list[Code]:
+    coding = (codeable_concept or {}).get('coding')
+    if not coding:
+        return None
+    return [Code.interned(c.get('code'), c.get('system'), c.get('display')) for c in coding]
+
 
 class FHIRValue(value.Value):
+    """`Value` of a FHIR resource.
+
+    Resources are decoded straight from their JSON, reading only the elements concord uses;
+    with `strict`, the full fhirclient model is built first, which validates the resource and becomes the source.
+    """
 
     @property
     def fhirtype(self):
-        return self.source[0].resource_type
-    
+        source = self.source[0]
+        return source['resourceType'] if isinstance(source, dict) else source.resource_type
+
 
     @classmethod
     def from_medicationRequest(cls, mr: medicationrequest.MedicationRequest):
-        date = mr.authoredOn.date.date()
-        coding = mr.medicationCodeableConcept.coding
-        codes = [Code(c.coding,c.system,c.display) for c in coding]
-        return cls(value=codes, date=date, source=mr)
-    
+        return cls.decode_medicationRequest(mr.as_json(), source=mr)
+
     @classmethod
     def from_procedure(cls, pr):
         log.error(f'unsupported ={pr}')
 
-    @classmethod 
+    @classmethod
     def from_observation(cls, ob:observation.Observation):
-        date = ob.effectiveDateTime.date or ob.issued.date or ob.meta.lastUpdate.date.date
+        return cls.decode_observation(ob.as_json(), source=ob)
+
+    @property
+    def title(self):
+        return ",".join([c.display or c.code for c in self.code])
+
+    @classmethod
+    def from_condition(cls, c:condition.Condition):
+        return cls.decode_condition(c.as_json(), source=c)
+
+    @classmethod
+    def from_questionnaireResponse(cls, qr: questionnaireresponse.QuestionnaireResponse):
+        return cls.decode_questionnaireResponse(qr.as_json(), source=qr)
+
+
+    # ---- decoding from JSON ---- #
+
+    @classmethod
+    def decode_observation(cls, ob: dict, source=None):
+        date = _date(ob.get('effectiveDateTime')) or _date(ob.get('issued')) or _date((ob.get('meta') or {}).get('lastUpdated'))
         unit = None
-        cd = None
-        if ob.code.coding:
-            cd = [Code(cc.code, cc.system, cc.display) for cc in ob.code.coding]
-        
+        cd = _codes(ob.get('code'))
+
         # decimal
-        if ob.valueQuantity:
-            vq = ob.valueQuantity
-            value = vq.value
-            unit = Unit(vq.code, vq.system, vq.unit)
+        if vq := ob.get('valueQuantity'):
+            value = vq.get('value')
+            unit = Unit(vq.get('code'), vq.get('system'), vq.get('unit'))
 
         # boolean
-        elif ob.valueBoolean:
-            value = ob.valueBoolean
+        elif ob.get('valueBoolean') is not None:
+            value = ob['valueBoolean']
         # blood pressure
-        elif ob.component and (ob.code.coding[0].code == '55284-4' or ob.code.coding[0].code == '85354-9'):
+        elif ob.get('component') and cd and cd[0].code in BP_PANEL_CODES:
             # value == tuple(sbp, dbp)
-            components = ob.component 
             sbp_value = None
             dbp_value = None
-            for c in components:
-                scode = c.code.coding[0].code
-                if scode == '8480-6':
-                    sbp_value = c.valueQuantity.value 
-                elif scode == '8462-4':
-                    dbp_value = c.valueQuantity.value
+            for c in ob['component']:
+                scode = c['code']['coding'][0]['code']
+                if scode == SYSTOLIC_BP_CODE:
+                    sbp_value = c['valueQuantity']['value']
+                elif scode == DIASTOLIC_BP_CODE:
+                    dbp_value = c['valueQuantity']['value']
             if sbp_value == None or dbp_value == None:
                 raise ValueError('BP does not have both sbp and dbp')
             value = (sbp_value, dbp_value)
             unit = Unit('mm[Hg]', 'http://unitsofmeasure.org', 'mmHg')
 
         # codeableconcept
-        elif ob.valueCodeableConcept:
-            coding = ob.valueCodeableConcept.coding[0]
-            cod = Code(coding.code, coding.system, coding.display)
-            value = cod
+        elif vcc := ob.get('valueCodeableConcept'):
+            coding = vcc['coding'][0]
+            value = Code.interned(coding.get('code'), coding.get('system'), coding.get('display'))
         else:
-            raise Exception(f'FHIRValue: Observation value not assigned {ob.id}')
-
+            raise Exception(f'FHIRValue: Observation value not assigned {ob.get("id")}')
 
-        instance = cls(value=value, unit=unit, date=date, source=[ob])
+        instance = cls(value=value, unit=unit, date=date, source=[source or ob])
         instance.code = cd
-
         return instance
 
-    @property
-    def title(self):
-        return ",".join([c.display or c.code for c in self.code])
+    @classmethod
+    def decode_condition(cls, c: dict, source=None):
+        cd = _codes(c.get('code'))
+        if not cd:
+            raise ValueError(f'FHIRValue: Condition without a coded condition {c.get("id")}')
+
+        instance = cls(value=True, unit=None, date=_date(c.get('recordedDate')), source=[source or c])
+        instance.code = cd
+        return instance
 
     @classmethod
-    def from_condition(cls, c:condition.Condition):
-        date = c.recordedDate.date
-        if c.code.coding:
-            cd = [Code(cc.code, cc.system, cc.display) for cc in c.code.coding]
+    def decode_medicationRequest(cls, mr: dict, source=None):
+        # like a condition: the medication's codes, with the value True
+        cd = _codes(mr.get('medicationCodeableConcept'))
+        if not cd:
+            raise ValueError(f'FHIRValue: MedicationRequest without a coded medication {mr.get("id")}')
 
-        instance = cls(value=True, unit=None, date=date, source=[c])
+        instance = cls(value=True, unit=None, date=_date(mr.get('authoredOn')), source=[source or mr])
         instance.code = cd
         return instance
-    
+
     @classmethod
-    def from_questionnaireResponse(cls, qr: questionnaireresponse.QuestionnaireResponse):
-        # 
-        # 
+    def decode_questionnaireResponse(cls, qr: dict, source=None):
+        #
+        #
         log.info(' ******************* TODO: GET CONCORD Coded AnswersL')
         #
         #
-        itm = qr.item
+        itm = qr.get('item')
         value = None
-        if itm:
-            cnt = len(itm)
-            if cnt == 1:
-                first = itm[0]
-                if first and first.answer:
-                    ans = first.answer[0]
-                    if ans.valueBoolean is not None:
-                        value = ans.valueBoolean
-                    elif ans.valueQuantity:
-                        value = ans.valueQuantity.value 
-                    elif ans.valueCoding:
-                        value = ans.valueCoding.code 
-
-        date = qr.authored.date
+        if itm and len(itm) == 1:
+            first = itm[0]
+            if first and first.get('answer'):
+                ans = first['answer'][0]
+                if ans.get('valueBoolean') is not None:
+                    value = ans['valueBoolean']
+                elif ans.get('valueQuantity'):
+                    value = ans['valueQuantity'].get('value')
+                elif ans.get('valueCoding'):
+                    value = ans['valueCoding'].get('code')
+
         if not value:
             raise ValueError('Cannot get value from QuestionnarieResponse')
-        
-        return cls(value=value, unit=None, date=date, source=[qr])
 
+        return cls(value=value, unit=None, date=_date(qr.get('authored')), source=[source or qr])
 
 
-    @classmethod 
-    def from_fhir(cls, fhirjson):
+    @classmethod
+    def from_fhir(cls, fhirjson, strict: bool = False, reference: SourceReference = None):
+        """strict: build (and so validate) the fhirclient model of the resource, kept as the value's source
+        reference: kept as the value's source instead of the resource, which is then not held in memory"""
 
-        resource_type = fhirjson['resourceType']
+        resource_type = fhirjson.get('resourceType')
         if not resource_type:
             raise ValueError(f'Unknown file, missing resourceType: {fhirjson}')
 
-
-        unit = None
-
-        # Observation
-        if resource_type == 'Observation':
-            try:
-                ob = observation.Observation.parse_obj(fhirjson)
-                return cls.from_observation(ob)
-            except Exception as e:
-                log.error("error",fhirjson)
-                raise e
-            
-
-        # Condition
-        elif resource_type == 'Condition':
-            c = condition.Condition.parse_obj(fhirjson)
-            return cls.from_condition(c)
-            
-        # QuestionnaireResponse
-        elif resource_type == 'QuestionnaireResponse':
-            qr = questionnaireresponse.QuestionnaireResponse.parse_obj(fhirjson)
-            return cls.from_questionnaireResponse(qr)
-
-        elif resource_type == 'MedicationRequest':
-            mr = medicationrequest.MedicationRequest.parse_obj(fhirjson)
-            return cls.from_medicationRequest(mr)
-        
-        elif resource_type == 'Procedure':
-            pr = procedure.Procedure.parse_obj(fhirjson)
+        if resource_type == 'Procedure':
+            pr = procedure.Procedure(fhirjson) if strict else fhirjson
             return cls.from_procedure(pr)
 
-        else:
+        decoder = _DECODERS.get(resource_type)
+        if decoder is None:
             raise ValueError(f'Unknown FHIR resource type: {resource_type}')
 
+        model, decode = decoder
+        source = model(fhirjson) if strict else None
+        return decode(cls, fhirjson, source=reference or source)
+
 
+_DECODERS = {
+    'Observation':              (observation.Observation, FHIRValue.decode_observation.__func__),
+    'Condition':                (condition.Condition, FHIRValue.decode_condition.__func__),
+    'QuestionnaireResponse':    (questionnaireresponse.QuestionnaireResponse, FHIRValue.decode_questionnaireResponse.__func__),
+    'MedicationRequest':        (medicationrequest.MedicationRequest, FHIRValue.decode_medicationRequest.__func__),
+}
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+# Local stand-in of a FHIR server, serving an export directory (eg. samples/fhir_r4/ndjson) on localhost
+# to develop and test `fhir.bulkclient` and `fhir.search` without a real server.
+#
+#   with MockBulkServer('samples/fhir_r4/ndjson') as server:
+#       BulkDataClient(server.url).export('/tmp/export')
+#
+# Kick-off (`$export`, `Patient/$export`, `Group/<id>/$export`) answers 202 with a status url, which
+# answers 202 `pending_polls` times before the manifest. Files support Range requests; with
+# `interrupt_after`, the first response of each file is broken off after that many bytes, with
+# `unavailable`, the first requests of each file answer 503, and with `range_block`, ranges are
+# answered from the start of the block holding the requested byte.
+#
+# The same resources can be read (`Patient/<id>`) and searched (`Observation?patient=..&code=..`,
+# with `_lastUpdated`, `_count` and paging); responses carry an ETag and answer 304 to If-None-Match.
+# `update(resource)` adds or replaces a resource, stamping `meta.lastUpdated`. The server's clock,
+# for those stamps and the Date header, runs `clock_skew` seconds off the local one.
+
+import hashlib, json, logging, os, threading, time, uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from fhir.bulk import NDJSONExport, iter_ndjson, patient_key
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class MockBulkServer:
+    """Bulk-data server of the NDJSON files in `directory`"""
+
+    directory: str
+    port: int = 0
+    """0 picks a free port"""
+    pending_polls: int = 1
+    retry_after: float = 0.05
+    interrupt_after: int = None
+    unavailable: int = 0
+    """the first requests of each file answered 503, with Retry-After"""
+    range_block: int = None
+    """bytes per block ranges are aligned to, as some servers do; ranges are answered as requested if None"""
+    access_token: str = None
+    """when given, every request must carry it as a Bearer token"""
+    clock_skew: float = 0.0
+    """seconds the server's clock is ahead of the local one, behind if negative"""
+    requests: list = field(default_factory=list, init=False, repr=False)
+    """(method, path, headers) of every request served"""
+    loaded_at: str = field(default=None, init=False, repr=False)
+    """`meta.lastUpdated` of resources that have none"""
+    __resources: dict = field(default=None, init=False, repr=False)
+    __jobs: dict = field(default_factory=dict, init=False, repr=False)
+    __interrupted: set = field(default_factory=set, init=False, repr=False)
+    __file_requests: dict = field(default_factory=dict, init=False, repr=False)
+    __lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    __httpd: ThreadingHTTPServer = field(default=None, init=False, repr=False)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.__httpd.server_address[1]}'
+
+    def start(self) -> 'MockBulkServer':
+        self.__httpd = ThreadingHTTPServer(('127.0.0.1', self.port), self.__handler())
+        self.__httpd.daemon_threads = True
+        threading.Thread(target=self.__httpd.serve_forever, daemon=True).start()
+        log.info(f'MockBulkServer: serving {self.directory} at {self.url}')
+        return self
+
+    def stop(self):
+        if self.__httpd:
+            self.__httpd.shutdown()
+            self.__httpd.server_close()
+            self.__httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def now(self) -> datetime:
+        """Time on the server's clock"""
+        return datetime.now(timezone.utc) + timedelta(seconds=self.clock_skew)
+
+    # ---- responses ---- #
+
+    def kick_off(self, query: dict) -> str:
+        """New job of the export; its id"""
+        types = set(query['_type'][0].split(',')) if query.get('_type') else None
+        job = uuid.uuid4().hex[:16]
+        with self.__lock:
+            self.__jobs[job] = {'types': types, 'polls': 0}
+        return job
+
+    def has_job(self, job: str) -> bool:
+        with self.__lock:
+            return job in self.__jobs
+
+    def status(self, job: str) -> dict:
+        """Manifest of the job, None while it is pending"""
+        with self.__lock:
+            state = self.__jobs[job]
+            state['polls'] += 1
+            if state['polls'] <= self.pending_polls:
+                return None
+        files = NDJSONExport(self.directory).files(state['types'])
+        output = [{
+            'type': resource_type,
+            'url': f'{self.url}/jobs/{job}/download/{os.path.basename(path)}',
+        } for resource_type, path in files]
+        return {
+            'transactionTime': self.now().isoformat(),
+            'request': f'{self.url}/$export',
+            'requiresAccessToken': self.access_token is not None,
+            'output': output,
+            'error': [],
+        }
+
+    def file_path(self, name: str) -> str:
+        path = os.path.join(self.directory, os.path.basename(name))
+        return path if os.path.isfile(path) else None
+
+    def interrupts(self, name: str) -> bool:
+        """Whether the response of the file is broken off, once per file"""
+        if self.interrupt_after is None:
+            return False
+        with self.__lock:
+            if name in self.__interrupted:
+                return False
+            self.__interrupted.add(name)
+            return True
+
+    def is_unavailable(self, name: str) -> bool:
+        """Whether the request of the file is answered 503, for its first `unavailable` requests"""
+        with self.__lock:
+            count = self.__file_requests[name] = self.__file_requests.get(name, 0) + 1
+            return count <= self.unavailable
+
+    def resources(self) -> dict:
+        """resource type -> {id: resource}, read from the directory on first use"""
+        with self.__lock:
+            if self.__resources is None:
+                self.loaded_at = self.now().isoformat()
+                self.__resources = {}
+                for resource_type, path in NDJSONExport(self.directory).files():
+                    for resource in iter_ndjson(path):
+                        self.__resources.setdefault(resource_type, {})[resource.get('id')] = resource
+            return self.__resources
+
+    def update(self, resource: dict):
+        """Adds or replaces `resource`, last updated now"""
+        resource.setdefault('meta', {})['lastUpdated'] = self.now().isoformat()
+        resources = self.resources()
+        with self.__lock:
+            resources.setdefault(resource['resourceType'], {})[resource['id']] = resource
+
+    def read(self, resource_type: str, id: str) -> dict:
+        return self.resources().get(resource_type, {}).get(id)
+
+    def search(self, resource_type: str, query: dict) -> list[dict]:
+        """Resources matching the `patient`, `code` and `_lastUpdated` parameters of `query`"""
+        patient = query.get('patient', [None])[0]
+        if patient:
+            patient = patient.rsplit('/', 1)[-1]
+        tokens = set(query['code'][0].split(',')) if query.get('code') else None
+        last_updated = query.get('_lastUpdated', [None])[0]
+        matches = []
+        for resource in list(self.resources().get(resource_type, {}).values()):
+            if patient and patient_key(resource) != patient:
+                continue
+            if tokens and not any(t in tokens for t in self.__tokens(resource)):
+                continue
+            if last_updated and not self.__updated_since(resource, last_updated):
+                continue
+            matches.append(resource)
+        return matches
+
+    def bundle(self, resource_type: str, query: dict) -> dict:
+        matches = self.search(resource_type, query)
+        count = int(query.get('_count', [50])[0])
+        offset = int(query.get('_offset', [0])[0])
+        bundle = {
+            'resourceType': 'Bundle',
+            'type': 'searchset',
+            'total': len(matches),
+            'entry': [{'resource': r} for r in matches[offset:offset + count]],
+            'link': [],
+        }
+        if offset + count < len(matches):
+            params = urlencode({**{k: v[0] for k, v in query.items()}, '_offset': offset + count})
+            bundle['link'].append({'relation': 'next', 'url': f'{self.url}/{resource_type}?{params}'})
+        return bundle
+
+    def __updated_since(self, resource: dict, last_updated: str) -> bool:
+        updated = (resource.get('meta') or {}).get('lastUpdated') or self.loaded_at
+        prefix, instant = last_updated[:2], last_updated[2:]
+        if prefix not in ('gt', 'ge'):
+            prefix, instant = 'ge', last_updated
+        parse = datetime.fromisoformat
+        return parse(updated) > parse(instant) if prefix == 'gt' else parse(updated) >= parse(instant)
+
+    @staticmethod
+    def __tokens(resource: dict) -> list[str]:
+        concept = resource.get('code') or resource.get('medicationCodeableConcept') or {}
+        tokens = []
+        for coding in concept.get('coding') or []:
+            tokens.append(coding.get('code'))
+            tokens.append(f'{coding.get("system")}|{coding.get("code")}')
+        return tokens
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                log.debug(f'MockBulkServer: {format % args}')
+
+            def date_time_string(self, timestamp=None):
+                return super().date_time_string((timestamp or time.time()) + server.clock_skew)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = [p for p in url.path.split('/') if p]
+                server.requests.append(('GET', self.path, dict(self.headers)))
+                if server.access_token and self.headers.get('Authorization') != f'Bearer {server.access_token}':
+                    return self.send_json(401, {'resourceType': 'OperationOutcome'})
+                if parts and parts[-1] == '$export':
+                    job = server.kick_off(parse_qs(url.query))
+                    return self.send_empty(202, {'Content-Location': f'{server.url}/jobs/{job}/status'})
+                if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'status':
+                    if not server.has_job(parts[1]):
+                        return self.send_json(404, {'resourceType': 'OperationOutcome'})
+                    manifest = server.status(parts[1])
+                    if manifest is None:
+                        return self.send_empty(202, {'Retry-After': str(server.retry_after), 'X-Progress': 'in progress'})
+                    return self.send_json(200, manifest)
+                if len(parts) == 4 and parts[0] == 'jobs' and parts[2] == 'download':
+                    return self.send_file(parts[3])
+                if len(parts) == 2:
+                    resource = server.read(*parts)
+                    if resource is None:
+                        return self.send_json(404, {'resourceType': 'OperationOutcome'})
+                    return self.send_cacheable(resource)
+                if len(parts) == 1 and parts[0][:1].isupper():
+                    return self.send_cacheable(server.bundle(parts[0], parse_qs(url.query)))
+                self.send_json(404, {'resourceType': 'OperationOutcome'})
+
+            def send_cacheable(self, body: dict):
+                etag = 'W/"' + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self.send_empty(304, {'ETag': etag})
+                self.send_json(200, body, {'ETag': etag})
+
+            def send_empty(self, status: int, headers: dict):
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def send_json(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_file(self, name: str):
+                path = server.file_path(name)
+                if path is None:
+                    return self.send_json(404, {'resourceType': 'OperationOutcome'})
+                if server.is_unavailable(name):
+                    return self.send_empty(503, {'Retry-After': '0'})
+                size = os.path.getsize(path)
+                start = 0
+                if byte_range := self.headers.get('Range'):
+                    start = int(byte_range.removeprefix('bytes=').split('-')[0])
+                    if server.range_block:
+                        start -= start % server.range_block
+                    if start >= size:
+                        return self.send_empty(416, {'Content-Range': f'bytes */{size}'})
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'application/fhir+ndjson')
+                self.send_header('Content-Length', str(size - start))
+                self.end_headers()
+
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    if server.interrupts(name):
+                        self.wfile.write(f.read(server.interrupt_after))
+                        self.wfile.flush()
+                        self.close_connection = True
+                        return
+                    while chunk := f.read(2**16):
+                        self.wfile.write(chunk)
+
+        return Handler
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# Byte-offset index of a bulk-data export, for reading one patient's resources without a full scan.
+#
+# For every patient it records the file and byte range of each of their resources; the index is
+# saved next to the export (`INDEX_FILE`) and reused while the files it was built from are unchanged.
+# Plain NDJSON files are read through memory maps; gzipped files are indexed on their decompressed
+# bytes and have to be decompressed up to an offset to be read, so are best unpacked first.
+
+import json, logging, mmap, os
+from array import array
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+from fhir.bulk import NDJSONExport, PATIENT_RESOURCE_TYPE, VALUE_RESOURCE_TYPES, open_ndjson, patient_key
+from primitives.sourcereference import SourceReference
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = '.concord-index.json'
+INDEX_VERSION = 1
+
+
+@dataclass
+class NDJSONIndex:
+    """Patient -> (file, offset, length) of their resources in an export"""
+
+    directory: str
+    files: list[dict]
+    """resource `type`, file `name`, and the `size` and `mtime_ns` it was indexed at"""
+    positions: dict[str, array]
+    """patient key -> flat (file index, offset, length) triplets"""
+    __maps: dict = field(default_factory=dict, init=False, repr=False)
+
+    @classmethod
+    def build(cls, directory: str, resource_types: Iterable[str] = None) -> 'NDJSONIndex':
+        """Indexes the export with a single scan of its files"""
+        resource_types = resource_types or VALUE_RESOURCE_TYPES + (PATIENT_RESOURCE_TYPE,)
+        files, positions, skipped = [], {}, 0
+        for index, (resource_type, path) in enumerate(NDJSONExport(directory).files(resource_types)):
+            files.append(cls.__stat(resource_type, path))
+            offset = 0
+            with open_ndjson(path) as file_:
+                for line in file_:
+                    length = len(line)
+                    if line.strip():
+                        key = patient_key(json.loads(line))
+                        if key is None:
+                            skipped += 1
+                        else:
+                            positions.setdefault(key, array('q')).extend((index, offset, length))
+                    offset += length
+        if skipped:
+            log.warning(f'NDJSONIndex: {skipped} resources without a patient reference not indexed')
+        log.info(f'NDJSONIndex: {len(positions)} patients indexed in {directory}')
+        return cls(directory, files, positions)
+
+    @classmethod
+    def load(cls, directory: str) -> 'NDJSONIndex':
+        """The saved index of the export; None if there is none or its files have changed since"""
+        path = os.path.join(directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        if saved.get('version') != INDEX_VERSION:
+            return None
+        index = cls(directory, saved['files'], {k: array('q', v) for k, v in saved['positions'].items()})
+        if not index.is_current():
+            log.info(f'NDJSONIndex: {path} is out of date')
+            return None
+        return index
+
+    @classmethod
+    def for_export(cls, directory: str) -> 'NDJSONIndex':
+        """The saved index of the export, built and saved if there is none that is current"""
+        index = cls.load(directory)
+        if index is None:
+            index = cls.build(directory)
+            index.save()
+        return index
+
+    def save(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        saved = {
+            'version': INDEX_VERSION,
+            'files': self.files,
+            'positions': {k: v.tolist() for k, v in self.positions.items()},
+        }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(saved, f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    def is_current(self) -> bool:
+        """Whether the indexed files are unchanged"""
+        for f in self.files:
+            path = os.path.join(self.directory, f['name'])
+            if not os.path.exists(path) or self.__stat(f['type'], path) != f:
+                return False
+        return True
+
+    @property
+    def patients(self) -> list[str]:
+        return list(self.positions)
+
+    def lines(self, patient: str) -> Iterator[tuple[int, int, bytes]]:
+        """(file index, offset, raw line) of each of the patient's resources, in file order"""
+        triplets = self.positions.get(patient)
+        if not triplets:
+            return
+        gzipped = None
+        for i in range(0, len(triplets), 3):
+            index, offset, length = triplets[i:i + 3]
+            mapped = self.__mapped(index)
+            if mapped is not None:
+                yield index, offset, mapped[offset:offset + length]
+                continue
+            # gzipped: one forward pass over the file for all of the patient's lines in it
+            if gzipped is None or gzipped[0] != index:
+                if gzipped:
+                    gzipped[1].close()
+                gzipped = (index, open_ndjson(self.path(index)))
+            gzipped[1].seek(offset)
+            yield index, offset, gzipped[1].read(length)
+        if gzipped:
+            gzipped[1].close()
+
+    def resources(self, patient: str) -> Iterator[tuple[dict, SourceReference]]:
+        """The patient's resources, each with its `SourceReference`"""
+        for index, offset, line in self.lines(patient):
+            resource = json.loads(line)
+            yield resource, SourceReference.of(resource, self.path(index), offset, len(line))
+
+    def path(self, index: int) -> str:
+        return os.path.abspath(os.path.join(self.directory, self.files[index]['name']))
+
+    def close(self):
+        for mapped in self.__maps.values():
+            if mapped is not None:
+                mapped.close()
+        self.__maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __mapped(self, index: int) -> mmap.mmap:
+        if index not in self.__maps:
+            self.__maps[index] = self.__map(self.path(index))
+        return self.__maps[index]
+
+    @staticmethod
+    def __map(path: str) -> mmap.mmap:
+        # gzipped files cannot be mapped, None
+        with open(path, 'rb') as file_:
+            if file_.peek(2)[:2] == b'\x1f\x8b':
+                return None
+            return mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def __stat(resource_type: str, path: str) -> dict:
+        st = os.stat(path)
+        return {'type': resource_type, 'name': os.path.basename(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
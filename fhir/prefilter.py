@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Code pushdown for FHIR ingest: drop resources whose codes cannot match a CPG variable
+# before they are decoded, converted and bucketed.
+
+import re
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from primitives.code import Code
+
+
+# resource types matched to variables by one CodeableConcept; others (eg. Patient) always pass
+CODED_ELEMENTS = {
+    'Observation':          'code',
+    'Condition':            'code',
+    'Procedure':            'code',
+    'MedicationRequest':    'medicationCodeableConcept',
+}
+
+
+@dataclass(frozen=True)
+class CodePrefilter:
+    """Accepts resources carrying any of `codes` ((system, code) pairs).
+
+    `may_match` is a compiled multi-pattern search over the raw bytes of a resource, for every code
+    at once; it may let through a resource that only mentions a code elsewhere, which `accepts`,
+    an exact check of the decoded resource's coding, then rejects.
+    """
+
+    codes: frozenset[tuple[str, str]]
+    pattern: re.Pattern = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        values = sorted({re.escape(code.encode()) for _, code in self.codes if code}, key=len, reverse=True)
+        pattern = rb'"code"\s*:\s*"(?:' + b'|'.join(values) + rb')"' if values else rb'(?!)'
+        object.__setattr__(self, 'pattern', re.compile(pattern))
+
+    @classmethod
+    def for_codes(cls, codes: Iterable[Code]) -> 'CodePrefilter':
+        return cls(frozenset((c.system, c.code) for c in codes))
+
+    @classmethod
+    def for_variables(cls, variables: list) -> 'CodePrefilter':
+        return cls.for_codes(c for v in variables for c in v.code or [])
+
+    @classmethod
+    def for_cpgs(cls, cpgs: list) -> 'CodePrefilter':
+        """Union of the variable codes of all `cpgs`"""
+        return cls.for_codes(c for cpg in cpgs for c in cpg.code_index.identifiers)
+
+    def may_match(self, line: bytes) -> bool:
+        """False when the raw resource cannot carry any of the codes"""
+        return self.pattern.search(line) is not None
+
+    def accepts(self, resource: dict) -> bool:
+        """Exact check of a decoded resource"""
+        element = CODED_ELEMENTS.get(resource.get('resourceType'))
+        if element is None:
+            return True
+        coding = (resource.get(element) or {}).get('coding') or ()
+        return any((c.get('system'), c.get('code')) in self.codes for c in coding)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# Per-patient FHIR searches scoped to the codes of a CPG's variables.
+#
+# Rather than everything a patient has, only resources carrying a code some variable uses are
+# fetched: the codes are grouped by the resource type their code system is recorded in and sent
+# as batched `code=` searches, run concurrently over keep-alive connections. Responses are cached
+# with their ETag and revalidated with If-None-Match; a patient searched before is refreshed with
+# `_lastUpdated` for what changed since. That time is the server's, taken from the search Bundle's
+# `meta.lastUpdated` or the response's Date header, less `refresh_overlap`, so clock skew between
+# client and server does not hide updates.
+#
+#   search = CodeSearch('https://fhir.example.org/fhir', cpg.variables, access_token=token)
+#   hc = search.healthcontext('123')
+
+import logging, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import cached_property
+
+import requests
+
+from core.healthcontext import HealthContext
+from fhir.bulk import PATIENT_RESOURCE_TYPE, healthcontext_of
+from fhir.bulkclient import BulkDataError, pooled_session
+from fhir.prefilter import CodePrefilter
+from ontology.definitions import CodeSystemType
+from primitives.code import Code
+from primitives.types import Persona
+from variables.codeindex import CodeIndex
+from variables.var import Var
+
+log = logging.getLogger(__name__)
+
+# code system -> resource type searched for its codes; codes of other systems (eg. concord) are not searched
+SEARCH_RESOURCE_TYPES = {
+    CodeSystemType.loinc.value:     'Observation',
+    CodeSystemType.snomed.value:    'Condition',
+    CodeSystemType.icd10cm.value:   'Condition',
+    CodeSystemType.rxnorm.value:    'MedicationRequest',
+    CodeSystemType.cpt.value:       'Procedure',
+}
+
+
+@dataclass(frozen=True)
+class CodeQuery:
+    """One search: resources of `resource_type` with any of `codes`"""
+
+    resource_type: str
+    codes: tuple[Code, ...]
+
+    def params(self, patient: str, since: datetime = None, count: int = None) -> dict:
+        params = {'patient': patient, 'code': ','.join(f'{c.system}|{c.code}' for c in self.codes)}
+        if since:
+            params['_lastUpdated'] = f'ge{since.isoformat()}'
+        if count:
+            params['_count'] = count
+        return params
+
+
+def code_queries(for_variables: list[Var], codes_per_query: int = 40) -> list[CodeQuery]:
+    """Searches covering every code of the variables, at most `codes_per_query` codes each"""
+    by_type = {}
+    for variable in for_variables:
+        for c in variable.code or []:
+            resource_type = SEARCH_RESOURCE_TYPES.get(c.system)
+            if resource_type:
+                by_type.setdefault(resource_type, dict())[c] = None
+    queries = []
+    for resource_type, codes in by_type.items():
+        codes = list(codes)
+        for i in range(0, len(codes), codes_per_query):
+            queries.append(CodeQuery(resource_type, tuple(codes[i:i + codes_per_query])))
+    return queries
+
+
+@dataclass
+class CodeSearch:
+    """Searches of a FHIR server for the resources the variables of a CPG can use.
+
+    Deletions on the server are not seen by an incremental refresh; `forget` a patient to fetch them anew.
+    """
+
+    base_url: str
+    for_variables: list[Var]
+    access_token: str = None
+    persona: Persona = Persona.patient
+    until_date: date = None
+    max_workers: int = 4
+    """concurrent searches, and the size of the connection pool"""
+    codes_per_query: int = 40
+    """codes of one `code=` search, keeping urls short"""
+    page_size: int = 200
+    cache_size: int = 4096
+    """responses kept with their ETag"""
+    request_timeout: float = 30.0
+    retries: int = 5
+    refresh_overlap: float = 60.0
+    """seconds before the server time of the last search that a refresh starts from"""
+    strict: bool = False
+    __cache: OrderedDict = field(default_factory=OrderedDict, init=False, repr=False)
+    __patients: dict = field(default_factory=dict, init=False, repr=False)
+    __lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @cached_property
+    def session(self) -> requests.Session:
+        return pooled_session(self.max_workers, self.retries, self.access_token)
+
+    @cached_property
+    def queries(self) -> list[CodeQuery]:
+        return code_queries(self.for_variables, self.codes_per_query)
+
+    @cached_property
+    def code_index(self) -> CodeIndex:
+        return CodeIndex.for_variables(self.for_variables)
+
+    @cached_property
+    def prefilter(self) -> CodePrefilter:
+        # servers may match codes loosely (eg. by code only), results are checked again
+        return CodePrefilter.for_variables(self.for_variables)
+
+    def search(self, patient: str, since: datetime = None) -> list[dict]:
+        """The patient's resources with any of the variables' codes, last updated at or after `since` if given"""
+        return self.__search_all(patient, since)[0]
+
+    def __search_all(self, patient: str, since: datetime) -> tuple[list[dict], datetime]:
+        # resources, and the earliest server time of the searches (None if the server gives none)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.__search, query, patient, since) for query in self.queries]
+            results = [future.result() for future in futures]
+        times = [t for _, t in results if t]
+        return [resource for resources, _ in results for resource in resources], min(times) if times else None
+
+    def resources(self, patient: str, refresh: bool = True) -> list[dict]:
+        """The patient's Patient resource and resources for the variables: all of them the first time,
+        after that what changed since the last time, unless `refresh` is False"""
+        cached = self.__patients.get(patient)
+        if cached and not refresh:
+            return [cached['patient'], *cached['resources'].values()]
+
+        started = datetime.now(timezone.utc)
+        found, server_time = self.__search_all(patient, since=cached['fetched_at'] if cached else None)
+        if server_time is None:
+            log.warning(f'Search: no server time in the responses of {self.base_url}, refreshing from the local clock')
+        resources = dict(cached['resources']) if cached else {}
+        for resource in found:
+            resources[(resource['resourceType'], resource.get('id'))] = resource
+        self.__patients[patient] = {
+            'fetched_at': (server_time or started) - timedelta(seconds=self.refresh_overlap),
+            'patient': self.get(f'{self.base_url.rstrip("/")}/{PATIENT_RESOURCE_TYPE}/{patient}'),
+            'resources': resources,
+        }
+        log.debug(f'Search: patient={patient} {len(found)} resources fetched, {len(resources)} in all')
+        return self.resources(patient, refresh=False)
+
+    def healthcontext(self, patient: str, refresh: bool = True) -> HealthContext:
+        return healthcontext_of(
+            patient, self.resources(patient, refresh), self.for_variables, self.persona, self.until_date,
+            code_index=self.code_index, strict=self.strict)
+
+    def forget(self, patient: str):
+        self.__patients.pop(patient, None)
+
+    def get(self, url: str, params: dict = None) -> dict:
+        """GET of a FHIR resource or Bundle, revalidated with If-None-Match when it is cached"""
+        return self.__get(url, params)[0]
+
+    def __get(self, url: str, params: dict = None) -> tuple[dict, datetime]:
+        # the body, and the server time of the response
+        key = requests.Request('GET', url, params=params).prepare().url
+        with self.__lock:
+            cached = self.__cache.get(key)
+        headers = {'Accept': 'application/fhir+json'}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+
+        response = self.session.get(key, headers=headers, timeout=self.request_timeout)
+        if response.status_code == 304 and cached:
+            with self.__lock:
+                self.__cache.move_to_end(key)
+            return cached[1], self.server_time(response)
+        if response.status_code != 200:
+            raise BulkDataError('Search: request failed', response)
+
+        body = response.json()
+        if etag := response.headers.get('ETag'):
+            with self.__lock:
+                self.__cache[key] = (etag, body)
+                self.__cache.move_to_end(key)
+                while len(self.__cache) > self.cache_size:
+                    self.__cache.popitem(last=False)
+        return body, self.server_time(response, body)
+
+    @staticmethod
+    def server_time(response: requests.Response, body: dict = None) -> datetime:
+        """When the server answered (aware): the Bundle's `meta.lastUpdated`, else the Date header; None if neither is given"""
+        for parse, text in ((datetime.fromisoformat, ((body or {}).get('meta') or {}).get('lastUpdated')),
+                            (parsedate_to_datetime, response.headers.get('Date'))):
+            try:
+                dt = parse(text) if text else None
+            except (TypeError, ValueError):
+                dt = None
+            if dt is not None:
+                return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+        return None
+
+    def __search(self, query: CodeQuery, patient: str, since: datetime) -> tuple[list[dict], datetime]:
+        # resources of all pages, and the server time of the first
+        resources = []
+        bundle, server_time = self.__get(f'{self.base_url.rstrip("/")}/{query.resource_type}', query.params(patient, since, self.page_size))
+        while True:
+            for entry in bundle.get('entry') or []:
+                resource = entry.get('resource')
+                if resource and self.prefilter.accepts(resource):
+                    resources.append(resource)
+            next_url = next((link['url'] for link in bundle.get('link') or [] if link.get('relation') == 'next'), None)
+            if not next_url:
+                return resources, server_time
+            bundle = self.get(next_url)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Attestation sessions on an event loop: the questions for every variable waiting for attestation
+# go to the front end in one batch, and the session is suspended until the answers come back, so
+# thousands of patients can be waiting on one event loop without a thread each.
+#
+#   frontend = MemoryFrontend()
+#   session = AsyncSession(concord, frontend, 'patient-123')
+#   if await session.run():
+#       concord.assess()
+#
+# Answers are validated as `CLI` does, by setting `Record.attested_value`; rejected or missing
+# answers are asked again, with the errors, for up to `max_rounds` rounds.
+
+import asyncio, logging, uuid
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Protocol
+
+from core.concord import Concord
+from primitives.types import ValueType
+from variables.record import Record
+from variables.value import Value
+from .inputprotocol import AsyncInputProtocol
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Question:
+    """What the front end asks for one variable"""
+
+    id: str
+    title: str
+    value_type: ValueType = None
+    required: bool = True
+    error: str = None
+    """why the previous answer was rejected"""
+
+    @classmethod
+    def of(cls, record: Record, error: str = None) -> 'Question':
+        return cls(record.id, record.var.title or record.id, record.var.value_type, record.var.required, error)
+
+
+class Frontend(Protocol):
+
+    async def ask(self, session_id: str, questions: list[Question]) -> dict[str, Any]:
+        """Answers (variable id -> value) to some or all of the questions"""
+        ...
+
+
+def coerce(value, value_type: ValueType):
+    """Typed value of an answer given as text (`'42'`, `'yes'`, `'2020-01-31'`); other values as they are"""
+    if not isinstance(value, str) or value_type is None:
+        return value
+    text = value.strip()
+    if value_type == ValueType.boolean:
+        if text.lower() in ('true', 'yes', 'y', '1'):
+            return True
+        if text.lower() in ('false', 'no', 'n', '0'):
+            return False
+        return text
+    if value_type == ValueType.integer:
+        return int(text)
+    if value_type == ValueType.decimal:
+        return float(text)
+    if value_type == ValueType.date:
+        return date.fromisoformat(text)
+    return text
+
+
+@dataclass
+class AsyncSession(AsyncInputProtocol):
+    """Collects the attestations a `Concord` waits for (`NeedAttestationError`) from a front end"""
+
+    concord: Concord
+    frontend: Frontend
+    session_id: str = None
+    max_rounds: int = 3
+    timeout: float = None
+    """seconds to wait for each batch of answers"""
+
+    def __post_init__(self):
+        self.session_id = self.session_id or uuid.uuid4().hex
+
+    async def prepare(self):
+        if self.concord.sufficiency_result is None:
+            raise ValueError('AsyncSession: sufficiency must be evaluated before attestation')
+
+    async def run(self) -> bool:
+        """True when every variable waiting for attestation has an attested value"""
+        await self.prepare()
+        pending = {ev.record.id: ev.record for ev in self.concord.sufficiency_result.attestation_variables}
+        errors = {}
+        for _ in range(self.max_rounds):
+            if not pending:
+                return True
+            try:
+                answers = await asyncio.wait_for(self.get_input(list(pending.values()), errors), self.timeout)
+            except asyncio.TimeoutError:
+                log.info(f'AsyncSession={self.session_id}: no answers within {self.timeout}s')
+                return False
+            errors = {}
+            for var_id, answer in answers.items():
+                record = pending.get(var_id)
+                if record is None:
+                    log.warning(f'AsyncSession={self.session_id}: no attestation pending for variable={var_id}')
+                    continue
+                try:
+                    self.validate(answer, record)
+                    del pending[var_id]
+                except Exception as e:
+                    errors[var_id] = str(e)
+        return not pending
+
+    async def get_input(self, records: list[Record], errors: dict = None) -> dict:
+        errors = errors or {}
+        return await self.frontend.ask(self.session_id, [Question.of(r, errors.get(r.id)) for r in records])
+
+    def validate(self, value, variable: Record, structure_definition=None) -> bool:
+        """Attests the answer; raises when it is not a valid value of the variable"""
+        answer = value if isinstance(value, Value) else Value(coerce(value, variable.var.value_type), source=['attested'])
+        variable.attested_value = answer
+        if not variable.has_value:
+            raise ValueError(f'Answer={value} not accepted for variable={variable.id}')
+        return True
+
+
+@dataclass
+class MemoryFrontend:
+    """In-memory stand-in of a front end: sessions wait in `ask` until `answer` is called for them"""
+
+    asked: asyncio.Queue = field(default_factory=asyncio.Queue)
+    """ids of the sessions as they ask"""
+    __waiting: dict = field(default_factory=dict, init=False, repr=False)
+
+    async def ask(self, session_id: str, questions: list[Question]) -> dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        self.__waiting[session_id] = (questions, future)
+        self.asked.put_nowait(session_id)
+        try:
+            return await future
+        finally:
+            self.__waiting.pop(session_id, None)
+
+    def questions(self, session_id: str) -> list[Question]:
+        """Open questions of the session, empty if it is not waiting"""
+        waiting = self.__waiting.get(session_id)
+        return waiting[0] if waiting else []
+
+    @property
+    def waiting(self) -> list[str]:
+        return list(self.__waiting)
+
+    def answer(self, session_id: str, answers: dict[str, Any]):
+        """Answers the open questions of the session; raises KeyError if it is not waiting"""
+        _, future = self.__waiting[session_id]
+        if not future.done():
+            future.set_result(answers)
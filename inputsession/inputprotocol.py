@@ -19,3 +19,19 @@ class InputProtocol(Protocol):
         ...  
 
 
+
+class AsyncInputProtocol(Protocol):
+    """`InputProtocol` for front ends that answer later (web forms, chat): waiting for an answer
+    suspends a coroutine instead of holding a thread, so one event loop drives many sessions"""
+
+    def validate(self, value, variable, structure_definition = None):
+        ...
+
+    async def prepare(self):
+        ...
+
+    async def run(self):
+        ...
+
+    async def get_input(self, records, errors: dict = None) -> dict:
+        ...
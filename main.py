@@ -25,6 +25,7 @@ parser.add_argument('-f', dest='filepath', type=str, help='Path to Concord.CPG f
 parser.add_argument('-t', dest='template_name', type=str, help='Name of the template')
 parser.add_argument('-p', dest='persona', type=str, help='patient or provider persona')
 parser.add_argument('--inspect', action=argparse.BooleanOptionalAction, help='Inspect output')
+parser.add_argument('--demand-driven', dest='demand_driven', action=argparse.BooleanOptionalAction, help='Only evaluate what applicable recommendations need')
 
 args = parser.parse_args()
 fp = args.filepath
@@ -58,7 +59,7 @@ ht(
 #       OUT:    Checks(Validity, Eligibility, Sufficiency, Execution, Recommendations)
 """)
 mycpg = cpg.CPG.from_document_path(fp)
-concord = Concord(mycpg, user_context)
+concord = Concord(mycpg, user_context, demand_driven=bool(args.demand_driven))
 logger.info(f'Initialized with with cpg: [bold]{mycpg.title}')
 logger.info(f'Publisher={mycpg.publisher}')
 logger.info(f'doi ={mycpg.publisher}')
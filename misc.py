@@ -10,41 +10,35 @@ SAMPLE_NDJSON_FILES = SAMPLE_FHIR_DATA_PATH + '/ndjson/'
 
 def sample_fhir_values():
 
+    from itertools import chain
     from fhir.fhirvalue import FHIRValue
+    from fhir.bulk import iter_ndjson
 
-    obs = read_ndjson(SAMPLE_NDJSON_FILES + 'Observation.ndjson')
-    conditions = read_ndjson(SAMPLE_NDJSON_FILES + 'Condition.ndjson')
-    medreq = read_ndjson(SAMPLE_NDJSON_FILES + 'MedicationRequest.ndjson')
-    procedures = read_ndjson(SAMPLE_NDJSON_FILES + 'Procedure.ndjson')
-
-    all = obs + conditions + medreq + procedures
+    resource_types = ['Observation', 'Condition', 'MedicationRequest', 'Procedure']
+    resources = chain.from_iterable(iter_ndjson(SAMPLE_NDJSON_FILES + f'{rt}.ndjson') for rt in resource_types)
     errs = [] 
     fhir_values = [] 
 
-    for jsn in all:
+    for jsn in resources:
         try: 
             v = FHIRValue.from_fhir(jsn)
-            fhir_values.append(v) 
+            if v:
+                fhir_values.append(v) 
         except Exception as e:
             errs.append(e) 
 
-    log.error(errs)
+    if errs:
+        log.error(errs)
     return fhir_values
 
 
 
 def read_ndjson(filepath):
-    # Reduce mem load, can use "YEILD"
-    
-    fhirresources = []
-    try:
-        with open (filepath, 'r') as file_:
-            for line in file_:
-                json_ = json.loads(line)
-                fhirresources.append(json_)
-        return fhirresources if len(fhirresources) > 0 else None
-    except Exception as e:
-        raise e
+    # streaming: `fhir.bulk.iter_ndjson`
+    from fhir.bulk import iter_ndjson
+
+    fhirresources = list(iter_ndjson(filepath))
+    return fhirresources if len(fhirresources) > 0 else None
 
 def readsample(fn):
     fn = f'{SAMPLE_FHIR_DATA_PATH}' + fn 
@@ -70,19 +64,22 @@ def sample_data():
 
 
 
-def sample_healthcontext(persona_text = 'patient'):
+def sample_healthcontext(persona_text = 'patient', as_of = None):
+    """Sample patient; its observations are dated `as_of` (now if not given) unless dated explicitly"""
 
     from core.healthcontext import HealthContext, Persona
     from variables.record import Record
-    from variables.value import Value
+    from variables import value
     from variables.var import Var
     from variables.age import Age
     from primitives.code import Code
     from ontology.codes import ConcordDefinition, CodeRaceEthnicity, CodeGender, Code_LabLoinc
     from datetime import datetime, timedelta
 
+    def Value(v, date=None):
+        return value.Value(v, date=date or as_of)
 
-    age     = Age(50)
+    age     = Age(50, date=as_of)
     gender  = ConcordDefinition.code_Gender.as_record(CodeGender.female_snomed.value)
     race    = ConcordDefinition.code_Ethnicity.as_record(CodeRaceEthnicity.White.value)
 
@@ -91,7 +88,7 @@ def sample_healthcontext(persona_text = 'patient'):
     bp    = Record(Var('BP', code=[Code.loinc('55284-4')]), [Value((130, 90))])
 
     ldl     = Record(Var('LDL', code=[Code.loinc('13457-7')]), [
-        Value(123, date=datetime.today() - timedelta(days=1200)),
+        Value(123, date=(as_of or datetime.today()) - timedelta(days=1200)),
         Value(122),
         Value(155),
         Value(122),
@@ -2,7 +2,7 @@
 
 from primitives.code import Code
 from ontology.definitions import CodeSystemType
-from variables.var import Var
+from variables.var import Var, VarType
 from variables.value import Value
 from variables.record import Record
 from enum import Enum
@@ -37,7 +37,7 @@ class ConcordDefinition(Enum):
         return Code(self.value, CodeSystemType.concord.value, self.value)
 
     def as_record(self, value_code: Code):
-        return Record(Var(self.value, self.value, code=[self.as_code()]), [Value(value_code)])
+        return Record(Var(self.value, self.value, code=[self.as_code()], category=VarType.demographics), [Value(value_code)])
 
 
 class Code_LabLoinc(Enum):
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+# Batch calling convention for CPG functions modules.
+#
+# A CPG function is called once per patient with `healthcontext` (id -> `Value` or None).
+# A module may also register a batch implementation of it, called once for many patients
+# with `healthcontext` (id -> numpy masked array of `Value.value`, masked where there is no value).
+# It returns an array of results, masked (or NaN) where the scalar function would fail.
+#
+#   def tenyearriskscore(healthcontext): ...
+#
+#   @batch_of(tenyearriskscore)
+#   def tenyearriskscore_batch(healthcontext): ...
+
+import numpy as np
+
+
+def batch_of(scalar):
+    """Registers the decorated function as the batch implementation of `scalar` (`scalar.batch`)"""
+    def register(batch):
+        scalar.batch = batch
+        batch.scalar = scalar
+        return batch
+    return register
+
+
+def batch_result(result, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Values and failed mask of a batch result"""
+    result = np.ma.asarray(result)
+    if result.shape != (n,):
+        raise ValueError(f'Batch result must have one value per patient, expected {n} got shape={result.shape}')
+    failed = np.ma.getmaskarray(result).copy()
+    data = np.ma.getdata(result)
+    if data.dtype.kind == 'f':
+        failed |= np.isnan(data)
+    return data, failed
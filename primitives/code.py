@@ -3,14 +3,60 @@
 from ontology.definitions import CodeSystemType
 from dataclasses import dataclass
 from functools import cached_property
+from threading import Lock
 
 
-@dataclass(frozen=True)
+# (system, code) -> dense integer id, process wide
+_code_ids: dict[tuple[str, str], int] = {}
+# (system, code) -> shared Code instance
+_interned: dict[tuple[str, str], 'Code'] = {}
+_lock = Lock()
+
+
+@dataclass(frozen=True, eq=False)
 class Code:
+    """Coded concept; equality and hashing ignore `display`.
+
+    `Code.interned(...)` returns one shared instance per (system, code) for high volume ingest.
+    Every Code, interned or not, has a dense integer `code_id` that is used for equality and hashing.
+    """
 
     code: str
     system: str 
     display: str = None
+
+    @classmethod
+    def interned(cls, code: str, system: str, display: str = None) -> 'Code':
+        """Shared instance for (system, code); the display of the first instance is kept"""
+        key = (system, code)
+        instance = _interned.get(key)
+        if instance is None:
+            with _lock:
+                instance = _interned.setdefault(key, cls(code, system, display))
+        return instance
+
+    @staticmethod
+    def id_for(system: str, code: str) -> int:
+        key = (system, code)
+        code_id = _code_ids.get(key)
+        if code_id is None:
+            with _lock:
+                code_id = _code_ids.setdefault(key, len(_code_ids))
+        return code_id
+
+    @cached_property
+    def code_id(self) -> int:
+        """Dense integer id of (system, code), only valid within this process"""
+        return Code.id_for(self.system, self.code)
+
+    def __hash__(self) -> int:
+        return self.code_id
+
+    def __reduce__(self):
+        # ids are per process: never pickle `code_id`, re-intern shared instances on load
+        if _interned.get((self.system, self.code)) is self:
+            return (Code.interned, (self.code, self.system, self.display))
+        return (Code, (self.code, self.system, self.display))
     
     def __str__(self) -> str:
         return self.display or self.as_string
@@ -34,7 +80,7 @@ class Code:
     def __eq__(self, __o: object) -> bool:
         # if type(self) == type(right):
         if isinstance(__o, Code):
-            return  self.as_string == __o.as_string
+            return self is __o or self.code_id == __o.code_id
         else:
             return super().__eq__(__o)
     
@@ -19,6 +19,14 @@ class ExpressionVariableNotFound(ExpressionError):
 
 
 
+class DependencyCycleError(Exception):
+    def __init__(self, cycle):
+        message = 'Circular dependency: ' + ' -> '.join(cycle)
+        super(DependencyCycleError, self).__init__(message)
+        self.cycle = cycle
+
+
+
 class VarError(Exception):
 
     def __init__(self, message, variable_id):
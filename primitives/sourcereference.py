@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Compact `Value.source` for values read from FHIR resources: the resource is not kept in memory,
+# only where to find it again.
+
+import gzip, json
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class SourceReference:
+    """A FHIR resource by type and id and, when it was read from an NDJSON file,
+    the byte range of its line in the (decompressed) file. `resolve` reads it back on demand.
+    """
+
+    resource_type: str
+    id: str
+    path: str = None
+    offset: int = None
+    length: int = None
+
+    @classmethod
+    def of(cls, resource: dict, path: str = None, offset: int = None, length: int = None) -> 'SourceReference':
+        return cls(resource.get('resourceType'), resource.get('id'), path, offset, length)
+
+    @property
+    def reference(self) -> str:
+        """`Type/id`, as in a FHIR Reference"""
+        return f'{self.resource_type}/{self.id}'
+
+    @property
+    def resolvable(self) -> bool:
+        return self.path is not None and self.offset is not None
+
+    def resolve(self) -> dict:
+        """The resource's JSON, read back from its file"""
+        if not self.resolvable:
+            raise ValueError(f'SourceReference: {self.reference} was not read from a file')
+        with open(self.path, 'rb') as file_:
+            if file_.peek(2)[:2] == b'\x1f\x8b':
+                # gzip streams cannot seek directly, this decompresses up to `offset`
+                file_ = gzip.GzipFile(fileobj=file_)
+            file_.seek(self.offset)
+            return json.loads(file_.read(self.length))
+
+    def model(self):
+        """The resource as a fhirclient model"""
+        from fhirclient.models.fhirelementfactory import FHIRElementFactory
+        return FHIRElementFactory.instantiate(self.resource_type, self.resolve())
+
+    def __str__(self) -> str:
+        return self.reference
@@ -2,7 +2,15 @@
 #!/usr/bin/env python3
 
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime
+
+
+def local_naive(dt: date | datetime) -> datetime:
+    """`dt` as a naive local datetime, comparable with `datetime.today()` and naive `as_of` dates"""
+    if not isinstance(dt, datetime):
+        return datetime(dt.year, dt.month, dt.day)
+    return dt.astimezone().replace(tzinfo=None) if dt.tzinfo else dt
+
 
 @dataclass(frozen=True)
 class ValueDate:
@@ -17,4 +25,8 @@ class ValueDate:
     def __lt__(self, other) -> bool:
         return self.dt < other.dt
     def __gt__(self, other) -> bool:
-        return self.dt > other.dt
\ No newline at end of file
+        return self.dt > other.dt
+    def __le__(self, other) -> bool:
+        return self.dt <= other.dt
+    def __ge__(self, other) -> bool:
+        return self.dt >= other.dt
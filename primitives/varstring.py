@@ -4,8 +4,9 @@ from enum import StrEnum, auto
 import logging
 
 from dataclasses import dataclass, field
-from functools import cached_property
+from functools import cache, cached_property
 from re import findall
+from typing import Any
 
 l = logging.getLogger(__name__)
 
@@ -58,37 +59,66 @@ class ExpressionVariable(StrEnum):
 
 
 
-from simpleeval import simple_eval
+import simpleeval
+
+
+@dataclass(frozen=True)
+class CompiledExpression:
+    """Expression parsed once into a `simpleeval` node tree.
+
+    Evaluation is a single call against a name mapping, with the same
+    operators, functions and limits as `simpleeval.simple_eval`.
+    """
+
+    string: VarString
+    source: str
+    node: Any
+
+    @classmethod
+    def compile(cls, string: str):
+        return _compile_expression(string)
+
+    @property
+    def variable_identifiers(self):
+        return self.string.variable_identifiers
+
+    @property
+    def tags(self):
+        return self.string.tags
+
+    def evaluate(self, names: dict = None):
+        # default operator/function tables are read-only during evaluation, no need for per-call copies
+        evaluator = simpleeval.SimpleEval(operators=simpleeval.DEFAULT_OPERATORS, functions=simpleeval.DEFAULT_FUNCTIONS, names=names)
+        return evaluator.eval(self.source, previously_parsed=self.node)
+
+
+@cache
+def _compile_expression(string: str) -> CompiledExpression:
+    var_string = VarString(string)
+    source = var_string.replace('$', '')
+    return CompiledExpression(var_string, source, simpleeval.SimpleEval.parse(source))
+
+
 class EvaluatorString:
+    """Expression over `$variables`, evaluated with their values; keeps no state, so one instance
+    (eg. the validators of a `Var`) is shared by every record and thread"""
 
     def __init__(self, string: str):
 
-        self.string = VarString(string)
-        self.__result = None
-        self.__functions = None # Pass on functions? {'count': len} ??
-        self.__value_dict = None
+        self.compiled = CompiledExpression.compile(string)
+        self.string = self.compiled.string
         if self.variables == None:
             raise ValueError('EvaluatorString must contain variable_identifiers, none found')
 
-    @property
-    def result(self):
-        return self.__result
-    
     @property
     def variables(self):
         return self.string.variable_identifiers
     
     def __repr__(self) -> str:
-        return f'<Expression({self.string}) result={self.result}>'
+        return f'<Expression({self.string})>'
 
     def evaluate(self, values: dict = None):
-        try:
-            self.__value_dict = values
-            expstr = self.string.replace('$', '')
-            self.__result = simple_eval(expstr, names=values)
-            return self.result
-        except Exception as e:
-            raise e
+        return self.compiled.evaluate(values)
         
             
 
@@ -105,7 +135,7 @@ class ValidationExpression(EvaluatorString):
     def evaluate(self, value):
         res = super().evaluate({'value': value})
         if not isinstance(res, bool):
-            raise TypeError(f'ValidatorExpression error: must evaluate to type `bool`, is={type(self.result)}')
+            raise TypeError(f'ValidatorExpression error: must evaluate to type `bool`, is={type(res)}')
         return res
 
 
@@ -123,20 +153,17 @@ if __name__ == '__main__':
 
     test = EvaluatorString('1 == $value')
     assert test.variables == ['value']
-    assert test.result == None
     assert test.evaluate({'value': 1}) == True
     print(test)
     print(test.string.variable_identifiers)
 
     test = EvaluatorString('2 + $value')
     assert test.variables == ['value']
-    assert test.result == None
     assert test.evaluate({'value': 1}) == 3
 
 
     test = ValidationExpression('2 == $value and $value == 1')
     assert test.variables == ['value']
-    assert test.result == None
     assert test.evaluate({'value': 1}) == False
 
     test = EvaluatorString('1 + $va')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+from array import array
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+
+from primitives.valuedate import ValueDate
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# kind of each element, values are stored as float64
+_FLOAT, _INT, _BOOL = 0, 1, 2
+
+
+def _micros(dt: datetime) -> int:
+    return (dt.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+
+
+class vcolumns(Sequence):
+    """Columnar alternative to `vlist` for long numeric histories of one variable.
+
+    Values are kept as parallel typed arrays, newest first like `vlist`:
+    timestamps as int64 microseconds since epoch, values as float64 and the kind (float/int/bool)
+    of each value; unit, code and timezone are shared by the column.
+    `Value` objects are only created when an element is accessed.
+    """
+
+    __slots__ = ('timestamps', 'numbers', 'kinds', 'unit', 'code', 'tzinfo', 'sources', 'value_class', '_materialized')
+
+    def __init__(self, timestamps: array, numbers: array, kinds: array, unit=None, code=None, tzinfo=None, sources: list = None, value_class=None):
+        self.timestamps = timestamps
+        self.numbers = numbers
+        self.kinds = kinds
+        self.unit = unit
+        self.code = code
+        self.tzinfo = tzinfo
+        self.sources = sources
+        self.value_class = value_class
+        self._materialized = {}
+
+    @classmethod
+    def from_values(cls, values) -> 'vcolumns':
+        """Columns for `values` (any order); None when they cannot be stored as columns:
+        non numeric values, dates without time, or different units, codes, timezones or `Value` classes."""
+
+        values = list(values)
+        if not values:
+            return None
+        first = values[0]
+        unit, code, tzinfo = first.unit, first.code, first.date.dt.tzinfo if isinstance(first.date.dt, datetime) else None
+        for v in values:
+            if type(v.value) not in (int, float, bool) or not isinstance(v.date.dt, datetime):
+                return None
+            if type(v) is not type(first) or v.unit != unit or v.code != code or v.date.dt.tzinfo != tzinfo:
+                return None
+
+        # same order as `vlist`: newest first, stable for equal dates
+        values.sort(key=lambda v: v.date.dt, reverse=True)
+        kinds = array('b', (_BOOL if type(v.value) is bool else _INT if type(v.value) is int else _FLOAT for v in values))
+        sources = [v.source for v in values] if any(v.source for v in values) else None
+        return cls(
+            array('q', (_micros(v.date.dt) for v in values)),
+            array('d', (float(v.value) for v in values)),
+            kinds, unit=unit, code=code, tzinfo=tzinfo, sources=sources, value_class=type(first))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def micros(self, dt: datetime) -> int:
+        """`dt` as stored in `timestamps`: wall clock of the column's timezone; naive `dt` is local time"""
+        if self.tzinfo:
+            dt = (dt if dt.tzinfo else dt.astimezone()).astimezone(self.tzinfo)
+        elif dt.tzinfo:
+            dt = dt.astimezone()
+        return _micros(dt)
+
+    def until(self, as_of: datetime) -> 'vcolumns':
+        """Values dated on or before `as_of`; the columns themselves when nothing is newer"""
+        cutoff = self.micros(as_of)
+        stamps = self.timestamps
+        lo, hi = 0, len(stamps)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if stamps[mid] > cutoff:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self if lo == 0 else self.take(range(lo, len(stamps)))
+
+    def take(self, indexes) -> 'vcolumns':
+        """New columns with the elements at `indexes` (in the order given)"""
+        indexes = list(indexes)
+        return vcolumns(
+            array('q', (self.timestamps[i] for i in indexes)),
+            array('d', (self.numbers[i] for i in indexes)),
+            array('b', (self.kinds[i] for i in indexes)),
+            unit=self.unit, code=self.code, tzinfo=self.tzinfo,
+            sources=[self.sources[i] for i in indexes] if self.sources else None,
+            value_class=self.value_class)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('vcolumns index out of range')
+        value = self._materialized.get(index)
+        if value is None:
+            from variables.value import Value
+            value = (self.value_class or Value)(self.number_at(index), unit=self.unit, code=self.code, date=self.datetime_at(index),
+                          source=self.sources[index] if self.sources else None)
+            self._materialized[index] = value
+        return value
+
+    def number_at(self, index: int):
+        """Value at `index` as its original type, without creating a `Value`"""
+        number, kind = self.numbers[index], self.kinds[index]
+        return bool(number) if kind == _BOOL else int(number) if kind == _INT else number
+
+    def datetime_at(self, index: int) -> datetime:
+        dt = _EPOCH + timedelta(microseconds=self.timestamps[index])
+        return dt.replace(tzinfo=self.tzinfo) if self.tzinfo else dt
+
+    def date_at(self, index: int) -> ValueDate:
+        """Date of the value at `index`, without creating a `Value`"""
+        return ValueDate(self.datetime_at(index))
+
+    def __str__(self) -> str:
+        return self.representation
+
+    @property
+    def representation(self) -> str:
+        return ', '.join(str(self.number_at(i)) for i in range(len(self)))
+
+    def __getstate__(self):
+        return {s: getattr(self, s) for s in self.__slots__ if s != '_materialized'}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+        self._materialized = {}
+
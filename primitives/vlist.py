@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 
+from collections.abc import Sequence
+
+from primitives.valuedate import local_naive
+
+
+def _date_key(v):
+    return v.date.dt
+
 
 class vlist(list):
+    """List of `Value`, newest first.
+
+    Sorted on construction unless the values are `presorted` (or already a vlist).
+    """
 
-    def __init__(self, iterable):
-        super().__init__(sorted(iterable, key=lambda v:v.date, reverse=True))
+    def __init__(self, iterable=(), presorted: bool = False):
+        if presorted or isinstance(iterable, vlist):
+            super().__init__(iterable)
+        else:
+            super().__init__(sorted(iterable, key=_date_key, reverse=True))
 
     def __str__(self) -> str:
         return self.representation
@@ -12,5 +27,75 @@ class vlist(list):
     @property
     def representation(self) -> str:
         if self == None:
-            return None             
-        return ', '.join([str(v.value) for v in self])
\ No newline at end of file
+            return None
+        return ', '.join([str(v.value) for v in self])
+
+    def insort(self, value):
+        """Inserts `value` keeping the list newest first; after values of the same date, like a stable sort"""
+        dt = value.date.dt
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid].date.dt < dt:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.insert(lo, value)
+
+    def until(self, as_of) -> 'vlist | vview':
+        """Values dated on or before `as_of` (naive local datetime); a view, or the list itself when nothing is newer"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if local_naive(self[mid].date.dt) > as_of:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self if lo == 0 else self.view(lo)
+
+    def view(self, start: int = None, stop: int = None) -> 'vview':
+        """Read-only window on this list that shares its storage"""
+        return vview(self, *slice(start, stop).indices(len(self))[:2])
+
+
+class vview(Sequence):
+    """Window `[start:stop]` of a `vlist` without copying; reflects the list at the time of access"""
+
+    __slots__ = ('base', 'start', 'stop')
+
+    def __init__(self, base: vlist, start: int, stop: int):
+        self.base = base
+        self.start = start
+        self.stop = max(start, stop)
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return vview(self.base, self.start + start, self.start + stop)
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('vview index out of range')
+        return self.base[self.start + index]
+
+    def __iter__(self):
+        base = self.base
+        for i in range(self.start, self.stop):
+            yield base[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, vview)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __str__(self) -> str:
+        return self.representation
+
+    @property
+    def representation(self) -> str:
+        return ', '.join([str(v.value) for v in self])
@@ -18,6 +18,16 @@ log = logging.getLogger(__name__)
 # concord: parsed guidance
 # base_template: any base tempalte this should be applied to -- must be jinja2
 
+def resolved_source(source):
+    """Template filter: the resource of a `SourceReference`, read only when a template asks for it"""
+    if getattr(source, 'resolvable', False):
+        try:
+            return source.resolve()
+        except Exception as e:
+            log.warning(f'Cannot resolve source={source}: {e}')
+    return source
+
+
 class RenderingModal(Enum):
     PHONE       = auto()
     EHR         = auto()
@@ -76,6 +86,7 @@ class BaseRenderer(RenderingProtocol):
         log.info(f'folderpath={self.rendering_folder_path()}')
         template_loader = jinja2.FileSystemLoader(searchpath=self.rendering_folder_path())
         self.template_env = jinja2.Environment(loader=template_loader, extensions=['jinja_markdown.MarkdownExtension'])
+        self.template_env.filters['resolved'] = resolved_source
 
 
     # Record -------------------------------------------------------------
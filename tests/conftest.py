@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import random
+from dataclasses import replace
+
+import pytest
+
+import misc
+from variables.record import Record
+from variables.value import Value
+
+
+def variants(n: int, seed: int = 0):
+    """`n` health contexts varied from the sample patients (both personas): records left out,
+    numbers scaled and booleans flipped, so that some are ineligible, insufficient or failing"""
+    rnd = random.Random(seed)
+    samples = {persona: misc.sample_healthcontext(persona) for persona in ('patient', 'provider')}
+    for i in range(n):
+        hc = samples['patient' if i % 2 else 'provider']
+        records = []
+        for r in hc.records:
+            if rnd.random() >= 0.8:
+                continue
+            values = r.values
+            if values and all(type(v.value) in (int, float) for v in values) and rnd.random() < 0.5:
+                values = [Value(type(v.value)(v.value * rnd.uniform(0.3, 1.7)), date=v.date.dt, unit=v.unit, code=v.code) for v in values]
+            elif values and all(type(v.value) is bool for v in values) and rnd.random() < 0.5:
+                values = [Value(not v.value, date=v.date.dt, code=v.code) for v in values]
+            records.append(r if values is r.values else Record(r.var, values))
+        yield replace(hc, records=records, identifier=f'p{i}')
+
+
+@pytest.fixture(scope='session')
+def patients():
+    """Factory of varied sample patients, `patients(n, seed)`"""
+    return lambda n, seed=0: list(variants(n, seed))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+from datetime import date, datetime, timedelta
+
+import pytest
+from fhirclient.models import patient
+
+import misc
+from core.concord import Concord
+from core.cpg import CPG
+from core.eligibility import EligibilityEvaluator
+from core.engine import ConcordEngine
+from fhir.fhirpatient import FHIRPatient
+from variables.record import Record
+from variables.value import Value
+from variables.var import Var
+
+PAST = datetime(2023, 3, 1, 12)
+
+
+@pytest.fixture(scope='module')
+def cpg():
+    return CPG.from_document_path('cpgs/cholesterol.yaml')
+
+
+def evaluated(concord: Concord):
+    concord.eligibility()
+    concord.sufficiency()
+    concord.assess(require_attestation=False)
+    concord.recommendations(raise_errors=False)
+    return ([(ev.id, str(ev.record.value.value) if ev.record.value else None) for ev in concord.assessment_result.context.evaluation_list],
+            [(er.recommendation.id, er.applies, er.compliant) for er in concord.recommendation_result.recommendations])
+
+
+def test_demographics_kept_on_backdated_run(cpg):
+    # the sample's demographics are dated now, the evaluation a month earlier
+    concord = Concord(cpg, misc.sample_healthcontext('provider'), as_of=datetime.now() - timedelta(days=30))
+    assert concord.eligibility().is_eligible
+    records = {ev.id: ev.record for ev in concord.sufficiency().context.evaluation_list}
+    for var_id in ('Age', 'Gender', 'Ethnicity'):
+        assert records[var_id].has_value, var_id
+    assert records['HDL'].value is None
+
+
+def test_backdated_sample_evaluates_as_current(cpg):
+    current = evaluated(Concord(cpg, misc.sample_healthcontext('provider')))
+    backdated = evaluated(Concord(cpg, misc.sample_healthcontext('provider', as_of=PAST), as_of=PAST))
+    assert backdated == current
+    engine = ConcordEngine(cpg).evaluate(misc.sample_healthcontext('provider', as_of=PAST), as_of=PAST)
+    assert engine.is_eligible and engine.is_executable
+    assert [(er.recommendation.id, er.applies, er.compliant) for er in engine.recommendations.recommendations] == backdated[1]
+
+
+def test_eligibility_leaves_out_later_values():
+    record = Record(Var('LDL'), [Value(190, date=PAST - timedelta(days=10)), Value(120, date=PAST + timedelta(days=10))])
+    until = EligibilityEvaluator.until(record, PAST)
+    assert [v.value for v in until.values] == [190]
+    assert EligibilityEvaluator.until(record, PAST + timedelta(days=30)) is record
+
+
+def test_fhir_demographics_dated():
+    pt = FHIRPatient(patient.Patient({'resourceType': 'Patient', 'birthDate': '1970-05-02', 'gender': 'female'}))
+    age = pt.age_as_of(date(2020, 1, 1))
+    assert age.value.value == 49
+    assert age.value.date.dt == datetime(2020, 1, 1)
+    assert pt.gender.value.date.dt == datetime(1970, 5, 2)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import asyncio
+from datetime import date
+
+import pytest
+
+import misc
+from core.concord import Concord
+from core.cpg import CPG
+from inputsession.asyncinput import AsyncSession, MemoryFrontend, coerce
+from primitives.types import ValueType
+
+DATE_VARIABLE = 'time_since_quit_smoking'
+
+
+@pytest.fixture(scope='module')
+def cpg():
+    return CPG.from_document_path('cpgs/screeninglungcancer.yaml')
+
+
+@pytest.fixture
+def concord(cpg):
+    concord = Concord(cpg, misc.sample_healthcontext('patient'))
+    concord.eligibility()
+    concord.sufficiency()
+    return concord
+
+
+def answers(questions, **given):
+    """An answer to every question: `given` ones, otherwise 'yes', or a date for date variables"""
+    default = {ValueType.date: '2015-01-31'}
+    return {q.id: given.get(q.id, default.get(q.value_type, 'yes')) for q in questions}
+
+
+def test_coerce():
+    assert coerce(' yes ', ValueType.boolean) is True
+    assert coerce('0', ValueType.boolean) is False
+    assert coerce('42', ValueType.integer) == 42
+    assert coerce('1.5', ValueType.decimal) == 1.5
+    assert coerce('2020-01-31', ValueType.date) == date(2020, 1, 31)
+    assert coerce(7, ValueType.date) == 7
+    with pytest.raises(ValueError):
+        coerce('not a date', ValueType.date)
+
+
+def test_rejected_answer_asked_again(concord):
+    pending = {ev.record.id for ev in concord.sufficiency_result.attestation_variables}
+    assert DATE_VARIABLE in pending
+
+    async def run():
+        frontend = MemoryFrontend()
+        session = AsyncSession(concord, frontend, 'session-1')
+        task = asyncio.create_task(session.run())
+
+        assert await frontend.asked.get() == 'session-1'
+        first = frontend.questions('session-1')
+        assert {q.id for q in first} == pending
+        assert all(q.error is None for q in first)
+        frontend.answer('session-1', answers(first, **{DATE_VARIABLE: 'not a date'}))
+
+        # only the rejected answer is asked again, with the reason
+        assert await frontend.asked.get() == 'session-1'
+        second = frontend.questions('session-1')
+        assert [q.id for q in second] == [DATE_VARIABLE]
+        assert second[0].error
+        frontend.answer('session-1', answers(second))
+
+        assert await task is True
+        assert frontend.waiting == []
+
+    asyncio.run(run())
+    # every attestation is in, the CPG is assessed without asking
+    concord.assess()
+    assert concord.recommendations(raise_errors=False).recommendations
+
+
+def test_gives_up_after_max_rounds(concord):
+    async def run():
+        frontend = MemoryFrontend()
+        session = AsyncSession(concord, frontend, 'session-2', max_rounds=2)
+        task = asyncio.create_task(session.run())
+        for _ in range(2):
+            await frontend.asked.get()
+            frontend.answer('session-2', answers(frontend.questions('session-2'), **{DATE_VARIABLE: 'not a date'}))
+        return await task
+
+    assert asyncio.run(run()) is False
+
+
+def test_timeout(concord):
+    async def run():
+        frontend = MemoryFrontend()
+        result = await AsyncSession(concord, frontend, 'session-3', timeout=0.01).run()
+        return result, frontend.waiting, frontend.asked.qsize()
+
+    # asked once, never answered: the session is no longer waiting
+    assert asyncio.run(run()) == (False, [], 1)
+
+
+def test_sessions_wait_independently(cpg):
+    concords = {}
+    for i in range(50):
+        concord = concords[f's{i}'] = Concord(cpg, misc.sample_healthcontext('patient'))
+        concord.eligibility()
+        concord.sufficiency()
+
+    async def run():
+        frontend = MemoryFrontend()
+        tasks = {sid: asyncio.create_task(AsyncSession(c, frontend, sid).run()) for sid, c in concords.items()}
+        for _ in concords:
+            await frontend.asked.get()
+        assert sorted(frontend.waiting) == sorted(concords)
+        # answered in reverse order
+        for sid in reversed(list(concords)):
+            frontend.answer(sid, answers(frontend.questions(sid)))
+        return {sid: await task for sid, task in tasks.items()}
+
+    assert set(asyncio.run(run()).values()) == {True}
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import math
+import random
+
+import numpy as np
+import pytest
+
+from core.cpg import CPG
+from primitives.code import Code
+from variables.value import Value
+
+MALE, FEMALE = Code('248153007', 'http://snomed.info/sct'), Code('248152002', 'http://snomed.info/sct')
+NUMERIC = {'Race_Is_Black_AfricanAmerican', 'is_smoker', 'med_for_htn', 'diabetesMellitus', 'Age', 'Chol', 'HDL'}
+
+
+@pytest.fixture(scope='module')
+def functions_module():
+    return CPG.from_document_path('cpgs/cholesterol.yaml').functions_module
+
+
+def patients(n: int, seed: int = 1) -> list[dict]:
+    # includes values the scalar function rejects: ages out of range, zero cholesterol, missing values
+    rng = random.Random(seed)
+    return [{
+        'Gender': rng.choice([MALE, FEMALE]),
+        'Race_Is_Black_AfricanAmerican': rng.choice([True, False]),
+        'is_smoker': rng.choice([True, False]),
+        'med_for_htn': rng.choice([True, False, None]),
+        'diabetesMellitus': rng.choice([True, False]),
+        'Age': rng.choice([rng.randint(30, 85), rng.uniform(39, 80)]),
+        'bloodpressure': (rng.randint(90, 200), 80),
+        'Chol': rng.choice([rng.randint(100, 400), 0, rng.uniform(100, 300)]),
+        'HDL': rng.randint(20, 100),
+    } for _ in range(n)]
+
+
+def columns(rows: list[dict]) -> dict:
+    """Batch `healthcontext`: id -> masked array of values, masked where missing"""
+    cols = {}
+    for key in rows[0]:
+        values = [r[key] for r in rows]
+        mask = np.array([v is None for v in values])
+        if key in NUMERIC:
+            data = np.array([0.0 if v is None else float(v) for v in values])
+        else:
+            data = np.empty(len(values), dtype=object)
+            data[:] = values
+        cols[key] = np.ma.masked_array(data, mask=mask)
+    return cols
+
+
+@pytest.mark.parametrize('name', ['tenyearriskscore', 'optimal_tenyearriskscore'])
+def test_batch_same_as_scalar(functions_module, name):
+    scalar = getattr(functions_module, name)
+    rows = patients(3000)
+    result = scalar.batch(columns(rows))
+    failed = np.ma.getmaskarray(result) | np.isnan(np.ma.getdata(result))
+    evaluated = 0
+    for i, row in enumerate(rows):
+        try:
+            expected = scalar({k: Value(v) if v is not None else None for k, v in row.items()})
+        except Exception:
+            expected = None
+        if expected is None:
+            assert failed[i], row
+        else:
+            assert not failed[i], row
+            assert math.isclose(float(np.ma.getdata(result)[i]), expected, rel_tol=1e-12), row
+            evaluated += 1
+    assert 0 < evaluated < len(rows)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+from core.cpg import CPG
+from fhir.bulk import BulkIngest, MANIFEST, NDJSONExport, healthcontext_of, iter_ndjson
+from primitives.code import Code
+from variables.var import Var
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+PATIENT = '6c5d9ca9-54d7-42f5-bfae-a7c19cd217f2'
+
+
+@pytest.fixture(scope='module')
+def variables():
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    return cpg.variables
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    """The sample export with 12 patients, each keeping a random part of the sample patient's resources; some files gzipped"""
+    directory = tmp_path_factory.mktemp('export')
+    rnd = random.Random(0)
+    patients = [PATIENT[:-2] + f'{i:02d}' for i in range(12)]
+    for fn in sorted(os.listdir(SAMPLE_EXPORT)):
+        if not fn.endswith('.ndjson'):
+            continue
+        with open(os.path.join(SAMPLE_EXPORT, fn)) as f:
+            lines = [line for line in f if line.strip()]
+        out = [line.replace(PATIENT, p) for p in patients for line in lines if fn == 'Patient.ndjson' or rnd.random() < 0.7]
+        opener = gzip.open if fn in ('Observation.ndjson', 'Condition.ndjson') else open
+        with opener(directory / (fn + '.gz' if opener is gzip.open else fn), 'wt') as f:
+            f.writelines(out)
+    return directory
+
+
+def contents(hc):
+    return [(r.id, [(v.value, v.date, v.code) for v in r.values or []]) for r in hc.records]
+
+
+def ingest(directory, variables, **options):
+    return {hc.identifier: contents(hc) for hc in BulkIngest(str(directory), variables, **options).healthcontexts()}
+
+
+def test_partitions_give_same_patients(export, variables, tmp_path):
+    whole = ingest(export, variables)
+    assert sorted(whole) == sorted(PATIENT[:-2] + f'{i:02d}' for i in range(12))
+    assert all(any(values for _, values in records) for records in whole.values())
+
+    # small partitions: patients are spread over several spill files by crc32 of their key
+    spilled = []
+    small = BulkIngest(str(export), variables, partition_size=20_000, spill_directory=str(tmp_path))
+    partitioned = {}
+    for hc in small.healthcontexts():
+        spill, = os.listdir(tmp_path)
+        spilled.append(len(os.listdir(tmp_path / spill)))
+        partitioned[hc.identifier] = contents(hc)
+    assert max(spilled) > 1
+    assert partitioned == whole
+    # partitions are removed once read, and the spill directory at the end
+    assert os.listdir(tmp_path) == []
+
+    assert ingest(export, variables, use_prefilter=False) == whole
+    assert ingest(export, variables, references=False) == whole
+
+
+def test_manifest_resolution(export, tmp_path):
+    directory = tmp_path / 'export'
+    shutil.copytree(export, directory)
+    assert NDJSONExport(str(directory)).manifest() is None
+    by_listing = NDJSONExport(str(directory)).files()
+
+    shutil.copy(os.path.join(SAMPLE_EXPORT, MANIFEST), directory / MANIFEST)
+    os.remove(directory / 'CarePlan.ndjson')
+    by_manifest = NDJSONExport(str(directory)).files()
+    # in manifest order, gzipped files found by name, missing files left out
+    manifest = json.loads((directory / MANIFEST).read_text())
+    assert [t for t, _ in by_manifest] == [o['type'] for o in manifest['output'] if o['type'] != 'CarePlan']
+    assert dict(by_manifest)['Observation'] == str(directory / 'Observation.ndjson.gz')
+    assert sorted(by_manifest) == sorted((t, p) for t, p in by_listing if t != 'CarePlan')
+    assert NDJSONExport(str(directory)).files(['Patient', 'Condition']) == [
+        ('Patient', str(directory / 'Patient.ndjson')), ('Condition', str(directory / 'Condition.ndjson.gz'))]
+    assert sum(1 for _ in NDJSONExport(str(directory)).resources(['Condition'])) == sum(1 for _ in iter_ndjson(str(directory / 'Condition.ndjson.gz')))
+
+
+def test_medication_request():
+    medication = Var('acetaminophen', code=[Code.rxnorm('313782')], required=False)
+    resources = list(iter_ndjson(os.path.join(SAMPLE_EXPORT, 'MedicationRequest.ndjson')))
+    by_reference = dict(resources[0], id='by-reference', medicationReference={'reference': 'Medication/1'})
+    del by_reference['medicationCodeableConcept']
+    # one requested with a coded medication, one referring to a Medication resource, which is not converted
+    for strict in (False, True):
+        hc = healthcontext_of(PATIENT, [by_reference] + resources, [medication], strict=strict)
+        record, = hc.records
+        assert [(v.value, v.date.dt.date().isoformat(), v.code) for v in record.values] == [(True, '2017-11-25', [Code.rxnorm('313782')])]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import filecmp
+import hashlib
+import os
+
+import pytest
+
+from fhir.bulk import MANIFEST
+from fhir.bulkclient import BulkDataClient, BulkDataError, PART_SUFFIX, SOURCE_SUFFIX
+from fhir.mockserver import MockBulkServer
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+TYPES = ['Patient', 'Observation']
+
+
+def client(server, **kwargs):
+    return BulkDataClient(server.url, poll_interval=0.01, chunk_size=1024, **kwargs)
+
+
+def downloads(server, name):
+    """Headers of the requests of the file `name`"""
+    return [headers for method, path, headers in server.requests if path.endswith(f'/download/{name}')]
+
+
+def assert_same_files(directory, types=TYPES):
+    for resource_type in types:
+        name = f'{resource_type}.ndjson'
+        assert filecmp.cmp(os.path.join(SAMPLE_EXPORT, name), os.path.join(directory, name), shallow=False)
+    assert not [fn for fn in os.listdir(directory) if fn.endswith(PART_SUFFIX)]
+
+
+def test_export(tmp_path):
+    with MockBulkServer(SAMPLE_EXPORT, pending_polls=2) as server:
+        directory = client(server).export(str(tmp_path / 'export'), resource_types=TYPES)
+    assert_same_files(directory)
+    assert os.path.exists(os.path.join(directory, MANIFEST))
+    assert not os.path.exists(os.path.join(directory, 'Encounter.ndjson'))
+
+
+def test_resumes_interrupted_download(tmp_path):
+    with MockBulkServer(SAMPLE_EXPORT, interrupt_after=5000) as server:
+        directory = client(server).export(str(tmp_path / 'export'), resource_types=['Observation'])
+    assert_same_files(directory, ['Observation'])
+    first, resumed = downloads(server, 'Observation.ndjson')
+    assert 'Range' not in first
+    # from what the part holds, the whole chunks received before the break
+    assert 0 < int(resumed['Range'].removeprefix('bytes=').rstrip('-')) <= 5000
+
+
+def test_retries_unavailable(tmp_path):
+    with MockBulkServer(SAMPLE_EXPORT, unavailable=2) as server:
+        directory = client(server).export(str(tmp_path / 'export'), resource_types=TYPES)
+    assert_same_files(directory)
+    assert len(downloads(server, 'Patient.ndjson')) == 3
+
+
+def test_restarts_on_misaligned_range(tmp_path):
+    # asked from byte 4096, the server answers from byte 3000: the part is not appended to
+    with MockBulkServer(SAMPLE_EXPORT, interrupt_after=5000, range_block=3000) as server:
+        directory = client(server).export(str(tmp_path / 'export'), resource_types=['Observation'])
+    assert_same_files(directory, ['Observation'])
+    requests = downloads(server, 'Observation.ndjson')
+    assert [h.get('Range') for h in requests] == [None, 'bytes=4096-', None]
+
+
+def test_earlier_export_is_replaced(tmp_path):
+    directory = str(tmp_path / 'export')
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        client(server).export(directory, resource_types=TYPES)
+        # same names, different urls: the files of the earlier export are not kept
+        with open(os.path.join(directory, 'Patient.ndjson'), 'w') as f:
+            f.write('{"resourceType": "Patient", "id": "stale"}\n')
+        os.remove(os.path.join(directory, 'Observation.ndjson' + SOURCE_SUFFIX))
+        before = len(server.requests)
+        client(server).export(directory, resource_types=TYPES)
+    assert_same_files(directory)
+    names = [path.rsplit('/', 1)[-1] for method, path, headers in server.requests[before:] if '/download/' in path]
+    assert sorted(names) == ['Observation.ndjson', 'Patient.ndjson']
+
+
+def test_same_export_is_kept(tmp_path):
+    directory = str(tmp_path / 'export')
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        bulk = client(server)
+        manifest = bulk.wait(bulk.kick_off(TYPES))
+        bulk.download(manifest, directory)
+        before = len(server.requests)
+        bulk.download(manifest, directory)
+        assert len(server.requests) == before
+    assert_same_files(directory)
+
+
+def test_part_of_other_export_is_not_resumed(tmp_path):
+    directory = tmp_path / 'export'
+    directory.mkdir()
+    leftover = directory / ('Patient.ndjson.' + '0' * 16 + PART_SUFFIX)
+    leftover.write_text('{"resourceType": "Patient", "id": "stale"}\n')
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        client(server).export(str(directory), resource_types=TYPES)
+    assert not leftover.exists()
+    assert_same_files(str(directory))
+    assert all('Range' not in h for h in downloads(server, 'Patient.ndjson'))
+
+
+def test_complete_part_is_not_downloaded_again(tmp_path):
+    directory = str(tmp_path / 'export')
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        bulk = client(server)
+        manifest = bulk.wait(bulk.kick_off(['Patient']))
+        url = manifest['output'][0]['url']
+        path = os.path.join(directory, 'Patient.ndjson')
+        bulk.download(manifest, directory)
+        # as left by a run stopped before the part was renamed
+        os.remove(path + SOURCE_SUFFIX)
+        os.rename(path, f'{path}.{hashlib.sha256(url.encode()).hexdigest()[:16]}{PART_SUFFIX}')
+        bulk.download(manifest, directory)
+    assert downloads(server, 'Patient.ndjson')[-1]['Range'] == f'bytes={os.path.getsize(path)}-'
+    assert_same_files(directory, ['Patient'])
+
+
+def test_missing_file_fails(tmp_path):
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        with pytest.raises(BulkDataError) as e:
+            client(server).download_file(f'{server.url}/jobs/none/download/Missing.ndjson', str(tmp_path / 'Missing.ndjson'))
+    assert e.value.status_code == 404
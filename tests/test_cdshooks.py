@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import asyncio
+import copy
+import json
+from urllib.parse import parse_qs
+
+import pytest
+
+from core.cpg import CPG
+from fhir.cdshooks import CDSHooksService, HOOK, PATIENT_ID_TOKEN, PATIENT_PREFETCH, SERVICES_PATH, prefetch_templates
+from fhir.mockserver import MockBulkServer
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+PATIENT = '6c5d9ca9-54d7-42f5-bfae-a7c19cd217f2'
+CPG_PATH = 'cpgs/screeninglungcancer.yaml'
+
+
+@pytest.fixture(scope='module')
+def fhir():
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        yield server
+
+
+@pytest.fixture(scope='module')
+def service_id():
+    return CPG.from_document_path(CPG_PATH).identifier
+
+
+def prefetch(fhir, templates):
+    """Prefetch as an EHR fills it, from the mock server"""
+    filled = {}
+    for key, template in templates.items():
+        query = template.replace(PATIENT_ID_TOKEN, PATIENT)
+        if '?' in query:
+            resource_type, params = query.split('?', 1)
+            filled[key] = fhir.bundle(resource_type, {**parse_qs(params), '_count': ['1000']})
+        else:
+            filled[key] = fhir.read(*query.split('/'))
+    return filled
+
+
+def calls(service_id, bodies, timeouts=None, max_pending=None):
+    """(status, body) of each call, one after the other, to a service started for them; `timeouts` of each call"""
+    async def run():
+        service = await CDSHooksService([CPG_PATH], port=0, max_workers=1, max_pending=max_pending).start()
+        try:
+            results = []
+            for body, timeout in zip(bodies, timeouts or [None] * len(bodies)):
+                service.timeout = timeout
+                results.append(await service.handle('POST', f'{SERVICES_PATH}/{service_id}', json.dumps(body).encode()))
+            return results
+        finally:
+            await service.stop()
+    return asyncio.run(run())
+
+
+def call(service_id, body):
+    return calls(service_id, [body])[0]
+
+
+def request(prefetch=None, fhir_server=None):
+    body = {'hook': HOOK, 'hookInstance': 'test', 'context': {'patientId': PATIENT, 'userId': 'Practitioner/1'}}
+    if prefetch is not None:
+        body['prefetch'] = prefetch
+    if fhir_server:
+        body['fhirServer'] = fhir_server
+    return body
+
+
+@pytest.fixture(scope='module')
+def templates():
+    return prefetch_templates(CPG.from_document_path(CPG_PATH))
+
+
+@pytest.fixture(scope='module')
+def expected(service_id, fhir, templates):
+    # cards of the CPG evaluated on the whole prefetch
+    status, body = call(service_id, request(prefetch(fhir, templates)))
+    assert status == 200
+    return sorted(c['summary'] for c in body['cards'])
+
+
+def summaries(body):
+    return sorted(c['summary'] for c in body['cards'])
+
+
+def test_cards_from_prefetch(expected):
+    assert expected
+
+
+def test_missing_prefetch_fetched_from_fhir_server(service_id, fhir, templates, expected):
+    filled = prefetch(fhir, templates)
+    filled = {k: (v if k == PATIENT_PREFETCH else None) for k, v in filled.items()}
+    status, body = call(service_id, request(filled, fhir.url))
+    assert status == 200 and summaries(body) == expected
+    status, body = call(service_id, request(fhir_server=fhir.url))
+    assert status == 200 and summaries(body) == expected
+
+
+@pytest.mark.parametrize('prefetched', ['none', 'null', 'partial'])
+def test_missing_prefetch_without_fhir_server(service_id, fhir, templates, prefetched):
+    filled = prefetch(fhir, templates)
+    body = {'none': None,
+            'null': {k: None for k in filled},
+            'partial': {k: (v if k == PATIENT_PREFETCH else None) for k, v in filled.items()}}[prefetched]
+    status, response = call(service_id, request(body))
+    assert status == 412
+    assert 'cards' not in response
+
+
+def test_invalid_patient_is_an_error(service_id, fhir, templates):
+    filled = prefetch(fhir, templates)
+    filled[PATIENT_PREFETCH] = dict(copy.deepcopy(filled[PATIENT_PREFETCH]), birthDate='not a date')
+    status, response = call(service_id, request(filled))
+    assert status == 500
+    assert 'cards' not in response
+
+
+def test_failing_fhir_server_is_an_error(service_id):
+    with MockBulkServer(SAMPLE_EXPORT, access_token='secret') as fhir:
+        status, response = call(service_id, request(fhir_server=fhir.url))
+    assert status == 502
+    assert 'cards' not in response
+
+
+def test_timeout(service_id, fhir, templates, expected):
+    filled = prefetch(fhir, templates)
+    # the slot of the call that ran out of time is given back, the next call is evaluated
+    (status, response), (next_status, next_response) = calls(
+        service_id, [request(filled), request(filled)], timeouts=[1e-6, None], max_pending=1)
+    assert status == 503
+    assert 'cards' not in response
+    assert next_status == 200 and summaries(next_response) == expected
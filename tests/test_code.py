@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import pickle
+import subprocess
+import sys
+import textwrap
+
+from core.cpg import CPG
+from primitives.code import Code
+
+
+def test_interned():
+    # interned codes are process wide: one no other test interns
+    a = Code.interned('interned-1', 'http://example.org/test', 'first')
+    b = Code.interned('interned-1', 'http://example.org/test', 'other display')
+    assert a is b and b.display == 'first'
+    assert Code.interned('interned-1', 'http://example.org/other') is not a
+    # a pickled interned code is the shared instance again
+    assert pickle.loads(pickle.dumps(a)) is a
+
+
+def test_equality_and_hash_by_id():
+    a, b = Code('x-1', 'http://example.org/test', 'one'), Code('x-1', 'http://example.org/test', 'two')
+    assert a is not b and a == b and hash(a) == hash(b) == a.code_id
+    assert a == Code.interned('x-1', 'http://example.org/test')
+    other = Code('x-2', 'http://example.org/test')
+    assert a != other and a.code_id != other.code_id
+    assert Code('x-1', 'http://example.org/other') != a
+    assert {a: 1}[b] == 1
+
+
+def test_var_equality_after_pickle_in_another_process(tmp_path):
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    a, b = cpg.variables[0], cpg.variables[1]
+    assert a == a and a != b
+    assert 'code_ids' in a.__dict__
+    path = tmp_path / 'vars.pkl'
+    path.write_bytes(pickle.dumps([a, b]))
+    assert 'code_ids' not in pickle.loads(path.read_bytes())[0].__dict__
+
+    # codes interned first in the other process get other ids
+    child = textwrap.dedent(f'''
+        import pickle
+        from primitives.code import Code
+        for i in range(500):
+            Code.interned(str(i), 'http://example.org').code_id
+        from core.cpg import CPG
+        a, b = pickle.loads(open({str(path)!r}, 'rb').read())
+        fresh = CPG.from_document_path('cpgs/cholesterol.yaml').variables[0]
+        assert a.code_ids == fresh.code_ids, (a.code_ids, fresh.code_ids)
+        assert a == fresh and fresh == a and b != fresh
+    ''')
+    result = subprocess.run([sys.executable, '-c', child], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
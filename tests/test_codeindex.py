@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+from core.cpg import CPG
+from primitives.code import Code
+from variables.codeindex import CodeIndex
+from variables.var import Var
+
+A, B, C, D = (Code.loinc(c) for c in ('1-1', '2-2', '3-3', '4-4'))
+
+
+def index():
+    # `b` shares A with `a` and C with `c`
+    return CodeIndex.for_variables([Var('a', code=[A]), Var('b', code=[C, A]), Var('c', code=[C, B]), Var('none')])
+
+
+def test_matches():
+    idx = index()
+    assert idx.matches([A]) == ('a', 'b')
+    assert idx.matches([B]) == ('c',)
+    assert idx.matches([D]) == ()
+    assert idx.matches([]) == () and idx.matches(None) == ()
+    # each variable once, in order of the first code it matches
+    assert idx.matches([C, A]) == ('b', 'c', 'a')
+    assert idx.matches([A, C, B]) == ('a', 'b', 'c')
+    # display is not part of the code
+    assert idx.matches([Code('1-1', A.system, 'a display')]) == ('a', 'b')
+
+
+def test_bucket_and_first():
+    idx = index()
+    items = [('x', [A]), ('y', [D]), ('z', [B, C]), ('w', [A])]
+    codes_of = lambda item: item[1]
+    assert idx.bucket(items, codes_of) == {
+        'a': [items[0], items[3]],
+        'b': [items[0], items[2], items[3]],
+        'c': [items[2]]}
+    assert idx.first(items, codes_of) == {'a': items[0], 'b': items[0], 'c': items[2]}
+    assert idx.bucket([], codes_of) == {} and idx.first([], codes_of) == {}
+
+
+def test_matches_like_var_equality():
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    variables = cpg.variables + cpg.eligibility_criterias
+    idx = CodeIndex.for_variables(variables)
+    for code in {c for v in variables for c in v.code or []}:
+        probe = Var('probe', code=[code])
+        assert set(idx.matches([code])) == {v.id for v in variables if v == probe}, code
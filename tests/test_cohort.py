@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from core.cohort import CohortRunner, PatientStatus, evaluate_patient
+from core.cpg import CPG
+
+CPG_PATH = 'cpgs/screeninglungcancer.yaml'
+
+
+@dataclass(frozen=True)
+class ListPartition:
+    """Patients loaded in the worker, after `delay` seconds"""
+
+    patients: tuple
+    delay: float = 0
+
+    def healthcontexts(self):
+        time.sleep(self.delay)
+        return list(self.patients)
+
+
+@pytest.fixture(scope='module')
+def cpg():
+    return CPG.from_document_path(CPG_PATH)
+
+
+@pytest.fixture(scope='module')
+def cohort(patients):
+    return patients(20)
+
+
+def expected(cpg, patients, **options):
+    return [evaluate_patient(cpg, hc, **options) for hc in patients]
+
+
+def test_in_process_same_as_evaluate_patient(cpg, cohort):
+    calls = []
+    runner = CohortRunner(CPG_PATH, max_workers=1, chunksize=6, progress=lambda done, submitted: calls.append((done, submitted)))
+    assert list(runner.run(iter(cohort))) == expected(cpg, cohort)
+    # one call per chunk, the last one short
+    assert calls == [(6, 6), (12, 12), (18, 18), (20, 20)]
+
+
+def test_partitions_count_as_one_item(cpg, cohort):
+    calls = []
+    items = [ListPartition(tuple(cohort[:5])), cohort[5], ListPartition(tuple(cohort[6:]))]
+    runner = CohortRunner(CPG_PATH, max_workers=1, chunksize=2, progress=lambda done, submitted: calls.append((done, submitted)))
+    assert list(runner.run(items)) == expected(cpg, cohort)
+    assert calls == [(2, 2), (3, 3)]
+
+
+def test_statuses(cpg, cohort):
+    results = list(CohortRunner(CPG_PATH, max_workers=1).run(cohort))
+    statuses = {r.status for r in results}
+    assert {PatientStatus.evaluated, PatientStatus.not_eligible, PatientStatus.failed} <= statuses
+    for r in results:
+        if r.status == PatientStatus.failed:
+            # eligibility could not be evaluated
+            assert r.error.startswith('ExceptionGroup: EligibilityEvaluationError') and r.eligible is None
+        elif r.status == PatientStatus.not_eligible:
+            assert r.eligible is False and not r.recommendations
+        else:
+            assert r.eligible and r.recommendations
+
+    attested = list(CohortRunner(CPG_PATH, max_workers=1, require_attestation=True).run(cohort))
+    assert attested == expected(cpg, cohort, require_attestation=True)
+    for r, a in zip(results, attested):
+        if r.status == PatientStatus.evaluated:
+            assert a.status == PatientStatus.needs_attestation and a.needs_attestation and not a.recommendations
+        else:
+            assert a == r
+
+
+def test_pool(cpg, cohort):
+    consumed = []
+
+    def lazy():
+        for hc in cohort:
+            consumed.append(hc.identifier)
+            yield hc
+
+    runner = CohortRunner(CPG_PATH, max_workers=2, chunksize=2, max_in_flight=3)
+    results = []
+    for result in runner.run(lazy()):
+        results.append(result)
+        # patients read: the chunk of this result and at most `max_in_flight` chunks in all
+        chunk = (len(results) - 1) // 2
+        assert len(consumed) <= (chunk + 3) * 2
+    assert results == expected(cpg, cohort)
+
+    # a slow first partition comes first in order, last otherwise
+    items = [ListPartition(tuple(cohort[:2]), delay=1.0), ListPartition(tuple(cohort[2:4])), ListPartition(tuple(cohort[4:6]))]
+    ordered = CohortRunner(CPG_PATH, max_workers=2, chunksize=1, ordered=True).run(items)
+    assert [r.identifier for r in ordered] == [hc.identifier for hc in cohort[:6]]
+    unordered = list(CohortRunner(CPG_PATH, max_workers=2, chunksize=1, ordered=False).run(items))
+    assert [r.identifier for r in unordered[-2:]] == [hc.identifier for hc in cohort[:2]]
+    assert sorted(unordered, key=lambda r: r.identifier) == sorted(expected(cpg, cohort[:6]), key=lambda r: r.identifier)
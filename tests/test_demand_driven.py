@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import pytest
+
+from core.engine import ConcordEngine
+from core.cpg import CPG
+from primitives.types import Persona
+
+
+@pytest.fixture(scope='module', params=['cpgs/cholesterol.yaml', 'cpgs/screeninglungcancer.yaml'])
+def cpg(request):
+    return CPG.from_document_path(request.param)
+
+
+def outcome(result):
+    """What a patient is told: stage reached and the recommendations that apply, with their narratives"""
+    sufficiency = result.sufficiency
+    return (result.eligibility.is_eligible if result.eligibility else None,
+            sufficiency.is_executable if sufficiency else None,
+            repr(result.error) if result.error else None,
+            [(r.recommendation.id, r.narrative) for r in result.applied])
+
+
+@pytest.mark.parametrize('persona', [Persona.patient, Persona.provider])
+def test_same_recommendations_as_default_mode(cpg, patients, persona):
+    default, demand_driven = ConcordEngine(cpg), ConcordEngine(cpg, demand_driven=True)
+    evaluated = 0
+    for hc in patients(120):
+        expected = default.evaluate(hc, persona=persona)
+        result = demand_driven.evaluate(hc, persona=persona)
+        assert outcome(result) == outcome(expected), hc.identifier
+        # recommendations that cannot apply for the persona are left out
+        if expected.recommendations:
+            evaluated += 1
+            assert {r.recommendation.id for r in result.recommendations.recommendations} == {
+                r.recommendation.id for r in expected.recommendations.recommendations if r.recommendation.may_apply(persona)}
+    assert evaluated
+
+
+def test_demanded_includes_required_variables(cpg):
+    for persona in (Persona.patient, Persona.provider):
+        demanded = cpg.demanded_identifiers(persona)
+        assert {v.id for v in cpg.variables if v.required} <= demanded
+        # assessments no applicable recommendation reaches are skipped
+        assert demanded <= {v.id for v in cpg.variables + cpg.assessments_variables + cpg.recommendation_variables}
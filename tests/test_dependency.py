@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import copy
+import importlib.util
+import textwrap
+
+import pytest
+
+from core.assessment import AssessmentVar
+from core.cpg import CPG
+from core.dependency import DependencyGraph, function_inputs
+from primitives.errors import DependencyCycleError
+
+
+def graph(**dependencies):
+    return DependencyGraph({node: tuple(deps) for node, deps in dependencies.items()})
+
+
+def assessment(id, expression):
+    return AssessmentVar.instantiate_from_yaml({'id': id, 'expression': expression})
+
+
+def test_order_follows_definition_order():
+    g = graph(c=['b'], a=[], b=['a'], d=[])
+    assert g.order == ['a', 'b', 'c', 'd']
+    assert g.cycle() is None
+
+
+def test_levels():
+    g = graph(a=[], b=['a'], c=[], d=['b', 'c'], e=['a'])
+    assert g.levels == [['a', 'c'], ['b', 'e'], ['d']]
+    # every node comes after all of its dependencies
+    level_of = {n: i for i, level in enumerate(g.levels) for n in level}
+    assert all(level_of[d] < level_of[n] for n, deps in g.dependencies.items() for d in deps)
+    assert graph().levels == []
+
+
+def test_cycle():
+    g = graph(a=[], b=['c'], c=['d'], d=['b'])
+    assert g.cycle() == ['b', 'c', 'd', 'b']
+    with pytest.raises(DependencyCycleError) as e:
+        g.order
+    assert e.value.cycle == ['b', 'c', 'd', 'b']
+    with pytest.raises(DependencyCycleError):
+        g.levels
+    assert graph(a=['a']).cycle() == ['a', 'a']
+
+
+def test_closures():
+    g = graph(a=[], b=['a'], c=['b'], d=[])
+    assert g.dependencies_of(['c']) == {'a', 'b', 'c'}
+    assert g.dependents_of(['a']) == {'a', 'b', 'c'}
+    assert g.subgraph(['b', 'c']).dependencies == {'b': (), 'c': ('b',)}
+
+
+def test_assessment_graph_of_cpg():
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    g = cpg.assessment_graph
+    assert sorted(g.order) == sorted(a.id for a in cpg.assessments_variables)
+    assert sorted(n for level in g.levels for n in level) == sorted(g.order)
+    assert len(g.levels) > 1
+
+
+def test_validate_reports_cycle():
+    cpg = copy.copy(CPG.from_document_path('cpgs/cholesterol.yaml'))
+    cpg.__dict__.pop('assessment_graph', None)
+    cpg.assessments_variables = cpg.assessments_variables + [
+        assessment('cycle_a', '$cycle_b == True'),
+        assessment('cycle_b', '$cycle_a == True'),
+    ]
+    with pytest.raises(ExceptionGroup) as e:
+        cpg.validate()
+    cycles = [err for err in e.value.exceptions if isinstance(err, DependencyCycleError)]
+    assert [c.cycle for c in cycles] == [['cycle_a', 'cycle_b', 'cycle_a']]
+
+
+@pytest.fixture
+def functions_module(tmp_path):
+    path = tmp_path / 'functions.py'
+    path.write_text(textwrap.dedent('''
+        def score(healthcontext):
+            return healthcontext['Age'] + healthcontext.get('sbp') + helper(healthcontext)
+
+        def helper(hc):
+            return hc['hdl']
+
+        def declared(healthcontext):
+            return 0
+        declared.inputs = ['ldl']
+
+        def dynamic(healthcontext):
+            key = 'Age'
+            return healthcontext[key]
+
+        def recursive(healthcontext):
+            return healthcontext['Age'] + recursive(healthcontext)
+    '''))
+    spec = importlib.util.spec_from_file_location('functions_under_test', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_function_inputs(functions_module):
+    assert sorted(function_inputs(functions_module, 'score')) == ['Age', 'hdl', 'sbp']
+    assert function_inputs(functions_module, 'declared') == ['ldl']
+    assert function_inputs(functions_module, 'recursive') == ['Age']
+    # not determined
+    assert function_inputs(functions_module, 'dynamic') is None
+    assert function_inputs(functions_module, 'missing') is None
+    assert function_inputs(None, 'score') is None
+
+
+def test_function_inputs_of_cpg():
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    functions = [a for a in cpg.assessments_variables if a.function]
+    assert functions
+    for a in functions:
+        inputs = function_inputs(cpg.functions_module, a.function)
+        assert inputs, a.function
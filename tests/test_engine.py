@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import copy
+import pickle
+
+import pytest
+
+import misc
+from core.concord import Concord
+from core.cpg import CPG
+
+
+@pytest.fixture(scope='module')
+def cpg():
+    return CPG.from_document_path('cpgs/cholesterol.yaml')
+
+
+def staged(concord):
+    concord.eligibility()
+    concord.sufficiency()
+    concord.assess(require_attestation=False)
+    return concord.recommendations(raise_errors=False)
+
+
+def summary(recommendations):
+    return [(er.recommendation.id, er.applies, er.compliant.value if er.compliant else None) for er in recommendations.recommendations]
+
+
+@pytest.mark.parametrize('persona', ['patient', 'provider'])
+@pytest.mark.parametrize('demand_driven', [False, True])
+def test_concord_runs_on_engine(cpg, persona, demand_driven):
+    hc = misc.sample_healthcontext(persona)
+    concord = Concord(cpg, hc, demand_driven=demand_driven)
+    result = cpg.engine(demand_driven).evaluate(hc)
+    assert concord.engine is cpg.engine(demand_driven)
+    assert summary(staged(concord)) == summary(result.recommendations)
+
+
+def test_engine_shared_by_patients(cpg):
+    first = Concord(cpg, misc.sample_healthcontext('patient'))
+    second = Concord(cpg, misc.sample_healthcontext('provider'))
+    staged(first)
+    staged(second)
+    assert first.engine is second.engine
+    assert first.engine is not cpg.engine(demand_driven=True)
+
+
+def test_engines_not_pickled(cpg):
+    cpg.engine()
+    # as artifacts are written, without the functions module
+    artifact = copy.copy(cpg)
+    artifact.functions_module = None
+    assert '_engines' not in artifact.__dict__
+    restored = pickle.loads(pickle.dumps(artifact))
+    assert '_engines' not in restored.__dict__
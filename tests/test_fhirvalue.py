@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import os
+from collections import Counter
+
+import pytest
+
+from fhir.bulk import VALUE_RESOURCE_TYPES, NDJSONExport
+from fhir.fhirvalue import FHIRValue
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+
+
+def decoded(resource, strict):
+    """(value, date, unit, codes) of the resource, or the type of the error raised"""
+    try:
+        v = FHIRValue.from_fhir(resource, strict=strict)
+    except Exception as e:
+        return type(e)
+    if v is None:
+        return None
+    unit = (v.unit.code, v.unit.system, v.unit.display) if v.unit else None
+    return v.value, v.date, unit, [(c.system, c.code, c.display) for c in v.code or []]
+
+
+@pytest.mark.parametrize('resource_type', VALUE_RESOURCE_TYPES)
+def test_strict_and_fast_decoding_agree(resource_type):
+    resources = list(NDJSONExport(SAMPLE_EXPORT).resources([resource_type]))
+    outcomes = Counter()
+    for resource in resources:
+        fast = decoded(resource, strict=False)
+        assert fast == decoded(resource, strict=True), resource.get('id')
+        outcomes['value' if isinstance(fast, tuple) else fast] += 1
+    if resource_type in ('Observation', 'Condition', 'MedicationRequest'):
+        assert outcomes['value'] > 0, outcomes
+
+
+def test_sources():
+    observation = next(NDJSONExport(SAMPLE_EXPORT).resources(['Observation']))
+    assert FHIRValue.from_fhir(observation).source == [observation]
+    strict = FHIRValue.from_fhir(observation, strict=True)
+    assert strict.fhirtype == 'Observation' and strict.source[0].as_json()['id'] == observation['id']
+
+
+@pytest.mark.parametrize('resource', [
+    {'resourceType': 'QuestionnaireResponse', 'id': 'qr', 'status': 'completed', 'authored': '2020-01-31',
+     'item': [{'linkId': '1', 'answer': [{'valueBoolean': True}]}]},
+    {'resourceType': 'QuestionnaireResponse', 'id': 'qr-quantity', 'status': 'completed', 'authored': '2020-01-31T10:00:00Z',
+     'item': [{'linkId': '1', 'answer': [{'valueQuantity': {'value': 12.5}}]}]},
+    {'resourceType': 'QuestionnaireResponse', 'id': 'qr-empty', 'status': 'completed', 'item': [{'linkId': '1'}]},
+    {'resourceType': 'Observation', 'id': 'no-value', 'status': 'final', 'code': {'coding': [{'system': 'http://loinc.org', 'code': '2093-3'}]}},
+    {'resourceType': 'Condition', 'id': 'no-code', 'subject': {'reference': 'Patient/1'}},
+], ids=lambda r: r['id'])
+def test_strict_and_fast_decoding_agree_on_edge_cases(resource):
+    assert decoded(resource, strict=False) == decoded(resource, strict=True)
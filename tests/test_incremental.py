@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+from dataclasses import replace
+from datetime import datetime
+
+import pytest
+
+import misc
+from core.cpg import CPG
+from core.engine import ConcordEngine
+from core.incremental import IncrementalEvaluation
+from primitives.sourcereference import SourceReference
+from variables.record import Record
+from variables.value import Value
+
+
+@pytest.fixture(scope='module', params=['cpgs/cholesterol.yaml', 'cpgs/screeninglungcancer.yaml'])
+def engine(request):
+    return ConcordEngine(CPG.from_document_path(request.param))
+
+
+@pytest.fixture(scope='module')
+def lung():
+    return ConcordEngine(CPG.from_document_path('cpgs/screeninglungcancer.yaml'))
+
+
+def state(result):
+    """Everything a result tells, without evaluation ids"""
+    def evaluations(stage):
+        return [(ev.id, str(ev.record.value.value) if ev.record.value else None, ev.sufficiency_status, ev.record.narrative,
+                 type(ev.error).__name__) for ev in (stage.context.evaluation_list if stage else [])]
+    recommendations = result.recommendations.recommendations if result.recommendations else []
+    return (result.is_eligible, result.is_executable, evaluations(result.sufficiency), evaluations(result.assessments),
+            [(er.recommendation.id, er.applies, er.compliant, er.narrative, type(er.error).__name__) for er in recommendations])
+
+
+def test_update_same_as_full_evaluation(engine, patients):
+    # each value arrives last: the patient is evaluated without it, then updated with it
+    variables = {v.id for v in engine.cpg.variables}
+    updated = 0
+    for hc in patients(30):
+        for i, record in enumerate(hc.records):
+            if record.var.id not in variables or not record.unfiltered_values:
+                continue
+            values = list(record.unfiltered_values)
+            records = list(hc.records)
+            records[i] = Record(record.var, values[1:] or None)
+            before = replace(hc, records=records)
+
+            evaluation = IncrementalEvaluation(engine, before)
+            changes = evaluation.update({record.var.id: values[:1]})
+            expected = engine.evaluate(evaluation.healthcontext)
+            assert state(evaluation.result) == state(expected), (hc.identifier, record.var.id)
+            assert changes == IncrementalEvaluation.changes(engine.evaluate(before), expected)
+            updated += 1
+    assert updated
+
+
+def test_same_source_replaces_value(lung):
+    hc = misc.sample_healthcontext('patient')
+    evaluation = IncrementalEvaluation(lung, hc)
+    var_id = 'smoking_cigarettes_per_day'
+
+    def values():
+        record = next((r for r in evaluation.healthcontext.records if r.var.id == var_id), None)
+        return list(record.unfiltered_values or []) if record else []
+
+    existing = len(values())
+
+    when = datetime(2024, 1, 1)
+    evaluation.update({var_id: [Value(10, date=when, source=[{'resourceType': 'Observation', 'id': 'obs-1'}])]})
+    evaluation.update({var_id: [Value(20, date=when, source=[{'resourceType': 'Observation', 'id': 'obs-2'}])]})
+    assert len(values()) == existing + 2
+    # a correction of obs-1, read back from a file
+    evaluation.update({var_id: [Value(30, date=when, source=[SourceReference('Observation', 'obs-1', 'export.ndjson', 0, 10)])]})
+    assert len(values()) == existing + 2
+    assert sorted(v.value for v in values()[-2:]) == [20, 30]
+    # values without a source are only added
+    evaluation.update({var_id: [Value(40, date=when)]})
+    evaluation.update({var_id: [Value(40, date=when)]})
+    assert len(values()) == existing + 4
+    assert state(evaluation.result) == state(lung.evaluate(evaluation.healthcontext))
+
+    with pytest.raises(ValueError):
+        evaluation.update({'no_such_variable': [Value(1)]})
+
+
+def test_eligibility_change_evaluates_again(lung, monkeypatch):
+    evaluation = IncrementalEvaluation(lung, misc.sample_healthcontext('patient'))
+    assert evaluation.result.evaluated
+    applied = {er.recommendation.id for er in evaluation.result.applied}
+    assert applied
+
+    # an eligibility input is never re-evaluated in place
+    def reevaluate(*args):
+        raise AssertionError('re-evaluated in place')
+    monkeypatch.setattr(IncrementalEvaluation, '_IncrementalEvaluation__reevaluate', reevaluate)
+
+    changes = evaluation.update({'Age': [Value(30)]})
+    assert evaluation.result.is_eligible is False
+    assert state(evaluation.result) == state(lung.evaluate(evaluation.healthcontext))
+    # every recommendation is gone; the applied ones are withdrawn
+    assert {c.id for c in changes if c.withdrawn} == applied
+    assert all(c.applies is None and not c.newly_applied for c in changes)
+
+    # not eligible: a change of other variables changes nothing
+    assert evaluation.update({'smoking_cigarettes_per_day': [Value(5)]}) == []
+
+    changes = evaluation.update({'Age': [Value(65)]})
+    assert evaluation.result.evaluated
+    assert {c.id for c in changes if c.newly_applied} == {er.recommendation.id for er in evaluation.result.applied}
+    assert all(c.applied is None for c in changes)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import pickle
+import shutil
+
+import pytest
+
+from core.cpg import CPG
+from fhir.bulk import BulkIngest
+from fhir.ndjsonindex import NDJSONIndex
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+PATIENT = '6c5d9ca9-54d7-42f5-bfae-a7c19cd217f2'
+
+
+@pytest.fixture
+def export(tmp_path):
+    # the index is saved next to the export
+    directory = tmp_path / 'export'
+    shutil.copytree(SAMPLE_EXPORT, directory)
+    return str(directory)
+
+
+@pytest.fixture(scope='module')
+def cpg():
+    return CPG.from_document_path('cpgs/cholesterol.yaml')
+
+
+def summary(healthcontext):
+    return [(r.id, [v.value for v in r.values] if r.values else None) for r in healthcontext.records if r]
+
+
+def test_patient_same_as_full_ingest(export, cpg):
+    ingest = BulkIngest(export, cpg.variables)
+    streamed = {hc.identifier: hc for hc in ingest.healthcontexts()}
+    with ingest:
+        assert summary(ingest.patient(PATIENT)) == summary(streamed[PATIENT])
+
+
+def test_index_loaded_once(export, cpg, monkeypatch):
+    NDJSONIndex.for_export(export)
+    loads = []
+    load = NDJSONIndex.load.__func__
+    monkeypatch.setattr(NDJSONIndex, 'load', classmethod(lambda cls, directory: loads.append(directory) or load(cls, directory)))
+    with BulkIngest(export, cpg.variables) as ingest:
+        first = ingest.patient(PATIENT)
+        second = ingest.patient(PATIENT)
+        assert summary(first) == summary(second)
+        assert len(loads) == 1
+        index = ingest.index
+    # closed with the ingest, loaded again on the next call
+    assert not index._NDJSONIndex__maps
+    ingest.patient(PATIENT)
+    assert len(loads) == 2
+    ingest.close()
+
+
+def test_pickled_without_index(export, cpg):
+    ingest = BulkIngest(export, cpg.variables)
+    ingest.patient(PATIENT)
+    restored = pickle.loads(pickle.dumps(ingest))
+    assert 'index' not in restored.__dict__
+    assert summary(restored.patient(PATIENT)) == summary(ingest.patient(PATIENT))
+    ingest.close()
+    restored.close()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from core.cohort import PatientStatus, evaluate_patient
+from core.cpg import CPG
+from core.population import PopulationData, PopulationEngine
+
+
+@pytest.fixture(scope='module', params=['cpgs/cholesterol.yaml', 'cpgs/screeninglungcancer.yaml'])
+def cpg(request):
+    return CPG.from_document_path(request.param)
+
+
+@pytest.fixture(scope='module')
+def cohort(patients):
+    return patients(120)
+
+
+@pytest.fixture(scope='module')
+def population(cpg, cohort):
+    return PopulationEngine(cpg).evaluate(PopulationData.from_healthcontexts(cpg, cohort))
+
+
+def test_patient_results_as_evaluate_patient(cpg, cohort, population):
+    expected = [evaluate_patient(cpg, hc) for hc in cohort]
+    assert list(population.patient_results()) == expected
+    # the cohort has patients in every stage, with failed eligibility too
+    assert {PatientStatus.evaluated, PatientStatus.not_eligible, PatientStatus.failed} <= {r.status for r in expected}
+    assert {r.error for r in expected if r.error} == {'ExceptionGroup: EligibilityEvaluationError (1 sub-exception)'}
+
+
+def test_result_columns(cpg, cohort, population):
+    expected = [evaluate_patient(cpg, hc) for hc in cohort]
+    assert population.eligible.tolist() == [r.eligible is True for r in expected]
+    assert population.eligibility_failed.tolist() == [r.status == PatientStatus.failed for r in expected]
+    assert population.evaluated.tolist() == [r.status == PatientStatus.evaluated for r in expected]
+    assert population.counts() == {rid: sum(rid in r.applied for r in expected) for rid in population.recommendations}
+
+
+def test_needs_attestation(cpg, cohort, population):
+    # patients asked to attest are those the scalar engine stops for when attestation is required
+    for i, hc in enumerate(cohort):
+        result = evaluate_patient(cpg, hc, require_attestation=True)
+        asked = {vid for vid, mask in population.needs_attestation.items() if mask[i]}
+        if result.status == PatientStatus.needs_attestation:
+            assert population.evaluated[i] and asked == set(result.needs_attestation), hc.identifier
+        elif result.status == PatientStatus.evaluated:
+            assert not asked, hc.identifier
+    assert any(np.any(mask & population.evaluated) for mask in population.needs_attestation.values())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import json
+
+import pytest
+
+from core.cpg import CPG
+from fhir.bulk import NDJSONExport, open_ndjson
+from fhir.prefilter import CODED_ELEMENTS, CodePrefilter
+from primitives.code import Code
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+
+
+def lines(resource_types=None):
+    for _, path in NDJSONExport(SAMPLE_EXPORT).files(resource_types):
+        with open_ndjson(path) as f:
+            yield from (line for line in f if line.strip())
+
+
+def export_codes():
+    """Every coding in the coded elements of the export"""
+    for line in lines(CODED_ELEMENTS):
+        resource = json.loads(line)
+        for c in (resource.get(CODED_ELEMENTS[resource['resourceType']]) or {}).get('coding') or []:
+            yield Code(c['code'], c['system'])
+
+
+@pytest.fixture(scope='module')
+def prefilters():
+    cpgs = [CPG.from_document_path(p) for p in ('cpgs/cholesterol.yaml', 'cpgs/screeninglungcancer.yaml')]
+    codes = list(export_codes())
+    return [CodePrefilter.for_variables(cpg.variables) for cpg in cpgs] + [
+        CodePrefilter.for_cpgs(cpgs),
+        # half of the export's codes, so that many resources are accepted and many are not
+        CodePrefilter.for_codes(codes[::2])]
+
+
+def test_may_match_never_rejects_accepted(prefilters):
+    for prefilter in prefilters:
+        accepted = 0
+        for line in lines(CODED_ELEMENTS):
+            if prefilter.accepts(json.loads(line)):
+                accepted += 1
+                assert prefilter.may_match(line), line[:120]
+        assert accepted
+    # whitespace in the raw JSON
+    prefilter = prefilters[-1]
+    resource = next(json.loads(line) for line in lines(['Observation']) if prefilter.accepts(json.loads(line)))
+    assert prefilter.may_match(json.dumps(resource, indent=2).encode())
+
+
+def test_other_resource_types_pass(prefilters):
+    others = [json.loads(line) for line in lines() if json.loads(line)['resourceType'] not in CODED_ELEMENTS]
+    assert {r['resourceType'] for r in others} >= {'Patient', 'Encounter', 'Immunization'}
+    assert all(p.accepts(r) for p in prefilters for r in others)
+
+
+def test_code_outside_coded_element_rejected():
+    prefilter = CodePrefilter.for_codes([Code.snomed('266919005')])
+    # the code is the value of the observation, not its code
+    observation = {'resourceType': 'Observation', 'code': {'coding': [{'system': 'http://loinc.org', 'code': '72166-2'}]},
+                   'valueCodeableConcept': {'coding': [{'system': 'http://snomed.info/sct', 'code': '266919005'}]}}
+    assert prefilter.may_match(json.dumps(observation).encode())
+    assert not prefilter.accepts(observation)
+    # the code of another system
+    condition = {'resourceType': 'Condition', 'code': {'coding': [{'system': 'http://loinc.org', 'code': '266919005'}]}}
+    assert prefilter.may_match(json.dumps(condition).encode())
+    assert not prefilter.accepts(condition)
+    condition['code']['coding'].append({'system': 'http://snomed.info/sct', 'code': '266919005'})
+    assert prefilter.accepts(condition)
+    assert not prefilter.may_match(b'{"resourceType": "Condition", "code": {"coding": [{"code": "2669190050"}]}}')
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import copy
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from core.cpg import CPG
+from fhir.mockserver import MockBulkServer
+from fhir.search import CodeSearch
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+PATIENT = '6c5d9ca9-54d7-42f5-bfae-a7c19cd217f2'
+
+
+@pytest.fixture(scope='module')
+def cpg():
+    return CPG.from_document_path('cpgs/cholesterol.yaml')
+
+
+def searches(server, since=0):
+    """Queries of the searches served after the first `since` requests"""
+    return [parse_qs(urlparse(path).query) for method, path, headers in server.requests[since:]
+            if urlparse(path).path.strip('/') in ('Observation', 'Condition', 'MedicationRequest', 'Procedure')]
+
+
+def observation(resources):
+    return next(r for r in resources if r['resourceType'] == 'Observation' and 'valueQuantity' in r)
+
+
+def test_search_finds_patient_resources(cpg):
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        resources = CodeSearch(server.url, cpg.variables).resources(PATIENT)
+    assert resources[0]['resourceType'] == 'Patient'
+    assert any(r['resourceType'] == 'Observation' for r in resources)
+    assert all('_lastUpdated' not in q for q in searches(server))
+
+
+def test_revalidated_with_etag(cpg):
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        search = CodeSearch(server.url, cpg.variables)
+        url = f'{server.url}/Patient/{PATIENT}'
+        first = search.get(url)
+        second = search.get(url)
+    assert first == second
+    assert 'If-None-Match' not in server.requests[0][2]
+    assert server.requests[1][2]['If-None-Match'].startswith('W/"')
+
+
+@pytest.mark.parametrize('clock_skew', [0.0, -3600.0, 3600.0])
+def test_refresh_finds_updates(cpg, clock_skew):
+    # the server's clock is behind or ahead of the client's, updates are found all the same
+    with MockBulkServer(SAMPLE_EXPORT, clock_skew=clock_skew) as server:
+        search = CodeSearch(server.url, cpg.variables, refresh_overlap=1.0)
+        first = search.resources(PATIENT)
+        updated = copy.deepcopy(observation(first))
+        updated['valueQuantity']['value'] = 1234.5
+        server.update(updated)
+        before = len(server.requests)
+        refreshed = search.resources(PATIENT)
+        queries = searches(server, before)
+        server_now = server.now()
+
+    assert len(refreshed) == len(first)
+    assert observation(r for r in refreshed if r.get('id') == updated['id'])['valueQuantity']['value'] == 1234.5
+    since = [datetime.fromisoformat(q['_lastUpdated'][0].removeprefix('ge')) for q in queries]
+    assert since and all(server_now - timedelta(seconds=30) < s < server_now for s in since)
+
+
+def test_refresh_without_updates(cpg):
+    with MockBulkServer(SAMPLE_EXPORT) as server:
+        search = CodeSearch(server.url, cpg.variables, refresh_overlap=0.0)
+        first = search.resources(PATIENT)
+        assert search.search(PATIENT, since=server.now() + timedelta(seconds=1)) == []
+        assert search.resources(PATIENT) == first
+
+
+def test_server_time():
+    class Response:
+        headers = {'Date': 'Sun, 18 Oct 2026 10:00:00 GMT'}
+
+    date = datetime(2026, 10, 18, 10, 0, tzinfo=timezone.utc)
+    assert CodeSearch.server_time(Response()) == date
+    assert CodeSearch.server_time(Response(), {'meta': {'lastUpdated': '2026-10-18T11:30:00.5+01:00'}}) == \
+        date + timedelta(minutes=30, milliseconds=500)
+    assert CodeSearch.server_time(Response(), {'meta': {'lastUpdated': 'not a date'}}) == date
+    Response.headers = {}
+    assert CodeSearch.server_time(Response()) is None
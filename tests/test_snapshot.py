@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import time
+import uuid
+from dataclasses import replace
+from datetime import datetime
+
+import pytest
+
+import misc
+from core.concord import Concord, NeedAttestationError
+from core.cpg import CPG
+from core.engine import ConcordEngine
+from core.snapshot import ConcordSnapshot, LocalSnapshotStore, SnapshotError
+from primitives.types import ValueType
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    concord = Concord(CPG.from_document_path('cpgs/screeninglungcancer.yaml'), misc.sample_healthcontext('patient'))
+    concord.eligibility()
+    concord.sufficiency()
+    return concord.snapshot()
+
+
+def age(path, seconds):
+    """Sets the times of `path` `seconds` back; ctime cannot be set, it stays now"""
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_pop_once(tmp_path, snapshot):
+    store = LocalSnapshotStore(str(tmp_path))
+    key = store.put(snapshot)
+    assert store.get(key).pending == snapshot.pending
+    assert store.pop(key).pending == snapshot.pending
+    assert store.pop(key) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_purge_expired(tmp_path, snapshot):
+    store = LocalSnapshotStore(str(tmp_path), max_age=60)
+    old, new = store.put(snapshot), store.put(snapshot)
+    age(tmp_path / f'{old}.snapshot', 120)
+    assert store.get(old) is None
+    assert store.purge() == 1
+    assert store.get(new) is not None
+    assert sorted(os.listdir(tmp_path)) == [f'{new}.snapshot']
+
+
+def test_purge_leftovers(tmp_path, snapshot, monkeypatch):
+    store = LocalSnapshotStore(str(tmp_path), leftover_age=60)
+    key = store.put(snapshot)
+    # as left by a crash inside `put` and inside `pop`
+    tmp = tmp_path / 'tmpabc123.tmp'
+    tmp.write_bytes(b'partial')
+    claimed = tmp_path / f'{uuid.uuid4().hex}.snapshot.{uuid.uuid4().hex}'
+    claimed.write_bytes(snapshot.to_bytes())
+    other = tmp_path / 'notes.txt'
+    other.write_text('not of the store')
+
+    # recent ones may belong to a put or pop still running
+    assert store.purge() == 0
+    later = time.time() + 120
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert store.purge() == 2
+    assert sorted(os.listdir(tmp_path)) == sorted([f'{key}.snapshot', 'notes.txt'])
+
+
+def attestations(concord):
+    """A value for every variable waiting for attestation"""
+    values = {ValueType.date: datetime(2015, 1, 1), ValueType.integer: 10, ValueType.decimal: 1.5, ValueType.string: 'x'}
+    return {ev.record.id: values.get(ev.record.var.value_type, True) for ev in concord.sufficiency_result.attestation_variables}
+
+
+def outcome(concord):
+    return ([(ev.id, str(ev.record.value.value) if ev.record.value else None, ev.record.narrative, type(ev.error).__name__)
+             for ev in concord.assessment_result.context.evaluation_list],
+            [(er.recommendation.id, er.applies, er.compliant, er.narrative) for er in concord.recommendation_result.recommendations])
+
+
+@pytest.mark.parametrize('path', ['cpgs/cholesterol.yaml', 'cpgs/screeninglungcancer.yaml'])
+@pytest.mark.parametrize('persona', ['patient', 'provider'])
+def test_resume_same_as_in_process(tmp_path, monkeypatch, path, persona):
+    cpg = CPG.from_document_path(path)
+    # the sample data is dated back from today
+    concord = Concord(cpg, misc.sample_healthcontext(persona), as_of=datetime.now())
+    concord.eligibility()
+    concord.sufficiency()
+    with pytest.raises(NeedAttestationError):
+        concord.assess()
+    store = LocalSnapshotStore(str(tmp_path))
+    key = store.put(concord.snapshot())
+
+    attested = attestations(concord)
+    concord.attest(attested)
+    concord.assess()
+    concord.recommendations(raise_errors=False)
+
+    # eligibility and sufficiency are not evaluated again, the snapshot has them
+    def evaluated_again(*args, **kwargs):
+        raise AssertionError('evaluated again')
+    monkeypatch.setattr(ConcordEngine, 'eligibility', evaluated_again)
+    monkeypatch.setattr(ConcordEngine, 'sufficiency', evaluated_again)
+
+    resumed = Concord.from_snapshot(cpg, store.pop(key))
+    assert resumed.healthcontext.records == []
+    assert set(attested) == set(resumed.snapshot().pending)
+    resumed.attest(attested)
+    resumed.assess()
+    resumed.recommendations(raise_errors=False)
+    assert outcome(resumed) == outcome(concord)
+    assert resumed.applied_recommendations
+
+
+def test_other_cpg_or_version(snapshot):
+    lung = CPG.from_document_path('cpgs/screeninglungcancer.yaml')
+    assert Concord.from_snapshot(lung, ConcordSnapshot.from_bytes(snapshot.to_bytes()))
+    with pytest.raises(SnapshotError):
+        Concord.from_snapshot(CPG.from_document_path('cpgs/cholesterol.yaml'), snapshot)
+    with pytest.raises(SnapshotError):
+        Concord.from_snapshot(lung, replace(snapshot, cpg_fingerprint='0' * len(snapshot.cpg_fingerprint)))
+    with pytest.raises(SnapshotError):
+        Concord.from_snapshot(lung, replace(snapshot, version=snapshot.version + 1))
+    with pytest.raises(SnapshotError):
+        ConcordSnapshot.from_bytes(pickle.dumps({'not': 'a snapshot'}))
+
+
+def test_attest_only_pending():
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    concord = Concord(cpg, misc.sample_healthcontext('patient'), as_of=datetime.now())
+    with pytest.raises(ValueError):
+        concord.snapshot()
+    concord.eligibility()
+    concord.sufficiency()
+    snapshot = concord.snapshot()
+
+    resumed = Concord.from_snapshot(cpg, snapshot)
+    with pytest.raises(ValueError):
+        resumed.attest({'no_such_variable': True})
+    # a variable that has a value is not waiting for attestation
+    valued = next(ev.id for ev in resumed.sufficiency_result.context.evaluation_list if ev.record.value)
+    assert valued not in snapshot.pending
+    with pytest.raises(ValueError):
+        resumed.attest({valued: True, snapshot.pending[0]: True})
+    # nothing is attested when any variable is not pending
+    assert {ev.id for ev in resumed.sufficiency_result.attestation_variables} == set(snapshot.pending)
+    resumed.attest(attestations(resumed))
+    assert resumed.sufficiency_result.attestation_variables == []
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import shutil
+
+import pytest
+
+import misc
+from core.concord import Concord
+from core.cpg import CPG
+from fhir.bulk import BulkIngest, NDJSONExport
+from primitives.sourcereference import SourceReference
+from renderer.templates import LocalRenderer
+
+SAMPLE_EXPORT = 'samples/fhir_r4/ndjson'
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    """The sample export with Observations gzipped"""
+    directory = tmp_path_factory.mktemp('export')
+    shutil.copytree(SAMPLE_EXPORT, directory, dirs_exist_ok=True)
+    with open(directory / 'Observation.ndjson', 'rb') as f, gzip.open(directory / 'Observation.ndjson.gz', 'wb') as gz:
+        shutil.copyfileobj(f, gz)
+    (directory / 'Observation.ndjson').unlink()
+    (directory / 'manifest.json').unlink()
+    return directory
+
+
+@pytest.fixture(scope='module')
+def references(export):
+    cpg = CPG.from_document_path('cpgs/cholesterol.yaml')
+    hc, = BulkIngest(str(export), cpg.variables).healthcontexts()
+    return [s for r in hc.records for v in r.values or [] for s in v.source or [] if isinstance(s, SourceReference)]
+
+
+def test_resolve(export, references):
+    originals = {(r['resourceType'], r['id']): r for r in NDJSONExport(SAMPLE_EXPORT).resources()}
+    paths = {ref.path for ref in references}
+    assert str(export / 'Observation.ndjson.gz') in paths and str(export / 'Patient.ndjson') in paths
+    for ref in references:
+        assert ref.resolvable
+        assert ref.resolve() == originals[(ref.resource_type, ref.id)]
+        model = ref.model()
+        assert model.resource_type == ref.resource_type and model.as_json()['id'] == ref.id
+
+
+def test_not_resolvable():
+    ref = SourceReference('Observation', '1')
+    assert not ref.resolvable and str(ref) == ref.reference == 'Observation/1'
+    with pytest.raises(ValueError):
+        ref.resolve()
+
+
+def test_renderer_resolved_filter(references, tmp_path):
+    concord = Concord(CPG.from_document_path('cpgs/screeninglungcancer.yaml'), misc.sample_healthcontext('patient'))
+    env = LocalRenderer(id='document', concord=concord).template_env
+    for ref in references:
+        assert json.loads(env.from_string('{{ source | resolved | tojson }}').render(source=ref)) == ref.resolve()
+    # unresolvable sources, and sources whose file is gone, are given as they are
+    template = env.from_string('{{ source | resolved }}')
+    assert template.render(source=SourceReference('Observation', '1')) == 'Observation/1'
+    ref = references[0]
+    assert template.render(source=SourceReference(ref.resource_type, ref.id, str(tmp_path / 'gone.ndjson'), 0, 10)) == ref.reference
+    assert template.render(source='Observation/2') == 'Observation/2'
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from primitives.vcolumns import vcolumns
+from primitives.vlist import vlist, vview
+from variables.value import Value
+from variables.var import ValueFilter
+
+AS_OF = datetime(2024, 6, 1)
+
+
+def reference(value_filter: ValueFilter, values: vlist, as_of: datetime) -> list:
+    """Per-value filter `Record` used before `ValueFilter.apply`"""
+    after, before = value_filter.after_date_as_of(as_of), value_filter.before_date_as_of(as_of)
+    kept = []
+    for v in values:
+        if after and v.date.dt < after:
+            continue
+        if before and v.date.dt > before:
+            continue
+        if value_filter.value_expression and not value_filter.compiled_value_expression.evaluate({'value': v.value}):
+            continue
+        kept.append(v)
+    if value_filter.upper:
+        return kept[:int(value_filter.upper)]
+    if value_filter.lower:
+        return kept[-int(value_filter.lower):]
+    return kept
+
+
+def history(rng: random.Random, n: int) -> vlist:
+    return vlist(Value(rng.choice([rng.randint(100, 300), round(rng.uniform(100, 300), 1)]),
+                       date=AS_OF - timedelta(days=rng.randint(0, 2000), hours=rng.randint(0, 23))) for _ in range(n))
+
+
+FILTERS = [
+    dict(after=365),
+    dict(before=30),
+    dict(before=90, after=730),
+    dict(value_expression=' > 175'),
+    dict(value_expression='>= 200.5'),
+    dict(value_expression=' > 150 and $value < 250'),
+    dict(after=1000, value_expression=' < 200', upper=2),
+    dict(before=10, lower=3),
+    dict(upper=1),
+]
+
+
+@pytest.mark.parametrize('kwargs', FILTERS)
+def test_same_values_as_per_value_filter(kwargs):
+    rng = random.Random(str(kwargs))
+    value_filter = ValueFilter(**kwargs)
+    for n in (0, 1, 2, 7, 50):
+        values = history(rng, n)
+        expected = [(v.value, v.date.dt) for v in reference(value_filter, values, AS_OF)]
+        assert [(v.value, v.date.dt) for v in value_filter.apply(values, as_of=AS_OF)] == expected
+        if n:
+            columns = vcolumns.from_values(values)
+            filtered = value_filter.apply(columns, as_of=AS_OF)
+            assert isinstance(filtered, vcolumns)
+            assert [(v.value, v.date.dt) for v in filtered] == expected
+
+
+def test_window_boundaries_inclusive():
+    values = vlist(Value(n, date=AS_OF - timedelta(days=n)) for n in range(0, 40))
+    filtered = ValueFilter(before=10, after=20).apply(values, as_of=AS_OF)
+    assert [v.value for v in filtered] == list(range(10, 21))
+    columns = ValueFilter(before=10, after=20).apply(vcolumns.from_values(values), as_of=AS_OF)
+    assert [v.value for v in columns] == list(range(10, 21))
+
+
+def test_window_only_is_a_view():
+    values = history(random.Random(0), 20)
+    filtered = ValueFilter(after=700).apply(values, as_of=AS_OF)
+    assert isinstance(filtered, vview)
+    assert list(filtered) == [v for v in values if v.date.dt >= AS_OF - timedelta(days=700)]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import pickle
+from datetime import datetime, timezone
+
+from primitives.vcolumns import vcolumns
+from primitives.vlist import vlist
+from variables.value import Value
+
+
+def history():
+    return [Value(255, date=datetime(2022, 1, 1)), Value(276, date=datetime(2023, 6, 1)), Value(266, date=datetime(2022, 9, 1))]
+
+
+def test_newest_first_like_vlist():
+    values = history()
+    columns = vcolumns.from_values(values)
+    assert len(columns) == 3
+    assert columns.representation == vlist(values).representation == '276, 266, 255'
+    assert [v.date.dt for v in columns] == [v.date.dt for v in vlist(values)]
+
+
+def test_values_materialized_once_with_original_type():
+    columns = vcolumns.from_values(history() + [Value(1.5, date=datetime(2021, 1, 1)), Value(True, date=datetime(2020, 1, 1))])
+    assert columns[0].value == 276 and isinstance(columns[0].value, int)
+    assert columns[3].value == 1.5
+    assert columns[4].value is True
+    assert columns[0] is columns[0]
+    assert str(columns[-1].date) == '2020-01-01'
+    assert [v.value for v in columns[1:3]] == [266, 255]
+
+
+def test_not_columnar():
+    assert vcolumns.from_values([]) is None
+    assert vcolumns.from_values([Value('text')]) is None
+    assert vcolumns.from_values([Value(1, unit='mg/dL'), Value(2, unit='mmol/L')]) is None
+
+
+def test_until():
+    columns = vcolumns.from_values(history())
+    assert columns.until(datetime(2024, 1, 1)) is columns
+    assert columns.until(datetime(2022, 9, 1)).representation == '266, 255'
+    assert len(columns.until(datetime(2021, 1, 1))) == 0
+
+
+def test_take_keeps_order_and_sources():
+    values = [Value(n, date=datetime(2022, 1, n), source=[f'Observation/{n}']) for n in range(1, 6)]
+    columns = vcolumns.from_values(values)
+    taken = columns.take([4, 0, 2])
+    assert taken.representation == '1, 5, 3'
+    assert [v.source for v in taken] == [['Observation/1'], ['Observation/5'], ['Observation/3']]
+    assert taken.unit == columns.unit and taken.value_class is columns.value_class
+
+
+def test_micros_timezones():
+    utc = [Value(n, date=datetime(2022, 1, n, 12, tzinfo=timezone.utc)) for n in range(1, 4)]
+    columns = vcolumns.from_values(utc)
+    noon = datetime(2022, 1, 2, 12, tzinfo=timezone.utc)
+    assert columns.micros(noon) == columns.timestamps[1]
+    # naive datetimes are local time
+    assert columns.micros(noon.astimezone().replace(tzinfo=None)) == columns.timestamps[1]
+    assert columns[1].date.dt == noon
+
+    naive = vcolumns.from_values([Value(1, date=datetime(2022, 1, 2, 12))])
+    assert naive.micros(datetime(2022, 1, 2, 12).astimezone()) == naive.timestamps[0]
+
+
+def test_pickle():
+    columns = vcolumns.from_values(history())
+    columns[0]
+    restored = pickle.loads(pickle.dumps(columns))
+    assert restored.representation == columns.representation
+    assert restored.unit == columns.unit
@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
 
+from datetime import datetime
 from ontology.codes import Code, CodeSystemType, Concord_Code_Age
 from variables import record, var, value
 
 
 class Age(record.Record):
 
-    def __init__(self, ageValue: int):
+    def __init__(self, ageValue: int, date: datetime = None):
+        """date: the day the age is for, now if not given"""
 
         val_code = Code(Concord_Code_Age, CodeSystemType.concord.value, Concord_Code_Age)
-        var_age = var.Var(Concord_Code_Age, 'Age', code=[val_code])
-        val = value.Value(ageValue)
+        var_age = var.Var(Concord_Code_Age, 'Age', code=[val_code], category=var.VarType.demographics)
+        val = value.Value(ageValue, date=date)
         super().__init__(var_age, [val])
         
         
\ No newline at end of file
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+from primitives.code import Code
+
+
+@dataclass(frozen=True)
+class CodeIndex:
+    """Inverted index from `Code` (by `system|code`) to the identifiers of the variables carrying that code.
+
+    Matches like `Var.__eq__` (any shared code) but buckets a patient's data in a single pass
+    instead of comparing every item against every variable.
+    """
+
+    identifiers: dict[Code, tuple[str, ...]]
+
+    @classmethod
+    def for_variables(cls, variables: list) -> 'CodeIndex':
+        index = {}
+        for variable in variables:
+            for c in variable.code or []:
+                ids = index.setdefault(c, [])
+                if variable.id not in ids:
+                    ids.append(variable.id)
+        return cls({c: tuple(ids) for c, ids in index.items()})
+
+    def matches(self, codes: list[Code]) -> tuple[str, ...]:
+        """Identifiers of variables sharing any of `codes`, in definition order of the first matching code"""
+        if not codes:
+            return ()
+        if len(codes) == 1:
+            return self.identifiers.get(codes[0], ())
+        matched = {}
+        for c in codes:
+            matched.update(dict.fromkeys(self.identifiers.get(c, ())))
+        return tuple(matched)
+
+    def bucket(self, items: Iterable[Any], codes_of: Callable[[Any], list[Code]]) -> dict[str, list]:
+        """variable id -> all items matching it, in the order given"""
+        buckets = {}
+        for item in items:
+            for variable_id in self.matches(codes_of(item)):
+                buckets.setdefault(variable_id, []).append(item)
+        return buckets
+
+    def first(self, items: Iterable[Any], codes_of: Callable[[Any], list[Code]]) -> dict[str, Any]:
+        """variable id -> first item matching it"""
+        firsts = {}
+        for item in items:
+            for variable_id in self.matches(codes_of(item)):
+                firsts.setdefault(variable_id, item)
+        return firsts
@@ -13,33 +13,50 @@ from primitives.errors import VarError
 
 
 from primitives.varstring import EvaluatorString, ValidationExpression
-from variables.var import Narrative, Var, VarError, VarImplausibleError, VarPanelValidationError
+from variables.var import Narrative, Var, VarError, VarImplausibleError, VarPanelValidationError, VarType
 from variables.value import Value
-from primitives.vlist import vlist
+from primitives.vlist import vlist, vview
+from primitives.vcolumns import vcolumns
 from primitives.types import Persona
+from primitives.valuedate import local_naive
 
 logger = logging.getLogger(__name__)
 
+
+def record_table(records) -> dict:
+    """Name table (id -> Record) for a list of records; the first record wins for a duplicate id, as with a linear search.
+    A table is passed through as is."""
+    if isinstance(records, dict):
+        return records
+    table = {}
+    for r in records:
+        table.setdefault(r.id, r)
+    return table
+
+
 @dataclass
 class Record:
 
     var: Var
-    __values: vlist[Value] = None 
+    __values: vlist[Value] | vcolumns = None 
+    """values of the variable, newest first; a `vlist` or `vcolumns` store is kept as is, not copied"""
     __attested_value: Value = field(init=False, default=None)
+    __attested_values: vlist[Value] = field(init=False, default=None)
     __narrative: str = field(init=False, default=None)
     __plausible_validator: ValidationExpression = field(init=False)
     __panel_validator: EvaluatorString = field(init=False)
     __persona: Persona = field(init=False)
+    as_of: datetime = field(default=None, kw_only=True)
+    """Evaluation date: value filter windows and narrative dates are relative to it, today if None"""
 
     def __post_init__(self):
-        self.__values = vlist(self.__values) if self.__values else None
-        if self.var.validator:
-            logger.debug(self.var.validator)
-            self.__panel_validator = EvaluatorString(self.var.validator['panel']) if 'panel' in self.var.validator else None 
-            self.__plausible_validator = ValidationExpression(self.var.validator['plausible']) if 'plausible' in self.var.validator else None 
-        else:
-            self.__panel_validator = None
-            self.__plausible_validator = None
+        if not self.__values:
+            self.__values = None
+        elif not isinstance(self.__values, (vlist, vview, vcolumns)):
+            self.__values = vlist(self.__values)
+        # validators are compiled once per Var
+        self.__panel_validator = self.var.panel_validator
+        self.__plausible_validator = self.var.plausible_validator
         # debug purpose:
         self.__persona = None
 
@@ -74,12 +91,25 @@ class Record:
     @property
     def values(self):
         if self.__attested_value:
-            return vlist([self.__attested_value])
+            return self.__attested_values
         elif self.__must_filter_values:
             return self.filtered_values
         else:
             return self.__values
 
+    def values_until(self, as_of: datetime):
+        """`values` dated on or before `as_of` (naive, local time), all of them if None.
+        Demographics are kept whatever their date: they describe the patient, not an observation."""
+        values = self.values
+        if not values or as_of is None or self.var.category == VarType.demographics:
+            return values
+        return values.until(as_of) if hasattr(values, 'until') else [v for v in values if local_naive(v.date.dt) <= as_of]
+
+    @property
+    def unfiltered_values(self):
+        """values as given, before the value filter of the variable"""
+        return self.__values
+
     @property
     def attested_value(self):
         return self.__attested_value
@@ -89,6 +119,7 @@ class Record:
         if self.var.user_attestable:
             if self.validate(value=value):
                 self.__attested_value = value
+                self.__attested_values = vlist([value], presorted=True)
                 assert self.__attested_value 
         else:
             raise ValueError(f'Variable is not attestable var={self.id}')
@@ -101,27 +132,11 @@ class Record:
     def has_value(self):
         return self.value is not None
 
-    def __filter_values(self, values: vlist[Value]):
+    def __filter_values(self, values):
         if not values:
             logging.debug('No values to apply valuefilter')
             return None
-        lst = list(filter(self.__function_filter, values))
-        if self.var.value_filter.upper:
-            return lst[:self.upper]
-        if self.var.value_filter.lower:
-            return lst[-int(self.lower):]
-        return vlist(lst)
-
-    def __function_filter(self, value: Value):
-        bools = []
-        if self.var.value_filter.after_date:
-            bools.append(value.date >= self.var.value_filter.after_date)
-        if self.var.value_filter.before_date:
-            bools.append(value.date <= self.var.value_filter.before_date)
-        if self.var.value_filter.value_expression:
-            exp = str(value.value) + ' ' + self.var.value_filter.value_expression
-            bools.append(eval(exp))
-        return False if False in bools else True
+        return self.var.value_filter.apply(values, as_of=self.as_of)
 
     @cached_property
     def filtered_values(self):
@@ -143,7 +158,7 @@ class Record:
         else:
             variable_data_dict = {"self": self.as_dict()}
 
-        self.__narrative = narr.get_text(self.value.value if self.value else None, persona, variable_data_dict, default=self.default_narratives.data)
+        self.__narrative = narr.get_text(self.value.value if self.value else None, persona, variable_data_dict, default=self.default_narratives.data, as_of=self.as_of)
         logger.debug(f'Santized-Narrative={self.id} variable_dict={variable_data_dict}, narrative_text={self.narrative}, tags={self.var.narr}, default={self.default_narratives.data}')
         # exit()
 
@@ -199,7 +214,8 @@ class Record:
             vtype = self.var.value_type.type
             if vtype == bool and type(val.value) == str and (val.value not in ['False', 'True']):
                 raise VarError(f'Invalid value_type={type(val.value)}; need={vtype}', self.id)
-            if vtype(val.value) == None:
+            # eg. an attested date is already a date, `date(value)` cannot convert it
+            if not isinstance(val.value, vtype) and vtype(val.value) == None:
                 raise VarError(f'Invalid value_type={type(val.value)}; need={vtype}', self.id)
 
 
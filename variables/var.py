@@ -3,17 +3,18 @@
 
 from dataclasses import dataclass, field
 from functools import cache, cached_property
+from itertools import compress, repeat
 from re import findall
 from typing import Any
 
-import logging, humanize
+import logging, humanize, operator, re
 
 from datetime import datetime, timedelta
 from primitives.errors import VarError
 from primitives.types import Persona, ValueType, YMLStrEnum
 from primitives.code import Code
-from primitives.varstring import VarString
-from primitives.valuedate import ValueDate
+from primitives.varstring import CompiledExpression, EvaluatorString, ValidationExpression, VarString
+from primitives.valuedate import ValueDate, local_naive
 
 log = logging.getLogger(__name__)
 
@@ -32,14 +33,122 @@ class ValueFilter:
     def __init__(self, before:int=None, after:int=None, count:int=None, value_expression:str=None, upper=None, lower=None):
         if before and after and before >= after:
             raise ValueError(f'ValueFilter error; before:{before} cannot be >= to after:{after}')
-        today = datetime.today()
-        self.after_date = today - timedelta(days=after) if after else None 
-        self.before_date = today - timedelta(days=before) if before else None 
+        # day offsets are kept, dates are resolved on access;
+        # a filter loaded from a compiled CPG artifact must not carry the build date
+        self.before = before
+        self.after = after
         self.count = count
         self.value_expression = value_expression
         self.upper = upper 
         self.lower = lower
 
+    @cached_property
+    def compiled_value_expression(self):
+        """`value_expression` (eg. ' > 175') compiled against the name `value`"""
+        return CompiledExpression.compile('$value ' + self.value_expression) if self.value_expression else None
+
+    @cached_property
+    def compiled_comparison(self):
+        """(operator, number) for a plain numeric comparison such as ' > 175', applied without expression evaluation"""
+        if not self.value_expression:
+            return None
+        m = _COMPARISON.match(self.value_expression)
+        if not m:
+            return None
+        number = m.group(2)
+        return _OPERATORS[m.group(1)], float(number) if '.' in number else int(number)
+
+    @property
+    def after_date(self):
+        return self.after_date_as_of(None)
+
+    @property
+    def before_date(self):
+        return self.before_date_as_of(None)
+
+    def after_date_as_of(self, as_of: datetime = None):
+        return (as_of or datetime.today()) - timedelta(days=self.after) if self.after else None
+
+    def before_date_as_of(self, as_of: datetime = None):
+        return (as_of or datetime.today()) - timedelta(days=self.before) if self.before else None
+
+    def apply(self, values, as_of: datetime = None):
+        """Filters `values` (newest first `vlist` or `vcolumns`): date window by binary search,
+        then the value expression over the window, then `upper` (newest n) or `lower` (oldest n).
+        Day offsets are counted back from `as_of`, today if not given.
+        Returns values of the same store, newest first."""
+
+        from primitives.vcolumns import vcolumns
+        from primitives.vlist import vlist
+        columnar = isinstance(values, vcolumns)
+
+        # dates descend with the index; the window is a contiguous range
+        if columnar:
+            stamps = values.timestamps
+            key = lambda cutoff: values.micros(cutoff)
+            date_at = lambda i: stamps[i]
+        else:
+            key = local_naive
+            date_at = lambda i: local_naive(values[i].date.dt)
+        lo, hi = 0, len(values)
+        if self.before:
+            cutoff = key(self.before_date_as_of(as_of))
+            lo = _partition_point(lo, hi, lambda i: date_at(i) > cutoff)
+        if self.after:
+            cutoff = key(self.after_date_as_of(as_of))
+            hi = _partition_point(lo, hi, lambda i: date_at(i) >= cutoff)
+
+        indexes = range(lo, hi)
+        if self.value_expression:
+            comparison = self.compiled_comparison
+            if comparison:
+                op, number = comparison
+                window = values.numbers[lo:hi] if columnar else [v.value for v in values[lo:hi]]
+                indexes = list(compress(indexes, map(op, window, repeat(number))))
+            else:
+                expression = self.compiled_value_expression
+                indexes = [i for i in indexes if expression.evaluate({'value': values[i].value})]
+
+        if self.upper:
+            indexes = indexes[:int(self.upper)]
+        elif self.lower:
+            indexes = indexes[-int(self.lower):]
+
+        if columnar:
+            return values.take(indexes)
+        if isinstance(indexes, range) and isinstance(values, vlist):
+            return values.view(indexes.start, indexes.stop)
+        return vlist([values[i] for i in indexes], presorted=True)
+
+
+_COMPARISON = re.compile(r'^\s*(<=|>=|==|!=|<|>)\s*(-?\d+(?:\.\d+)?)\s*$')
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+
+def _partition_point(lo: int, hi: int, predicate) -> int:
+    """First index in [lo, hi) where `predicate` is False; it must be True for a prefix and False after"""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if predicate(mid):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def natural_date(value, as_of: datetime = None) -> str:
+    """`humanize.naturaldate` relative to `as_of` instead of today"""
+    if as_of is None:
+        return humanize.naturaldate(value)
+    delta = (value.date() if isinstance(value, datetime) else value) - as_of.date()
+    if delta.days == 0:
+        return 'today'
+    if delta.days == 1:
+        return 'tomorrow'
+    if delta.days == -1:
+        return 'yesterday'
+    return value.strftime('%b %d %Y' if abs(delta.days) >= 5 * 365 / 12 else '%b %d')
+
 
 @dataclass(frozen=True)
 class Narrative:
@@ -80,19 +189,20 @@ class Narrative:
         else:
             return None
 
-    def get_compliance_text(self, for_value: bool, persona: Persona = Persona.patient, sanitization_dict: dict = None):
+    def get_compliance_text(self, for_value: bool, persona: Persona = Persona.patient, sanitization_dict: dict = None, as_of: datetime = None):
 
         if for_value is None or self._compliance_dict is None:
             return None
 
-        return self.__get_text(self._compliance_dict, for_value, persona, sanitization_dict)
+        return self.__get_text(self._compliance_dict, for_value, persona, sanitization_dict, as_of)
 
-    def get_text(self, for_value: Any, persona: Persona = Persona.patient, sanitization_dict: dict = None, default = None):
+    def get_text(self, for_value: Any, persona: Persona = Persona.patient, sanitization_dict: dict = None, default = None, as_of: datetime = None):
+        """as_of: dates are phrased relative to it (today, yesterday..), today if not given"""
 
-        return self.__get_text(self.data or default, for_value, persona, sanitization_dict)
+        return self.__get_text(self.data or default, for_value, persona, sanitization_dict, as_of)
 
 
-    def __get_text(self, narrative_dict: dict, for_value: Any, persona: Persona = Persona.patient, sanitization_dict: dict = None):
+    def __get_text(self, narrative_dict: dict, for_value: Any, persona: Persona = Persona.patient, sanitization_dict: dict = None, as_of: datetime = None):
         
         text = None
         narrative_dict = narrative_dict.get(persona.value, None)
@@ -120,9 +230,9 @@ class Narrative:
                     split = n_var.split('.')
                     val = sanitization_dict.get(split[0], {}).get(split[1] if len(split) > 1 else 'value', '-n/a-')
                     if isinstance(val, datetime):
-                        val = humanize.naturaldate(val)
+                        val = natural_date(val, as_of)
                     if isinstance(val, ValueDate):
-                        val = humanize.naturaldate(val.date)
+                        val = natural_date(val.dt, as_of)
 
                     val = self.formatted_value(str(val)) if self.FORMAT_VALUE else str(val)
                     text = text.replace('$'+n_var, val)
@@ -161,13 +271,33 @@ class Var:
             return super().__eq__(__o)        
 
         if self.code and __o.code:
-            my_codes = set(map(lambda c: c.as_string, self.code))
-            right_codes = set(map(lambda c: c.as_string, __o.code))
-            matched = (len(list(my_codes & right_codes)) > 0)
-            return matched
+            return not self.code_ids.isdisjoint(__o.code_ids)
 
         return False
 
+    @cached_property
+    def code_ids(self) -> frozenset[int]:
+        """Integer ids of `code`, see `Code.code_id`"""
+        return frozenset(c.code_id for c in self.code or [])
+
+    def __getstate__(self):
+        # code ids are per process, see `Code.code_id`; they are taken again from `code` after loading
+        state = dict(self.__dict__)
+        state.pop('code_ids', None)
+        return state
+
+    @cached_property
+    def plausible_validator(self):
+        if self.validator and 'plausible' in self.validator:
+            return ValidationExpression(self.validator['plausible'])
+        return None
+
+    @cached_property
+    def panel_validator(self):
+        if self.validator and 'panel' in self.validator:
+            return EvaluatorString(self.validator['panel'])
+        return None
+
     @cached_property
     def value_type(self):
         if not self.type: 
@@ -240,13 +370,15 @@ class Var:
     def Age():
         from ontology.codes import Concord_Code_Age, CodeSystemType
         return Var(id=Concord_Code_Age, 
-                   code=[Code(Concord_Code_Age,CodeSystemType.concord.value,Concord_Code_Age)]
+                   code=[Code(Concord_Code_Age,CodeSystemType.concord.value,Concord_Code_Age)],
+                   category=VarType.demographics
                 )
     @staticmethod 
     def Gender():
         from ontology.codes import Concord_Code_Gender, CodeSystemType
         return Var(id=Concord_Code_Gender, 
-                    code=[Code(Concord_Code_Gender,CodeSystemType.concord.value,Concord_Code_Gender)]
+                    code=[Code(Concord_Code_Gender,CodeSystemType.concord.value,Concord_Code_Gender)],
+                    category=VarType.demographics
                 )
 
     
@@ -254,7 +386,8 @@ class Var:
     def RaceEthnicity():
         from ontology.codes import Concord_Code_Ethnicity, CodeSystemType
         return Var(id=Concord_Code_Ethnicity, 
-                    code=[Code(Concord_Code_Ethnicity,CodeSystemType.concord.value,Concord_Code_Ethnicity)]
+                    code=[Code(Concord_Code_Ethnicity,CodeSystemType.concord.value,Concord_Code_Ethnicity)],
+                    category=VarType.demographics
                 )
 
 